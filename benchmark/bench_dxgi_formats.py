@@ -0,0 +1,130 @@
+# Conformance and speed matrix of the DXGI format codecs in ys8/lib_fmtibvb.py.  For every format it checks
+# that encoding what was decoded gives back the same bytes (for every vector that has an exact
+# representation: no NaN, and no SNORM minimum, which decodes below -1), that values survive an encode /
+# decode round trip to within half a step of the format, and that the NumPy column codecs agree with the
+# vector codecs.  Components are checked in memory order, and for BGR(A) formats also in RGBA order
+# (swizzle = True), which must be the same values reordered and encode back to the same bytes.  It also reports vectors/sec for each codec.  Exits with status 1 if a format fails.
+#
+# Usage: python bench_dxgi_formats.py [--vectors 20000] [--repeat 3] [--big-endian]
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import os, sys, time, random, argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ys8'))
+from lib_fmtibvb import *
+
+formats = ['R32G32B32A32_FLOAT', 'R32G32B32_FLOAT', 'R16G16B16A16_FLOAT', 'R16G16_FLOAT', 'R8G8B8A8_UNORM',\
+    'R8G8B8A8_SNORM', 'R16G16B16A16_UNORM', 'R16G16_SNORM', 'R8G8B8A8_UINT', 'R16G16B16A16_SINT', 'R32_UINT',\
+    'B8G8R8A8_UNORM', 'B8G8R8X8_UNORM', 'R10G10B10A2_UNORM', 'R10G10B10A2_UINT', 'R11G11B10_FLOAT',\
+    'D24_UNORM_S8_UINT', 'B5G6R5_UNORM', 'B5G5R5A1_UNORM', 'B4G4R4A4_UNORM']
+
+def component_types(codec):
+    # (numtype, bits) of each component of a codec
+    if codec['fields'] is not None:
+        return([(x[2], x[1].bit_length()) for x in codec['fields']])
+    return([(codec['numtype'], codec['bits'])] * codec['components'])
+
+def random_value(numtype, bits):
+    # A random value that the component can hold, and how far from it the decoded value may be
+    if numtype == 'UNORM':
+        return(random.random(), 0.5 / ((2**bits)-1))
+    if numtype == 'SNORM':
+        return(random.uniform(-1, 1), 0.5 / ((2**(bits-1))-1))
+    if numtype == 'UINT':
+        return(random.randrange(2**bits), 0)
+    if numtype == 'SINT':
+        return(random.randrange(-2**(bits-1), 2**(bits-1)), 0)
+    # Floats: 16- and 32-bit are signed with 10 and 23 bits of mantissa, the small floats unsigned with bits - 5
+    mantissa_bits = {32: 23, 16: 10}.get(bits, bits - 5)
+    value = random.uniform(0 if bits < 16 else -1000, 1000)
+    return(value, abs(value) * 2**-(mantissa_bits + 1))
+
+def exact(vector, types):
+    # True if the vector has a single encoding, so encoding it must give back the bytes it was decoded from
+    for x, (numtype, bits) in zip(vector, types):
+        if x != x or (numtype == 'SNORM' and x < -1):
+            return(False)
+    return(True)
+
+def same_values(a, b):
+    # True if two lists of vectors hold the same numbers (NaN matching NaN, 1.0 matching 1)
+    return(all([x == y or (x != x and y != y) for u, v in zip(a, b) for x, y in zip(u, v)]) and len(a) == len(b))
+
+def best_time(function, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return(best)
+
+def check_format(dxgi_format, vector_count, repeat, e):
+    # Returns (list of failures, {codec: vectors/sec})
+    stride = get_stride_from_dxgi_format(dxgi_format)
+    codec = dxgi_codec(stride, dxgi_format, e)
+    if codec['struct'] is None:
+        return(['not supported'], {})
+    types = component_types(codec)
+    failures = []
+    data = bytes([random.randrange(256) for x in range(vector_count * stride)])
+    vectors = [decode_dxgi_vector(codec, data, i * stride) for i in range(vector_count)]
+    encoded = encode_dxgi_column(codec, vectors)
+    exact_vectors = [i for i in range(vector_count) if exact(vectors[i], types)]
+    mismatches = [i for i in exact_vectors if encoded[i*stride:(i+1)*stride] != data[i*stride:(i+1)*stride]]
+    if len(mismatches) > 0:
+        failures.append('{0} vectors not encoded back to their bytes, e.g. {1}'.format(len(mismatches), data[mismatches[0]*stride:(mismatches[0]+1)*stride].hex()))
+    if b''.join([encode_dxgi_vector(codec, x) for x in vectors]) != encoded:
+        failures.append('vector and column encoders disagree')
+    # Values within the range of the format must come back within half a step
+    samples = [[random_value(numtype, bits) for numtype, bits in types] for i in range(vector_count)]
+    values = [[x[0] for x in sample] for sample in samples]
+    decoded = [decode_dxgi_vector(codec, encode_dxgi_vector(codec, x), 0) for x in values]
+    errors = [abs(decoded[i][j] - samples[i][j][0]) - samples[i][j][1] for i in range(vector_count) for j in range(len(types))]
+    if max(errors) > 1e-12:
+        failures.append('round trip error {0:.3g} more than half a step'.format(max(errors)))
+    if dxgi_format in rgba_dxgi_swizzles:
+        rgba_codec = dxgi_codec(stride, dxgi_format, e, swizzle = True)
+        rgba_vectors = [decode_dxgi_vector(rgba_codec, data, i * stride) for i in range(vector_count)]
+        if not same_values(rgba_vectors, [[x[j] for j in rgba_dxgi_swizzles[dxgi_format]] for x in vectors]):
+            failures.append('RGBA order is not the memory order reordered')
+        if encode_dxgi_column(rgba_codec, rgba_vectors) != encoded:
+            failures.append('RGBA order does not encode back to the same bytes')
+        if numpy is not None and not same_values(decode_dxgi_column(rgba_codec, numpy.frombuffer(data, dtype = rgba_codec['dtype'])).tolist(), rgba_vectors):
+            failures.append('NumPy and vector decoders disagree in RGBA order')
+    speeds = {'decode': vector_count / best_time(lambda: [decode_dxgi_vector(codec, data, i * stride) for i in range(vector_count)], repeat),\
+        'encode': vector_count / best_time(lambda: encode_dxgi_column(codec, vectors), repeat)}
+    if numpy is not None:
+        raw = numpy.frombuffer(data, dtype = codec['dtype'])
+        columns = decode_dxgi_column(codec, raw)
+        # NumPy keeps the payload of NaNs, which struct does not, so only vectors without them are compared
+        numpy_encoded = encode_dxgi_column(codec, columns)
+        if any([numpy_encoded[i*stride:(i+1)*stride] != encoded[i*stride:(i+1)*stride] for i in exact_vectors]):
+            failures.append('NumPy and vector encoders disagree')
+        if not same_values(columns.tolist(), vectors):
+            failures.append('NumPy and vector decoders disagree')
+        speeds['numpy decode'] = vector_count / best_time(lambda: decode_dxgi_column(codec, raw), repeat)
+        speeds['numpy encode'] = vector_count / best_time(lambda: encode_dxgi_column(codec, columns), repeat)
+    return(failures, speeds)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Check the DXGI format codecs of lib_fmtibvb.py and measure their speed.')
+    parser.add_argument('--vectors', type = int, default = 20000, help = 'vectors per format (default: 20000)')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs per codec, the best is reported (default: 3)')
+    parser.add_argument('--big-endian', action = 'store_true', help = 'check big endian buffers instead of little endian')
+    args = parser.parse_args()
+
+    random.seed(0)
+    columns = ['decode', 'encode'] + (['numpy decode', 'numpy encode'] if numpy is not None else [])
+    print('{0:20} {1:6} '.format('format', 'result') + ' '.join(['{0:>14}'.format(x) for x in columns]) + '  (vectors/sec)')
+    failed = 0
+    for dxgi_format in formats:
+        failures, speeds = check_format(dxgi_format, args.vectors, args.repeat, '>' if args.big_endian else '<')
+        print('{0:20} {1:6} '.format(dxgi_format, 'FAIL' if len(failures) > 0 else 'ok')\
+            + ' '.join(['{0:14,.0f}'.format(speeds[x]) if x in speeds else ' ' * 14 for x in columns]))
+        for failure in failures:
+            print('    ' + failure)
+        failed += 1 if len(failures) > 0 else 0
+    if failed > 0:
+        print(str(failed) + ' of ' + str(len(formats)) + ' formats failed.')
+        sys.exit(1)
@@ -0,0 +1,152 @@
+# Benchmark of the compiled DXGI codecs in ys8/lib_fmtibvb.py against the per-vector format parsing it used
+# before them.  Builds a synthetic vertex buffer in memory, reads and writes it both ways and reports
+# vertices/sec for each, plus reading and writing NumPy columns (read_vb_stream_columns) if NumPy is installed,
+# and reading only POSITION with the lazy reader (read_vb_element).
+#
+# Usage: python bench_fmtibvb.py [--vertices 100000] [--repeat 3]
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import os, io, re, sys, time, struct, random, argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ys8'))
+from lib_fmtibvb import *
+
+fmt_struct = {'stride': '40', 'format': 'DXGI_FORMAT_R16_UINT', 'elements': [\
+    {'SemanticName': 'POSITION', 'SemanticIndex': '0', 'Format': 'R32G32B32_FLOAT', 'AlignedByteOffset': '0'},\
+    {'SemanticName': 'NORMAL', 'SemanticIndex': '0', 'Format': 'R8G8B8A8_SNORM', 'AlignedByteOffset': '12'},\
+    {'SemanticName': 'TEXCOORD', 'SemanticIndex': '0', 'Format': 'R16G16_FLOAT', 'AlignedByteOffset': '16'},\
+    {'SemanticName': 'COLOR', 'SemanticIndex': '0', 'Format': 'R8G8B8A8_UNORM', 'AlignedByteOffset': '20'},\
+    {'SemanticName': 'BLENDWEIGHTS', 'SemanticIndex': '0', 'Format': 'R8G8B8A8_UNORM', 'AlignedByteOffset': '24'},\
+    {'SemanticName': 'BLENDINDICES', 'SemanticIndex': '0', 'Format': 'R16G16B16A16_UINT', 'AlignedByteOffset': '28'},\
+    {'SemanticName': 'TANGENT', 'SemanticIndex': '0', 'Format': 'R32_UINT', 'AlignedByteOffset': '36'}]}
+
+def make_vb(vertex_count):
+    # Random vertices in the layout above (finite floats and no SNORM -128, so that they survive a round trip)
+    random.seed(0)
+    vertices = []
+    for i in range(vertex_count):
+        vertices.append(struct.pack('<3f', random.random(), random.random(), random.random())\
+            + bytes([(random.randrange(255) + 129) % 256 for j in range(4)]) + struct.pack('<2e', random.random(), random.random())\
+            + bytes([random.randrange(256) for j in range(20)]))
+    return(b''.join(vertices))
+
+def legacy_format(stride, dxgi_format):
+    # The format parsing the old unpack_dxgi_vector / pack_dxgi_vector repeated for every vector
+    dxgi_format_split = dxgi_format.split('DXGI_FORMAT_')[-1].split('_')
+    vec_format = re.findall("[0-9]+",dxgi_format_split[0])
+    return(dxgi_format_split[1], int(vec_format[0]), len(vec_format))
+
+def legacy_unpack(f, stride, dxgi_format, e = '<'):
+    numtype, vec_bits, vec_elements = legacy_format(stride, dxgi_format)
+    code = {('FLOAT', 32): 'f', ('FLOAT', 16): 'e', ('UINT', 32): 'I', ('UINT', 16): 'H', ('UINT', 8): 'B',\
+        ('UNORM', 8): 'B', ('SNORM', 8): 'b'}[(numtype, vec_bits)]
+    read = list(struct.unpack(e+str(vec_elements)+code, f.read(stride)))
+    if numtype == 'UNORM':
+        float_max = ((2**vec_bits)-1)
+        for i in range(len(read)):
+            read[i] = read[i] / float_max
+    elif numtype == 'SNORM':
+        float_max = ((2**(vec_bits-1))-1)
+        for i in range(len(read)):
+            read[i] = read[i] / float_max
+    return(read)
+
+def legacy_pack(f, data, stride, dxgi_format, e = '<'):
+    numtype, vec_bits, vec_elements = legacy_format(stride, dxgi_format)
+    code = {('FLOAT', 32): 'f', ('FLOAT', 16): 'e', ('UINT', 32): 'I', ('UINT', 16): 'H', ('UINT', 8): 'B',\
+        ('UNORM', 8): 'B', ('SNORM', 8): 'b'}[(numtype, vec_bits)]
+    for i in range(vec_elements):
+        # One pack and one write per component
+        if numtype == 'UNORM':
+            f.write(struct.pack(e+code, int(round(min(max(data[i],0), 1) * ((2**vec_bits)-1)))))
+        elif numtype == 'SNORM':
+            f.write(struct.pack(e+code, int(round(min(max(data[i],-1), 1) * ((2**(vec_bits-1))-1)))))
+        else:
+            f.write(struct.pack(e+code, data[i]))
+    return
+
+def element_strides():
+    offsets = [int(x['AlignedByteOffset']) for x in fmt_struct['elements']] + [int(fmt_struct['stride'])]
+    return([offsets[i+1] - offsets[i] for i in range(len(offsets) - 1)])
+
+def legacy_read(vb_stream):
+    strides = element_strides()
+    vb_data = []
+    with io.BytesIO(vb_stream) as f:
+        for i in range(len(fmt_struct['elements'])):
+            element_buffer = []
+            for j in range(int(len(vb_stream) / int(fmt_struct['stride']))):
+                f.seek(j * int(fmt_struct['stride']) + int(fmt_struct['elements'][i]['AlignedByteOffset']))
+                element_buffer.append(legacy_unpack(f, strides[i], fmt_struct['elements'][i]['Format']))
+            vb_data.append({'Buffer': element_buffer})
+    return(vb_data)
+
+def legacy_write(vb_data):
+    strides = element_strides()
+    with io.BytesIO() as f:
+        for j in range(len(vb_data[0]['Buffer'])):
+            for i in range(len(fmt_struct['elements'])):
+                legacy_pack(f, vb_data[i]['Buffer'][j], strides[i], fmt_struct['elements'][i]['Format'])
+        return(f.getvalue())
+
+def codec_read(vb_stream):
+    return(read_vb_stream(vb_stream, fmt_struct))
+
+def codec_write(vb_data):
+    with io.BytesIO() as f:
+        write_vb_stream(vb_data, f, fmt_struct)
+        return(f.getvalue())
+
+def time_function(function, argument, repeat):
+    # Best of repeat runs, in seconds, and the last result
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return(best, result)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Compare the compiled DXGI codecs with the old per-vector format parsing.')
+    parser.add_argument('--vertices', type = int, default = 100000, help = 'vertices in the synthetic buffer (default: 100000)')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs per function, the best is reported (default: 3)')
+    args = parser.parse_args()
+
+    vb_stream = make_vb(args.vertices)
+    results = {}
+    outputs = {}
+    for name, function, argument in [('legacy read', legacy_read, vb_stream), ('codec read', codec_read, vb_stream)]:
+        seconds, outputs[name] = time_function(function, argument, args.repeat)
+        results[name] = args.vertices / seconds
+        print('{0:12} {1:12,.0f} vertices/sec'.format(name, results[name]))
+    if [x['Buffer'] for x in outputs['codec read']] != [x['Buffer'] for x in outputs['legacy read']]:
+        raise ValueError('Readers disagree on the vertex data')
+    if numpy is not None:
+        # The whole-buffer NumPy decode, without converting the columns to lists
+        seconds, columns = time_function(lambda x: read_vb_stream_columns(x, fmt_struct), vb_stream, args.repeat)
+        results['column read'] = args.vertices / seconds
+        print('{0:12} {1:12,.0f} vertices/sec'.format('column read', results['column read']))
+        if [x['Buffer'].tolist() for x in columns] != [x['Buffer'] for x in outputs['legacy read']]:
+            raise ValueError('Readers disagree on the vertex data')
+    # Only one element, as a tool after a bounding box would read it (a new reader each run, so nothing is cached)
+    seconds, positions = time_function(lambda x: read_vb_element(vb_reader(x, fmt_struct), 'POSITION', columns = False), vb_stream, args.repeat)
+    results['lazy element'] = args.vertices / seconds
+    print('{0:12} {1:12,.0f} vertices/sec'.format('lazy element', results['lazy element']))
+    if positions != outputs['legacy read'][0]['Buffer']:
+        raise ValueError('Readers disagree on the vertex data')
+    for name, function in [('legacy write', legacy_write), ('codec write', codec_write)]:
+        seconds, outputs[name] = time_function(function, outputs['codec read'], args.repeat)
+        results[name] = args.vertices / seconds
+        print('{0:12} {1:12,.0f} vertices/sec'.format(name, results[name]))
+    if outputs['codec write'] != outputs['legacy write'] or outputs['codec write'] != vb_stream:
+        raise ValueError('Writers disagree on the vertex buffer')
+    if numpy is not None:
+        # Writing the NumPy columns back, each encoded in one operation
+        seconds, output = time_function(codec_write, columns, args.repeat)
+        results['column write'] = args.vertices / seconds
+        print('{0:12} {1:12,.0f} vertices/sec'.format('column write', results['column write']))
+        if output != vb_stream:
+            raise ValueError('Writers disagree on the vertex buffer')
+    print('speedup      {0:.2f}x read, {1:.2f}x write'.format(results['codec read'] / results['legacy read'],\
+        results['codec write'] / results['legacy write']))
@@ -0,0 +1,43 @@
+# Compares the binary mesh cache of ys8/lib_fmtibvb.py (write_mesh_cache / read_mesh_cache) with the JSON
+# dumps of write_struct_to_json / read_struct_from_json.  Saves a synthetic mesh (the vertex layout of
+# bench_fmtibvb.py plus an index buffer) both ways and reports the file sizes and how long each takes to
+# write and load, checking that every copy loads back the same mesh.
+#
+# Usage: python bench_mesh_cache.py [--vertices 100000] [--repeat 3]
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import os, sys, random, argparse, tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ys8'))
+from lib_fmtibvb import *
+from bench_fmtibvb import fmt_struct, make_vb, time_function
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Compare the binary mesh cache of lib_fmtibvb.py with JSON dumps.')
+    parser.add_argument('--vertices', type = int, default = 100000, help = 'vertices in the synthetic mesh (default: 100000)')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs per function, the best is reported (default: 3)')
+    args = parser.parse_args()
+
+    vb_data = read_vb_stream(make_vb(args.vertices), fmt_struct)
+    ib_data = [[random.randrange(args.vertices) for j in range(3)] for i in range(args.vertices * 2)]
+    # 32-bit indices, as the default vertex count is more than a 16-bit index buffer can address
+    mesh = {'fmt': dict(fmt_struct, format = 'DXGI_FORMAT_R32_UINT'), 'vb': vb_data, 'ib': ib_data}
+    with tempfile.TemporaryDirectory() as folder:
+        json_file = os.path.join(folder, 'mesh.json')
+        cache_file = os.path.join(folder, 'mesh.meshbin')
+        tests = [('json write', lambda x: write_struct_to_json(x, json_file), mesh),\
+            ('cache write', lambda x: write_mesh_cache(x, cache_file), mesh),\
+            ('json read', read_struct_from_json, json_file),\
+            ('cache read', lambda x: read_mesh_cache(x, columns = False), cache_file)]
+        if numpy is not None:
+            tests.append(('column read', lambda x: read_mesh_cache(x, columns = True), cache_file))
+        for name, function, argument in tests:
+            seconds, result = time_function(function, argument, args.repeat)
+            print('{0:12} {1:10.3f} s'.format(name, seconds))
+            if name == 'column read':
+                result = {'fmt': result['fmt'], 'ib': result['ib'].tolist(),\
+                    'vb': [dict(x, Buffer = x['Buffer'].tolist()) for x in result['vb']]}
+            if name.endswith('read') and result != mesh:
+                raise ValueError(name + ' did not load the mesh that was saved')
+        json_size, cache_size = os.path.getsize(json_file), os.path.getsize(cache_file)
+        print('json {0:,} bytes, cache {1:,} bytes ({2:.1f}x smaller)'.format(json_size, cache_size, json_size / cache_size))
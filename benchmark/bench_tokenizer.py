@@ -0,0 +1,60 @@
+# Benchmark of lib_dumptokenizer against the per-line parsing the merge scripts used before it.  Builds a
+# synthetic 3dmigoto text dump in memory and reports lines/sec for each parser.
+#
+# Usage: python bench_tokenizer.py [--vertices 200000] [--repeat 3]
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import os, sys, time, argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib_dumptokenizer import *
+
+def make_dump(vertex_count):
+    # Position, normal, texcoord and blend indices per vertex, as 3dmigoto writes them (CRLF line endings)
+    lines = [b'stride: 48', b'first vertex: 0', b'vertex count: ' + str(vertex_count).encode(),\
+        b'topology: trianglelist', b'', b'vertex-data:', b'']
+    for i in range(vertex_count):
+        x = str((i % 1000) / 1000).encode()
+        lines.append(b'vb0[' + str(i).encode() + b']+000 POSITION: ' + x + b', 0.25, -1.5')
+        lines.append(b'vb0[' + str(i).encode() + b']+012 NORMAL: 0, 1, 0')
+        lines.append(b'vb0[' + str(i).encode() + b']+024 TEXCOORD: ' + x + b', 0.5')
+        lines.append(b'vb0[' + str(i).encode() + b']+032 BLENDINDICES: 1, 2, 3, 4')
+        lines.append(b'')
+    return(b'\r\n'.join(lines) + b'\r\n', vertex_count * 4)
+
+def legacy_parse(data):
+    # The old vb_merge.py loop: decode every line, then split it several times
+    records = []
+    for line in data.decode().split('\n'):
+        if line[0:2] == 'vb':
+            vertex_num, vertex_offset = [int(x) for x in line[4:].split(' ')[0].split(']+')]
+            records.append((vertex_num, vertex_offset, line.split(': ')[0].split(' ')[1], line.split(': ')[1].strip()))
+    return(records)
+
+def tokenizer_parse(data):
+    return(list(tokenize(data, split_header(data)[1])))
+
+def time_parser(parser, data, repeat):
+    # Best of repeat runs, in seconds
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        parser(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return(best)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Compare the dump tokenizer with the old per-line parsing.')
+    parser.add_argument('--vertices', type = int, default = 200000, help = 'vertices in the synthetic dump (default: 200000)')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs per parser, the best is reported (default: 3)')
+    args = parser.parse_args()
+
+    data, line_count = make_dump(args.vertices)
+    if len(legacy_parse(data)) != line_count or len(tokenizer_parse(data)) != line_count:
+        raise ValueError('Parsers disagree on the number of vertex data lines')
+    results = {}
+    for name, parse in [('per-line split', legacy_parse), ('tokenizer', tokenizer_parse)]:
+        results[name] = line_count / time_parser(parse, data, args.repeat)
+        print('{0:16} {1:12,.0f} lines/sec'.format(name, results[name]))
+    print('speedup          {0:.2f}x'.format(results['tokenizer'] / results['per-line split']))
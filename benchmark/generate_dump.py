@@ -0,0 +1,158 @@
+# Synthetic frame dump generator for the benchmarks.  Writes 3dmigoto text frame dumps (for the merge
+# scripts) or Blender style .fmt / .ib / .vb exports (for the split scripts) with random but deterministic
+# contents: the same layout, counts and seed always produce the same files.
+#
+# Usage: python generate_dump.py output_folder [--layout tocs4] [--draw-calls 10] [--vertices 5000] [--export]
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import os, sys, json, struct, random, argparse
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib_dumpbuf import dxgi_struct_format, stride_from_format, semantic_of
+
+# Each element is (SemanticName, SemanticIndex, Format, InputSlot, AlignedByteOffset)
+layouts = {
+    'single': [('POSITION', 0, 'R32G32B32_FLOAT', 0, 0), ('NORMAL', 0, 'R32G32B32_FLOAT', 0, 12),\
+        ('TEXCOORD', 0, 'R32G32_FLOAT', 0, 24), ('COLOR', 0, 'R8G8B8A8_UNORM', 0, 32)],
+    'tocs4': [('POSITION', 0, 'R32G32B32_FLOAT', 0, 0), ('NORMAL', 0, 'R32G32B32_FLOAT', 1, 0),\
+        ('TEXCOORD', 0, 'R32G32_FLOAT', 2, 0), ('TEXCOORD', 1, 'R32G32_FLOAT', 2, 8),\
+        ('BLENDWEIGHTS', 0, 'R32G32B32A32_FLOAT', 3, 0), ('BLENDINDICES', 0, 'R32G32B32A32_UINT', 4, 0)],
+    'kuro': [('POSITION', 0, 'R32G32B32_FLOAT', 0, 0), ('NORMAL', 0, 'R32G32B32_FLOAT', 1, 0),\
+        ('TANGENT', 0, 'R32G32B32_FLOAT', 2, 0), ('COLOR', 0, 'R32G32B32A32_FLOAT', 3, 0),\
+        ('TEXCOORD', 0, 'R32G32_FLOAT', 4, 0), ('TEXCOORD', 1, 'R32G32_FLOAT', 5, 0),\
+        ('BLENDWEIGHTS', 0, 'R32G32B32A32_FLOAT', 6, 0), ('BLENDINDICES', 0, 'R32G32B32A32_UINT', 7, 0)],
+    'ys8': [('POSITION', 0, 'R32G32B32A32_FLOAT', 0, 0), ('TEXCOORD', 0, 'R32G32B32A32_FLOAT', 0, 16),\
+        ('NORMAL', 0, 'R8G8B8A8_SNORM', 0, 32), ('TANGENT', 0, 'R8G8B8A8_SNORM', 0, 36),\
+        ('COLOR', 0, 'R8G8B8A8_UNORM', 0, 40), ('COLOR', 1, 'R8G8B8A8_UNORM', 0, 44),\
+        ('TEXCOORD', 1, 'R32G32B32A32_FLOAT', 0, 48), ('TEXCOORD', 2, 'R32G32B32A32_FLOAT', 0, 64),\
+        ('BLENDWEIGHTS', 0, 'R8G8B8A8_UNORM', 0, 80), ('BLENDINDICES', 0, 'R8G8B8A8_UINT', 0, 84)],
+}
+ib_formats = {'single': 'DXGI_FORMAT_R16_UINT', 'tocs4': 'DXGI_FORMAT_R16_UINT', 'kuro': 'DXGI_FORMAT_R16_UINT',\
+    'ys8': 'DXGI_FORMAT_R32_UINT'}
+
+def layout_elements(layout):
+    return([{'SemanticName': x[0], 'SemanticIndex': x[1], 'Format': x[2], 'InputSlot': x[3],\
+        'AlignedByteOffset': x[4], 'InputSlotClass': 'per-vertex', 'InstanceDataStepRate': 0} for x in layouts[layout]])
+
+def slot_strides(elements):
+    # Stride of each slot: the end of its last element
+    strides = [0] * (max([x['InputSlot'] for x in elements]) + 1)
+    for element in elements:
+        strides[element['InputSlot']] = max(strides[element['InputSlot']],\
+            element['AlignedByteOffset'] + stride_from_format(element['Format']))
+    return(strides)
+
+def random_values(rng, dxgi_format):
+    # Raw component values for one element: floats, or integers as they are stored (before normalisation)
+    num_components, code, scale = dxgi_struct_format(dxgi_format)
+    if code in 'fe':
+        return([round(rng.uniform(-1, 1), 6) for x in range(num_components)])
+    elif scale is not None and code in 'bhi':
+        return([rng.randint(-scale, scale) for x in range(num_components)])
+    elif scale is not None:
+        return([rng.randint(0, scale) for x in range(num_components)])
+    return([rng.randint(0, 60) for x in range(num_components)])
+
+def text_values(values, dxgi_format):
+    num_components, code, scale = dxgi_struct_format(dxgi_format)
+    if scale is not None:
+        return(', '.join(['%.9g' % (x / scale) for x in values]))
+    return(', '.join(['%.9g' % x if isinstance(x, float) else str(x) for x in values]))
+
+def random_mesh(rng, elements, vertex_count):
+    # {element number: [values for each vertex]}, and a triangle list covering every vertex
+    vertices = {i: [random_values(rng, elements[i]['Format']) for j in range(vertex_count)] for i in range(len(elements))}
+    triangles = [[rng.randrange(vertex_count) for x in range(3)] for y in range(vertex_count // 3)]
+    return(vertices, triangles)
+
+def make_text_header(stride, vertex_count, elements):
+    header = 'stride: {0}\nfirst vertex: 0\nvertex count: {1}\ntopology: trianglelist\n'.format(stride, vertex_count)
+    for i in range(len(elements)):
+        header += 'element[' + str(i) + ']:\n'
+        for key in elements[i]:
+            header += '  ' + key + ': ' + str(elements[i][key]) + '\n'
+    return(header + '\nvertex-data:\n\n')
+
+def write_text_dump(dirname, layout = 'tocs4', draw_calls = 10, vertex_count = 5000, seed = 0):
+    # Write a 3dmigoto text frame dump (one ib file and one vb file per slot, per draw call).  Returns the
+    # number of vertices written.
+    rng = random.Random(seed)
+    elements = layout_elements(layout)
+    strides = slot_strides(elements)
+    os.makedirs(dirname, exist_ok = True)
+    for draw_call in range(draw_calls):
+        vertices, triangles = random_mesh(rng, elements, vertex_count)
+        shaders = 'vs={0:016x}-ps={1:016x}'.format(rng.getrandbits(64), rng.getrandbits(64))
+        ib_text = 'byte offset: 0\nfirst index: 0\nindex count: {0}\ntopology: trianglelist\nformat: {1}\n\n'.format(\
+            len(triangles) * 3, ib_formats[layout]) + ''.join([' '.join(map(str, x)) + '\n' for x in triangles])
+        with open(os.path.join(dirname, '{0:06d}-ib={1:08x}-{2}.txt'.format(draw_call, rng.getrandbits(32), shaders)), 'wb') as f:
+            f.write(ib_text.replace('\n', '\r\n').encode())
+        for slot in range(len(strides)):
+            slot_elements = [i for i in range(len(elements)) if elements[i]['InputSlot'] == slot]
+            lines = [make_text_header(strides[slot], vertex_count, elements)]
+            for vertex in range(vertex_count):
+                for i in slot_elements:
+                    lines.append('vb{0}[{1}]+{2:03d} {3}: {4}\n'.format(slot, vertex, elements[i]['AlignedByteOffset'],\
+                        semantic_of(elements[i]), text_values(vertices[i][vertex], elements[i]['Format'])))
+                lines.append('\n')
+            with open(os.path.join(dirname, '{0:06d}-vb{1}={2:08x}-{3}.txt'.format(draw_call, slot, rng.getrandbits(32), shaders)), 'wb') as f:
+                f.write(''.join(lines).replace('\n', '\r\n').encode())
+    return(draw_calls * vertex_count)
+
+def write_export(dirname, layout = 'tocs4', meshes = 10, vertex_count = 5000, seed = 0):
+    # Write Blender style exports (.fmt, .ib and an interleaved .vb per mesh, plus .splitdata for layouts with
+    # more than one slot per element group).  Returns the number of vertices written.
+    rng = random.Random(seed)
+    elements = layout_elements(layout)
+    strides = slot_strides(elements)
+    combined_stride = sum(strides)
+    merged_elements = []
+    for element in elements:
+        merged_element = dict(element)
+        merged_element['AlignedByteOffset'] += sum(strides[0:element['InputSlot']])
+        merged_element['InputSlot'] = 0
+        merged_elements.append(merged_element)
+    _, ib_code, _ = dxgi_struct_format(ib_formats[layout])
+    os.makedirs(dirname, exist_ok = True)
+    for mesh in range(meshes):
+        vertices, triangles = random_mesh(rng, elements, vertex_count)
+        meshname = os.path.join(dirname, '{0:06d}'.format(mesh))
+        fmt_text = 'stride: {0}\ntopology: trianglelist\nformat: {1}\n'.format(combined_stride, ib_formats[layout])
+        for i in range(len(merged_elements)):
+            fmt_text += 'element[' + str(i) + ']:\n'
+            for key in merged_elements[i]:
+                fmt_text += '  ' + key + ': ' + str(merged_elements[i][key]) + '\n'
+        with open(meshname + '.fmt', 'w') as f:
+            f.write(fmt_text)
+        indices = [x for triangle in triangles for x in triangle]
+        with open(meshname + '.ib', 'wb') as f:
+            f.write(struct.pack('<' + str(len(indices)) + ib_code, *indices))
+        vb_data = bytearray(vertex_count * combined_stride)
+        for i in range(len(merged_elements)):
+            num_components, code, scale = dxgi_struct_format(merged_elements[i]['Format'])
+            element_struct = struct.Struct('<' + str(num_components) + code)
+            for vertex in range(vertex_count):
+                element_struct.pack_into(vb_data, vertex * combined_stride + merged_elements[i]['AlignedByteOffset'],\
+                    *vertices[i][vertex])
+        with open(meshname + '.vb', 'wb') as f:
+            f.write(vb_data)
+        if len(strides) < len(elements):
+            with open(meshname + '.splitdata', 'w') as f:
+                f.write(json.dumps(strides))
+    return(meshes * vertex_count)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Write a deterministic synthetic frame dump or Blender export.')
+    parser.add_argument('folder', help = 'folder to write the files to (created if needed)')
+    parser.add_argument('--layout', choices = sorted(layouts.keys()), default = 'tocs4',\
+        help = 'vertex buffer layout: single (one slot), tocs4 (5 slots), kuro (8 slots) or ys8 (stride 88) (default: tocs4)')
+    parser.add_argument('--draw-calls', type = int, default = 10, help = 'draw calls (or meshes) to write (default: 10)')
+    parser.add_argument('--vertices', type = int, default = 5000, help = 'vertices per draw call (default: 5000)')
+    parser.add_argument('--seed', type = int, default = 0, help = 'random seed (default: 0)')
+    parser.add_argument('--export', action = 'store_true', help = 'write .fmt/.ib/.vb exports instead of a text frame dump')
+    args = parser.parse_args()
+
+    if args.export:
+        write_export(args.folder, args.layout, args.draw_calls, args.vertices, args.seed)
+    else:
+        write_text_dump(args.folder, args.layout, args.draw_calls, args.vertices, args.seed)
@@ -0,0 +1,198 @@
+# Benchmark runner for the merge and split scripts.  Each pipeline runs on a fresh copy of a synthetic dump
+# (see generate_dump.py), and the wall time, vertices/sec, MB/s of input and peak memory (RSS) of the
+# script are reported and saved as JSON.  The outputs are hashed, so a run can be checked byte for byte
+# against another checkout of the scripts (--reference) or against the hashes in an earlier results file
+# (--compare).  --jobs times vb_merge.py on the ToCS4 dump with each number of worker processes given, and
+# reports the speed-up and parallel efficiency of each against the first, to show how --jobs scales.
+#
+# Usage: python run_benchmarks.py [--vertices 5000] [--draw-calls 10] [--output results.json]
+#        python run_benchmarks.py --reference ../other_checkout --compare old_results.json
+#        python run_benchmarks.py --draw-calls 400 --vertices 2000 --jobs 1 2 4 8 16
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import os, sys, json, glob, time, shutil, hashlib, argparse, platform, tempfile, subprocess
+from generate_dump import write_text_dump, write_export
+
+repo_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Every script changes to its own folder and processes the files there, so the scripts (and the libraries
+# they need) are copied into the dump folder, as a user would.
+pipelines = [
+    {'name': 'vb_merge_single', 'script': 'vb_merge.py', 'layout': 'single', 'export': False, 'args': []},
+    {'name': 'vb_merge_tocs4', 'script': 'vb_merge.py', 'layout': 'tocs4', 'export': False, 'args': []},
+    {'name': 'vb_merge_tocs4_binary', 'script': 'vb_merge.py', 'layout': 'tocs4', 'export': False, 'args': ['--binary']},
+    {'name': 'vb_split_tocs4', 'script': 'vb_split.py', 'layout': 'tocs4', 'export': True, 'args': []},
+    {'name': 'kuro_vb_merge', 'script': 'kuro/kuro_vb_merge.py', 'layout': 'kuro', 'export': False, 'args': []},
+    {'name': 'kuro_vb_split', 'script': 'kuro/kuro_vb_split.py', 'layout': 'kuro', 'export': True, 'args': []},
+    {'name': 'vb_ys8dump', 'script': 'ys8/vb_ys8dump.py', 'layout': 'ys8', 'export': False, 'args': []},
+]
+
+def folder_digests(folder):
+    # {relative path: sha1} for every file under folder, except python caches and the merge manifest (which
+    # records file times)
+    digests = {}
+    for filename in glob.glob(os.path.join(folder, '**', '*'), recursive = True):
+        relative_name = os.path.relpath(filename, folder).replace(os.sep, '/')
+        if os.path.isdir(filename) or '__pycache__' in relative_name or relative_name.endswith('manifest.json'):
+            continue
+        with open(filename, 'rb') as f:
+            digests[relative_name] = hashlib.sha1(f.read()).hexdigest()
+    return(digests)
+
+def copy_scripts(source_folder, pipeline, folder):
+    shutil.copy2(os.path.join(source_folder, pipeline['script']), folder)
+    for filename in glob.glob(os.path.join(source_folder, 'lib_*.py')):
+        shutil.copy2(filename, folder)
+    for filename in glob.glob(os.path.join(source_folder, os.path.dirname(pipeline['script']), 'lib_*.py')):
+        shutil.copy2(filename, folder)
+    return
+
+def run_script(folder, script, args):
+    # Run a script in its folder.  Returns (seconds, peak RSS in MB or None where the platform cannot report it).
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, script] + args, cwd = folder, stdout = subprocess.DEVNULL)
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak_rss = usage.ru_maxrss / (1048576 if sys.platform == 'darwin' else 1024)
+        process.returncode = returncode # Already reaped, so Popen must not wait for it again
+    else:
+        returncode = process.wait()
+        elapsed = time.perf_counter() - start
+        peak_rss = None
+    if returncode != 0:
+        raise RuntimeError(script + ' exited with code ' + str(returncode))
+    return(elapsed, peak_rss)
+
+def run_pipeline(pipeline, input_folder, work_folder, source_folder, repeat):
+    # Best of repeat runs of one pipeline, each on a fresh copy of the input.  Returns ((seconds, peak RSS),
+    # {output file: sha1})
+    input_digests = folder_digests(input_folder)
+    best = None
+    for i in range(repeat):
+        folder = os.path.join(work_folder, 'run')
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        shutil.copytree(input_folder, folder)
+        copy_scripts(source_folder, pipeline, folder)
+        script_names = set(folder_digests(folder).keys()) - set(input_digests.keys())
+        elapsed, peak_rss = run_script(folder, os.path.basename(pipeline['script']), pipeline['args'])
+        if best is None or elapsed < best[0]:
+            best = (elapsed, peak_rss)
+    # Outputs are every file written or changed by the script (the Kuro merge also rewrites its input files)
+    digests = {x: y for x, y in folder_digests(folder).items() if not x in script_names and input_digests.get(x) != y}
+    shutil.rmtree(folder)
+    return(best, digests)
+
+def combined_digest(digests):
+    return(hashlib.sha1(json.dumps(digests, sort_keys = True).encode()).hexdigest())
+
+def input_folder_of(pipeline, work_folder, args):
+    # The synthetic dump a pipeline runs on, generated the first time it is needed
+    input_folder = os.path.join(work_folder, 'input_' + pipeline['layout'] + ('_export' if pipeline['export'] else ''))
+    if not os.path.exists(input_folder):
+        generator = write_export if pipeline['export'] else write_text_dump
+        generator(input_folder, pipeline['layout'], args.draw_calls, args.vertices, args.seed)
+    return(input_folder)
+
+def run_jobs_scaling(args, work_folder):
+    # Time vb_merge.py on the ToCS4 dump with each --jobs value in args.jobs.  Returns {jobs: result}, with the
+    # speed-up against the first value and the efficiency (speed-up / increase in workers; 100% is linear).
+    base_pipeline = [x for x in pipelines if x['name'] == 'vb_merge_tocs4'][0]
+    print('vb_merge.py --jobs scaling, {0} draw calls of {1} vertices, {2} CPUs'.format(args.draw_calls, args.vertices, os.cpu_count()))
+    scaling = {}
+    base = None
+    for jobs in args.jobs:
+        pipeline = dict(base_pipeline, name = 'vb_merge_tocs4_jobs' + str(jobs), args = ['--jobs', str(jobs)])
+        (elapsed, peak_rss), digests = run_pipeline(pipeline, input_folder_of(pipeline, work_folder, args), work_folder, repo_folder, args.repeat)
+        if base is None:
+            base = (jobs, elapsed, digests)
+        speedup = base[1] / elapsed
+        result = {'seconds': round(elapsed, 4), 'vertices_per_second': round(args.draw_calls * args.vertices / elapsed),\
+            'peak_rss_mb': None if peak_rss is None else round(peak_rss, 1), 'speedup': round(speedup, 3),\
+            'efficiency': round(speedup / (jobs / base[0]), 3), 'output_sha1': combined_digest(digests),\
+            'matches_first': digests == base[2]}
+        scaling[str(jobs)] = result
+        print('  --jobs {0:<5} {1:9.3f} s {2:12,} vertices/s {3:6.2f}x speed-up {4:6.0%} efficiency'.format(jobs, elapsed,\
+            result['vertices_per_second'], speedup, result['efficiency'])\
+            + ('' if result['matches_first'] else '   OUTPUT DIFFERS') + ('   (more jobs than CPUs)' if jobs > os.cpu_count() else ''))
+    return(scaling)
+
+def run_benchmarks(args):
+    results = {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),\
+        'draw_calls': args.draw_calls, 'vertices': args.vertices, 'seed': args.seed, 'repeat': args.repeat, 'pipelines': {}}
+    # With --jobs, the other pipelines only run if they are asked for
+    selected = [x for x in pipelines if (args.pipelines is None and args.jobs is None) or (args.pipelines is not None and x['name'] in args.pipelines)]
+    with tempfile.TemporaryDirectory() as work_folder:
+        for pipeline in selected:
+            input_folder = input_folder_of(pipeline, work_folder, args)
+            input_bytes = sum([os.path.getsize(x) for x in glob.glob(os.path.join(input_folder, '*'))])
+            (elapsed, peak_rss), digests = run_pipeline(pipeline, input_folder, work_folder, repo_folder, args.repeat)
+            result = {'seconds': round(elapsed, 4), 'vertices_per_second': round(args.draw_calls * args.vertices / elapsed),\
+                'mb_per_second': round(input_bytes / 1048576 / elapsed, 3), 'peak_rss_mb': None if peak_rss is None else round(peak_rss, 1),\
+                'input_bytes': input_bytes, 'output_files': len(digests), 'output_sha1': combined_digest(digests)}
+            if args.reference is not None:
+                _, reference_digests = run_pipeline(pipeline, input_folder, work_folder, args.reference, 1)
+                result['matches_reference'] = (reference_digests == digests)
+                if not result['matches_reference']:
+                    result['differing_files'] = sorted([x for x in set(digests.keys()) | set(reference_digests.keys())\
+                        if digests.get(x) != reference_digests.get(x)])
+            results['pipelines'][pipeline['name']] = result
+            print('{0:24} {1:9.3f} s {2:12,} vertices/s {3:9.2f} MB/s {4:>8} MB peak'.format(pipeline['name'], elapsed,\
+                result['vertices_per_second'], result['mb_per_second'], '-' if peak_rss is None else '{0:.1f}'.format(peak_rss))\
+                + ('' if not 'matches_reference' in result else ('   output matches' if result['matches_reference'] else '   OUTPUT DIFFERS')))
+        if args.jobs is not None:
+            results['jobs_scaling'] = run_jobs_scaling(args, work_folder)
+    return(results)
+
+def compare_results(results, old_results):
+    # Print the change in time against an earlier results file, and whether the outputs are the same.  Returns
+    # the names of the pipelines whose outputs differ.
+    differences = []
+    if [old_results.get(x) for x in ['draw_calls', 'vertices', 'seed']] != [results[x] for x in ['draw_calls', 'vertices', 'seed']]:
+        print('Earlier results used different dump settings, so only the times are compared.')
+        same_inputs = False
+    else:
+        same_inputs = True
+    for name in results['pipelines']:
+        if not name in old_results['pipelines']:
+            continue
+        old, new = old_results['pipelines'][name], results['pipelines'][name]
+        line = '{0:24} {1:+7.1%} time'.format(name, new['seconds'] / old['seconds'] - 1)
+        if same_inputs:
+            if old['output_sha1'] == new['output_sha1']:
+                line += '   output matches'
+            else:
+                line += '   OUTPUT DIFFERS'
+                differences.append(name)
+        print(line)
+    return(differences)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Benchmark the merge and split scripts on synthetic frame dumps.')
+    parser.add_argument('--draw-calls', type = int, default = 10, help = 'draw calls (or meshes) per dump (default: 10)')
+    parser.add_argument('--vertices', type = int, default = 5000, help = 'vertices per draw call (default: 5000)')
+    parser.add_argument('--seed', type = int, default = 0, help = 'random seed for the dumps (default: 0)')
+    parser.add_argument('--repeat', type = int, default = 1, help = 'runs per pipeline, the best is reported (default: 1)')
+    parser.add_argument('--pipelines', nargs = '+', choices = [x['name'] for x in pipelines], help = 'pipelines to run (default: all)')
+    parser.add_argument('--jobs', type = int, nargs = '+', metavar = 'N', help = 'time vb_merge.py with each of these --jobs values '\
+        + '(e.g. 1 2 4 8) to measure how it scales; other pipelines then only run if given with --pipelines')
+    parser.add_argument('--reference', help = 'another checkout of this repository whose scripts must give identical outputs')
+    parser.add_argument('--compare', help = 'earlier results file to compare times and outputs with')
+    parser.add_argument('--output', help = 'file to save the results to, as JSON')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent = 1))
+    failed = [x for x in results['pipelines'] if results['pipelines'][x].get('matches_reference') == False]
+    failed += ['--jobs ' + x for x in results.get('jobs_scaling', {}) if results['jobs_scaling'][x]['matches_first'] == False]
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            failed += compare_results(results, json.loads(f.read()))
+    if len(failed) > 0:
+        sys.exit(1)
@@ -1,42 +1,109 @@
 # Script to replace all draw commands with drawindexedinstanced = auto
 # commands.  This version of my script REQUIRES the custom build of
 # 3DMigoto that has drawindexedinstanced = auto implemented.
+# Each .ini file is rewritten in a single pass (CRLF or LF line endings),
+# and only if something changed, via a temporary file that is renamed into
+# place.  Use --dry-run to see what would change without writing anything.
 # GitHub eArmada8/vbuffer_merge_split
 
-import glob, os
+import glob, os, re, sys, traceback, tracemalloc, concurrent.futures, argparse
+# The shared lib_*.py modules live in the parent folder, unless they have been copied alongside this script
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib_outputcache import atomic_open
+from lib_stats import *
+
+draw_command = b'drawindexedinstanced = auto'
+# A drawindexed* command at the start of a line, up to (not including) the line ending, unless it is already
+# draw_command
+draw_command_re = re.compile(rb'(?<=\n)drawindexed(?!instanced = auto(?:[\r\n]|\Z))[^\r\n]*')
 
 def retrieve_ini_files():
     # Make a list of all ini in the current folder recursively
     return glob.glob('**/*.ini',recursive=True)
 
-def process_ini_file(ini_file):
-    # Open the file
-    with open(ini_file, 'rb') as f:
+def process_ini_file(ini_file, dry_run = False):
+    # Replace all the drawindexed* commands of one ini file.  Returns the number of lines changed; the file is
+    # written only if there are any, and never with dry_run.
+    with timed('parse'), open(ini_file, 'rb') as f:
         ini_filedata = f.read()
+    count('bytes_read', len(ini_filedata))
 
-    # Replace all the drawindexed* commands
-    changes_made = False
-    current_offset = ini_filedata.find(b'\x0adrawindexed')
-    while current_offset > 0:
-        line_end = ini_filedata.find(b'\x0d\x0a',current_offset)
-        ini_filedata = ini_filedata[:current_offset] + b'\x0adrawindexedinstanced = auto' + ini_filedata[line_end:]
-        current_offset = ini_filedata.find(b'\x0adrawindexed', current_offset + 1)
-        changes_made = True
+    with timed('replace'):
+        ini_filedata, lines_changed = draw_command_re.subn(draw_command, ini_filedata)
 
     # If any changes were made, write the new file
-    if changes_made == True:
-        with open(ini_file, 'wb') as f:
+    if lines_changed > 0 and dry_run == False:
+        with timed('write'), atomic_open(ini_file, 'wb') as f:
             f.write(ini_filedata)
+        count('bytes_written', len(ini_filedata))
+
+    return(lines_changed)
+
+def try_ini_file(ini_file, dry_run = False):
+    # process_ini_file, returning (lines changed, None) or (0, the error as a traceback) rather than raising,
+    # so that one unreadable file does not abort a whole mod tree
+    with stats_file(ini_file):
+        try:
+            return((process_ini_file(ini_file, dry_run), None))
+        except Exception:
+            return((0, traceback.format_exc()))
 
-    return(changes_made)
+def try_ini_file_with_stats(trace_memory, *arguments):
+    # try_ini_file for a worker process, collecting its stats to be merged into the main process' stats
+    start_stats(trace_memory)
+    result = try_ini_file(*arguments)
+    return((result, take_stats()))
+
+def process_ini_files(ini_files, jobs = 1, dry_run = False):
+    # Process every ini file, spreading them over a pool of worker processes if jobs > 1.  Returns a list of
+    # (lines changed, error or None), one for each file.
+    arguments = [ini_files, [dry_run] * len(ini_files)]
+    results = []
+    progress(0, len(ini_files))
+    if jobs > 1 and len(ini_files) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as executor:
+            chunksize = max(1, len(ini_files) // (jobs * 8))
+            if stats_enabled():
+                for result, worker_stats in executor.map(try_ini_file_with_stats, [tracemalloc.is_tracing()] * len(ini_files),\
+                        *arguments, chunksize = chunksize):
+                    merge_stats(worker_stats)
+                    results.append(result)
+                    progress(len(results), len(ini_files))
+            else:
+                results = list(executor.map(try_ini_file, *arguments, chunksize = chunksize))
+    else:
+        for result in map(try_ini_file, *arguments):
+            results.append(result)
+            progress(len(results), len(ini_files))
+    return(results)
 
 if __name__ == "__main__":
-    # Set current directory
-    os.chdir(os.path.abspath(os.path.dirname(__file__)))
+    parser = argparse.ArgumentParser(description = 'Replace every drawindexed* command in the .ini files of a mod with drawindexedinstanced = auto.')
+    parser.add_argument('folder', nargs = '?', help = 'folder to search for .ini files, with its subfolders (default: the folder this script is in)')
+    parser.add_argument('-j', '--jobs', type = int, default = 1, metavar = 'N', help = 'number of worker processes (0 = one per CPU)')
+    parser.add_argument('-n', '--dry-run', action = 'store_true', help = 'only report which files and how many lines would change')
+    add_stats_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented_run(args, 'kuro_replace_all_draw_commands.py'):
+        # Set current directory
+        os.chdir(os.path.abspath(args.folder) if args.folder is not None else os.path.abspath(os.path.dirname(__file__)))
 
-    # Retrieve ini files to process
-    ini_files = retrieve_ini_files()
+        # Retrieve ini files to process
+        with timed('scan'):
+            ini_files = retrieve_ini_files()
 
-    # Open each file, look for IB, and replace the draw command
-    for i in range(len(ini_files)):
-        process_ini_file(ini_files[i])
+        # Open each file, look for draw commands, and replace them
+        results = process_ini_files(ini_files, jobs = args.jobs if args.jobs > 0 else os.cpu_count(), dry_run = args.dry_run)
+        changed_files = [i for i in range(len(ini_files)) if results[i][0] > 0]
+        if args.dry_run == True:
+            for i in changed_files:
+                print(ini_files[i] + ': ' + str(results[i][0]) + ' line(s) would change')
+        print(str(len(changed_files)) + ' of ' + str(len(ini_files)) + ' .ini files ' + ('would change' if args.dry_run else 'changed')\
+            + ', ' + str(sum([x[0] for x in results])) + ' draw command(s) ' + ('would be ' if args.dry_run else '') + 'replaced.')
+        errors = [i for i in range(len(ini_files)) if results[i][1] is not None]
+        for i in errors:
+            sys.stderr.write('Error processing ' + ini_files[i] + ':\n' + results[i][1] + '\n')
+        if len(errors) > 0:
+            sys.stderr.write(str(len(errors)) + ' of ' + str(len(ini_files)) + ' .ini files could not be processed.\n')
+            sys.exit(1)
@@ -4,35 +4,47 @@
 # vb0-vb7 vertex buffers (8-part buffers).
 # GitHub eArmada8/vbuffer_merge_split
 
-import glob, os, re, shutil
+import os, re, sys, argparse
+# The shared lib_*.py modules live in the parent folder, unless they have been copied alongside this script
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib_dumpindex import *
+from lib_dumpbuf import open_buf, read_buf_vertex_groups
+from lib_dumptokenizer import split_header, tokenize_columns
+from lib_materialize import *
+from lib_stats import *
+from lib_fmtcache import *
 
-def retrieve_indices():
+def retrieve_indices(draw_calls = None):
     # Make a list of all vertex buffer indices in the current folder (only include 8-part vertex buffers)
     # NOTE: Will *not* include index buffers without vertex data! (i.e. ib files without corresponding vb files)
-    return(sorted([re.findall('^\d+', x)[0] for x in glob.glob('*-vb2*txt')]))
+    if draw_calls is None:
+        draw_calls = index_dump_directory('.')
+    return(filter_draw_calls(draw_calls, required_slot = 2))
 
-def copy_ib_file_to_output(fileindex):
+def copy_ib_file_to_output(fileindex, draw_call = None, materialize_method = 'hardlink'):
     # Copy the index buffer file to the output directory unmodified, if it exists
-    ib_filename = str(glob.glob(fileindex + '-ib*txt')[0])
-    if os.path.exists(ib_filename):
-        shutil.copy2(ib_filename, 'output/' + ib_filename)
+    if draw_call is None:
+        draw_call = index_dump_directory('.')[fileindex]
+    ib_filename = draw_call['ib']
+    if ib_filename is not None and os.path.exists(ib_filename):
+        materialize(ib_filename, 'output/' + ib_filename, materialize_method)
     return
 
 def stride_from_format(dxgi_format):
     return(int(sum([int(x) for x in re.findall("[0-9]+",dxgi_format)])/8))
 
 def remove_semantic_names (header):
-    new_header = b''
+    new_header = []
     current_offset = 0
     next_sem = 1
     while next_sem > 0:
         next_sem = header.find(b'SemanticName', current_offset)
         if next_sem > 0:
-            new_header += header[current_offset:next_sem] + b'SemanticName: UNKNOWN'
+            new_header.extend([header[current_offset:next_sem], b'SemanticName: UNKNOWN'])
             current_offset = header.find(b'SemanticIndex', next_sem) - 4
         else:
-            new_header += header[current_offset:len(header)]
-    return(new_header)
+            new_header.append(header[current_offset:len(header)])
+    return(b''.join(new_header))
 
 def guess_semantic_names (fmt_struct):
     for i in range(len(fmt_struct['elements'])):
@@ -66,6 +78,25 @@ def fix_strides (fmt_struct):
     return(fmt_struct)
 
 def read_fmt (header, combined_stride = True):
+    # Parse a dump header, with the semantic names guessed from the formats and, if combined_stride, the
+    # elements moved into one combined slot.  The element descriptions are the same in every slot file with
+    # the same input layout, so each layout is worked out once (both ways) and shared, read-only (see
+    # lib_fmtcache.py).
+    header_lines, element_lines = split_layout(header)
+    fmt_struct = parse_fmt(header_lines)
+    layout = cached_layout((element_lines, combined_stride), parse_layout, element_lines, combined_stride)
+    fmt_struct['elements'] = layout['elements']
+    if 'stride' in layout:
+        fmt_struct['stride'] = layout['stride']
+    return(fmt_struct)
+
+def parse_layout (element_lines, combined_stride = True):
+    fmt_struct = guess_semantic_names(parse_fmt(element_lines))
+    if combined_stride == True:
+        fmt_struct = fix_strides(fmt_struct)
+    return(fmt_struct)
+
+def parse_fmt (header):
     fmt_struct = {}
     headerlines = remove_semantic_names(header).decode('utf-8').strip().replace('\r','').split('\n')
     elements = []
@@ -84,11 +115,9 @@ def read_fmt (header, combined_stride = True):
                 fmt_struct[linekey] = lineval
             else:
                 element[linekey] = lineval
-    elements.append(element)
+    if element_num > -1:
+        elements.append(element)
     fmt_struct['elements'] = elements
-    fmt_struct = guess_semantic_names(fmt_struct)
-    if combined_stride == True:
-        fmt_struct = fix_strides(fmt_struct)
     return(fmt_struct)
 
 def make_header(fmt_struct):
@@ -105,78 +134,142 @@ def make_header(fmt_struct):
     header += '\nvertex-data:\n\n'
     return(header)
 
-def merge_vb_file_to_output(fileindex):
-    # Take all the vertex buffer files for one index buffer and merge them into a single vertex buffer file
-    # First, get a list of all the VB files
-    vb_filenames = sorted(glob.glob(fileindex + '-vb*txt'))
+def read_header(filename):
+    # Read a text dump header, up to (but not including) the vertex data, without reading the rest of the file
+    header = b''
+    with open(filename, 'rb') as f:
+        for line in f:
+            if line[0:11] == b'vertex-data':
+                break
+            header += line
+    return(header)
+
+def interleave_columns(columns, line_prefixes, vertex_count, separator = b'\x0d\x0a'):
+    # Interleave columns of values (one list per slot) into vertex data lines, in vertex order then slot order,
+    # for the first vertex_count vertices, with separator after every vertex.  Returns the list of lines.
+    # Line i of slot j is b'vb0[i]' + line_prefixes[j] + columns[j][i] + CRLF.  Slots that are short of
+    # vertex_count are skipped in the vertices they do not have.
+    lengths = [min(len(x), vertex_count) for x in columns]
+    complete = min(lengths) if len(lengths) > 0 else 0 # Vertices that every slot has
+    line_starts = [b'vb0[' + str(x).encode("utf8") + b']' for x in range(vertex_count)]
+    group_size = len(columns) + (1 if separator != b'' else 0)
+    #The complete vertices are filled in a slot at a time, each slot's lines going in every group_size'th place
+    lines = [None] * (complete * group_size)
+    for j in range(len(columns)):
+        line_prefix = line_prefixes[j]
+        lines[j::group_size] = [x + line_prefix + y + b'\x0d\x0a' for x, y in zip(line_starts[0:complete], columns[j])]
+    if separator != b'':
+        lines[len(columns)::group_size] = [separator] * complete
+    #Then the rest, a vertex at a time, with only the slots that are long enough
+    for i in range(complete, vertex_count):
+        lines.extend([line_starts[i] + line_prefixes[j] + columns[j][i] + b'\x0d\x0a' for j in range(len(columns)) if i < lengths[j]])
+        if separator != b'':
+            lines.append(separator)
+    return(lines)
 
-    #Get header for merged buffer
-    with open(vb_filenames[0], 'rb') as f:
-        filedata = f.read()
-        fmt = read_fmt(filedata[:filedata.find(b'vertex-data')], combined_stride = True)
-        del(filedata)
+def merge_vb_file_to_output(fileindex, draw_call = None, write_split = False):
+    # Take all the vertex buffer files for one index buffer and merge them into a single vertex buffer file.
+    # Each slot file is read once and the dump is left untouched.  With write_split, a cleaned-up copy of each
+    # text slot file (renumbered, with the guessed semantic names) is also written to output/split/, from the
+    # same pass.  Returns the files written.
+    if draw_call is None:
+        draw_call = index_dump_directory('.')[fileindex]
+    vb_filenames = vb_filenames_of(draw_call)
+    outputs = []
 
-    #Grab vertex data, file by file, into two dimensional list
+    #Get header for merged buffer.  The first file is also the first slot's vertex data, so it is kept until
+    #that slot has been read rather than being read again.
+    with timed('parse'), open(vb_filenames[0], 'rb') as f:
+        first_data = f.read()
+        first_header = split_header(first_data)[0]
+        fmt = read_fmt(first_header, combined_stride = True)
+
+    #Grab vertex data, file by file, into one column of values per slot, with the text that goes before the
+    #value on every line of that slot
     line_headers = [(x['SemanticName']+str(x['SemanticIndex'])).encode() if x['SemanticIndex'] > 0 else x['SemanticName'].encode() for x in fmt['elements']]
-    vertex_data = []
-    for i in range(len(vb_filenames)):
-        merged_vertex_file_data = []
-        split_vertex_file_data = []
-        with open(vb_filenames[i], 'rb') as f:
-            vb_data = f.read()
-            #Get header for split buffer
-            base_fmt = read_fmt(vb_data[:vb_data.find(b'vertex-data')], combined_stride = False)
-            current_index = 0
-            current_offset = vb_data.find(b'vertex-data', 0) # Jump to start of vertex data
-            while current_offset > 0:
-                try:
-                    current_offset = vb_data.find(b': ', vb_data.find(b'\x0d\x0a\x76\x62', current_offset + 1)) # Jump to next vertex
-                    next_offset = vb_data.find(b'\x0d\x0a', current_offset + 1)
-                    merged_vertex_file_data.append(b'vb0[' + str(current_index).encode("utf8") + b']+' \
-                    + str(fmt['elements'][i]['AlignedByteOffset']).zfill(3).encode("utf8") + b' ' + line_headers[i] + b': ' \
-                    + vb_data[current_offset:next_offset].split(b': ')[1] + b'\x0d\x0a')
-                    split_vertex_file_data.append(b'vb0[' + str(current_index).encode("utf8") + b']+' \
-                    + str(base_fmt['elements'][i]['AlignedByteOffset']).zfill(3).encode("utf8") + b' ' + line_headers[i] + b': ' \
-                    + vb_data[current_offset:next_offset].split(b': ')[1] + b'\x0d\x0a')
-                    current_index = current_index + 1
-                except IndexError:
-                    pass
+    columns = []
+    line_prefixes = []
+    slots = vb_slots_of(draw_call)
+    with timed('parse'):
+        for i in range(len(slots)):
+            line_prefixes.append(b'+' + str(fmt['elements'][i]['AlignedByteOffset']).zfill(3).encode("utf8") + b' ' + line_headers[i] + b': ')
+            if slots[i]['buf'] is not None:
+                #Binary dump: decode the memory-mapped buffer using the element layout from the text header
+                header_filename = slots[i]['txt'] if slots[i]['txt'] is not None else vb_filenames[0]
+                header = first_header if header_filename == vb_filenames[0] else read_header(header_filename)
+                base_fmt = read_fmt(header, combined_stride = False)
+                element = base_fmt['elements'][i]
+                if slots[i]['txt'] is not None:
+                    stride = int(header.split(b'stride: ')[1].split()[0])
+                else:
+                    stride = stride_from_format(element['Format'])
+                with open_buf(slots[i]['buf']) as buf:
+                    columns.append([group[element['AlignedByteOffset']][1] for vertex_num, slot, group\
+                        in read_buf_vertex_groups(buf, i, stride, [element])])
                 continue
-            vertex_data.append(merged_vertex_file_data)
-            fixed_buffer = b'\x0d\x0a'.join(split_vertex_file_data) + b'\x0d\x0a'
-            with open(vb_filenames[i], 'wb') as f:
-                f.write(make_header(base_fmt).encode()+fixed_buffer)
-
-    #Build vertex list in format expected by Blender plugin
-    vertex_output = bytearray()
-    for i in range(len(vertex_data[0])):
-        for j in range(len(vertex_data)):
-            try:
-                vertex_output.extend(vertex_data[j][i])
-            except IndexError:
-                pass
-            continue
-        #Blender plugin expects a blank line after every vertex group
-        vertex_output.extend(b'\x0d\x0a')
-
-    with open('output/' + vb_filenames[0], 'wb') as f:
-        f.write(make_header(fmt).encode()+vertex_output)
-    return
+            if slots[i]['txt'] == vb_filenames[0] and first_data is not None:
+                vb_data, first_data = first_data, None
+            else:
+                with open(slots[i]['txt'], 'rb') as f:
+                    vb_data = f.read()
+            #Get header for split buffer
+            header, vertex_data_offset = split_header(vb_data)
+            base_fmt = read_fmt(header, combined_stride = False)
+            #Each slot holds a single element, so every vertex data line is the next vertex
+            columns.append(tokenize_columns(vb_data, vertex_data_offset)['value'])
+            del(vb_data)
+            if write_split == True:
+                split_prefix = b'+' + str(base_fmt['elements'][i]['AlignedByteOffset']).zfill(3).encode("utf8") + b' ' + line_headers[i] + b': '
+                split_lines = interleave_columns([columns[i]], [split_prefix], len(columns[i]), separator = b'')
+                with timed('write'), open('output/split/' + slots[i]['txt'], 'wb') as f:
+                    f.write(make_header(base_fmt).encode())
+                    f.write(b'\x0d\x0a'.join(split_lines) + b'\x0d\x0a')
+                outputs.append('output/split/' + slots[i]['txt'])
+    first_data = None # Only still held if the first slot was read from a binary dump
+
+    with timed('merge'):
+        #Build vertex list in format expected by Blender plugin, with a blank line after every vertex group
+        vertex_output = b''.join(interleave_columns(columns, line_prefixes, len(columns[0])))
+    count('vertices', len(columns[0]))
+
+    with timed('write'), open('output/' + vb_filenames[0], 'wb') as f:
+        f.write(make_header(fmt).encode())
+        f.write(vertex_output)
+    outputs.append('output/' + vb_filenames[0])
+    return(outputs)
 
 # End of functions, begin main script
 
 if __name__ == "__main__":
-    # Set current directory
-    os.chdir(os.path.abspath(os.path.dirname(__file__)))
-
-    # Let's make an output directory, because otherwise we would have to delete / overwrite files
-    if not os.path.exists('output'): 
-        os.mkdir('output')
-
-    indices = retrieve_indices()
-    for i in range(len(indices)):
-        #print('Processing index ' + indices[i] + '...\n')
-        copy_ib_file_to_output(indices[i])
-        #print('  Copying IB file ' + indices[i] + '...\n')
-        merge_vb_file_to_output(indices[i])
-        #print('  Processing VB file ' + indices[i] + '...\n')
+    parser = argparse.ArgumentParser(description = 'Merge Kuro no Kiseki 8-slot vertex buffers in a 3dmigoto frame dump.')
+    add_filter_arguments(parser)
+    parser.add_argument('--write-split', action = 'store_true', help = 'also write a cleaned-up copy of each text slot file '\
+        + '(renumbered, with guessed semantic names) to output/split/; the dump itself is never modified')
+    add_materialize_argument(parser)
+    add_stats_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented_run(args, 'kuro_vb_merge.py'):
+        # Set current directory
+        os.chdir(os.path.abspath(os.path.dirname(__file__)))
+
+        # Let's make an output directory, because otherwise we would have to delete / overwrite files
+        if not os.path.exists('output'): 
+            os.mkdir('output')
+        if args.write_split == True and not os.path.exists('output/split'):
+            os.mkdir('output/split')
+
+        with timed('scan'):
+            draw_calls = index_dump_directory('.')
+        indices = filter_draw_calls_from_args(draw_calls, args, required_slot = 2)
+        for i in range(len(indices)):
+            with stats_file(indices[i]):
+                count_files('bytes_read', draw_call_filenames(draw_calls[indices[i]]))
+                #print('Processing index ' + indices[i] + '...\n')
+                with timed('write'):
+                    copy_ib_file_to_output(indices[i], draw_calls[indices[i]], args.materialize)
+                #print('  Copying IB file ' + indices[i] + '...\n')
+                outputs = merge_vb_file_to_output(indices[i], draw_calls[indices[i]], args.write_split)
+                #print('  Processing VB file ' + indices[i] + '...\n')
+                count_files('bytes_written', outputs + ['output/' + x for x in [draw_calls[indices[i]]['ib']] if x is not None])
+            progress(i + 1, len(indices))
@@ -6,7 +6,12 @@
 # with the drawindexedinstanced = auto command.
 # GitHub eArmada8/vbuffer_merge_split
 
-import glob, os, re
+import glob, os, re, contextlib, sys, argparse
+# The shared lib_*.py modules live in the parent folder, unless they have been copied alongside this script
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib_stats import *
+from lib_deinterleave import *
+from lib_dumpbuf import open_buf
 
 def retrieve_meshes():
     # Make a list of all mesh groups in the current folder, both fmt and vb files are necessary for processing
@@ -14,12 +19,13 @@ def retrieve_meshes():
     vbs = [x[:-3] for x in glob.glob('*vb')]
     return [value for value in fmts if value in vbs]
 
-def split_vb_file_and_make_ini_file(meshname):
-    #Take the raw combined buffer and split into individual raw buffers
+def split_vb_file_and_make_ini_file(meshname, stream = False, chunk_vertices = 65536):
+    #Take the raw combined buffer and split into individual raw buffers.  With stream, the combined buffer is
+    #memory-mapped and split chunk_vertices vertices at a time, so memory use does not depend on its size.
     
     #Determine the offsets used in the combined buffer by parsing the FMT file
     offsets = []
-    with open(meshname + '.fmt', 'r') as f:
+    with timed('parse'), open(meshname + '.fmt', 'r') as f:
         for line in f:
             if line[0:6] == 'stride':
                 combined_stride = int(line[8:-1])
@@ -40,21 +46,31 @@ def split_vb_file_and_make_ini_file(meshname):
         else:
             strides.append(offsets[i+1] - offsets[i])
     
-    #Read in the entire combined buffer
-    with open(meshname + '.vb', 'rb') as f:
-        vb_read_buffer = f.read()
-    
-    #Count the total number of vertices
-    vertex_count = int(len(vb_read_buffer)/combined_stride)
-    
-    #Write each individual vertex buffer file, one for each element
-    for vertex_group in range(len(strides)):
-        write_data = b''
-        for i in range(vertex_count):
-            start_index = i * combined_stride + offsets[vertex_group]
-            write_data = write_data + vb_read_buffer[start_index:start_index+strides[vertex_group]]
-        with open(meshname + '.vb' + str(vertex_group), 'wb') as f:
-            f.write(write_data)
+    if stream == True:
+        #Memory-map the combined buffer and write every individual vertex buffer file a chunk at a time
+        with timed('split'), open_buf(meshname + '.vb') as vb_read_buffer, contextlib.ExitStack() as stack:
+            count('bytes_read', len(vb_read_buffer))
+            vertex_count = int(len(vb_read_buffer)/combined_stride)
+            count('vertices', vertex_count)
+            vb_files = [stack.enter_context(open(meshname + '.vb' + str(vertex_group), 'wb')) for vertex_group in range(len(strides))]
+            count('bytes_written', deinterleave_to_files(vb_read_buffer, combined_stride, offsets, strides, vb_files, chunk_vertices, vertex_count))
+    else:
+        #Read in the entire combined buffer
+        with timed('parse'), open(meshname + '.vb', 'rb') as f:
+            vb_read_buffer = f.read()
+        count('bytes_read', len(vb_read_buffer))
+        
+        #Count the total number of vertices
+        vertex_count = int(len(vb_read_buffer)/combined_stride)
+        count('vertices', vertex_count)
+        
+        #Write each individual vertex buffer file, one for each element
+        for vertex_group in range(len(strides)):
+            with timed('split'):
+                write_data = deinterleave_slot(vb_read_buffer, combined_stride, offsets[vertex_group], strides[vertex_group], vertex_count)
+            with timed('write'), open(meshname + '.vb' + str(vertex_group), 'wb') as f:
+                f.write(write_data)
+            count('bytes_written', len(write_data))
     
     #Create the beginnings of an ini file
     ini_text = []
@@ -98,18 +114,30 @@ def split_vb_file_and_make_ini_file(meshname):
     
     #Write ini file
     if not os.path.exists(meshname + '.ini'):
-        with open(meshname + '.ini', 'w') as f:
+        with timed('write'), open(meshname + '.ini', 'w') as f:
             f.write("".join(ini_text))
+        count_files('bytes_written', [meshname + '.ini'])
         
     return
 
 # End of functions, begin main script
 
 if __name__ == "__main__":
-    # Set current directory
-    os.chdir(os.path.abspath(os.path.dirname(__file__)))
+    parser = argparse.ArgumentParser(description = 'Split Kuro no Kiseki Blender .vb exports into one buffer per element, with a starter .ini file.')
+    parser.add_argument('--stream', action = 'store_true', help = 'memory-map each .vb and split it a chunk at a time (for very large meshes)')
+    parser.add_argument('--chunk-vertices', type = int, default = 65536, metavar = 'N', help = 'vertices per chunk with --stream (default: 65536)')
+    add_stats_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented_run(args, 'kuro_vb_split.py'):
+        # Set current directory
+        os.chdir(os.path.abspath(os.path.dirname(__file__)))
 
-    meshes = retrieve_meshes()
-    for i in range(len(meshes)):
-        #print('Processing mesh ' + meshes[i] + '...\n')
-        split_vb_file_and_make_ini_file(meshes[i])
+        with timed('scan'):
+            meshes = retrieve_meshes()
+        for i in range(len(meshes)):
+            #print('Processing mesh ' + meshes[i] + '...\n')
+            with stats_file(meshes[i]):
+                count_files('bytes_read', [meshes[i] + '.fmt'])
+                split_vb_file_and_make_ini_file(meshes[i], args.stream, args.chunk_vertices)
+            progress(i + 1, len(meshes))
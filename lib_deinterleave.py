@@ -0,0 +1,71 @@
+# A small library to split an interleaved vertex buffer into separate buffers, one per input slot.  Each slot
+# is copied out of a strided view of the combined buffer in one pass: with NumPy if it is installed, or
+# otherwise with memoryview slices, one slice per lane of up to 8 bytes of the slot stride.  Works on bytes,
+# bytearray and mmap objects alike.  NumPy copies without holding the GIL, so with NumPy several slots or
+# meshes can be split at once on threads (see releases_gil); without it, use processes instead.
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# True if deinterleave_slot lets other python threads run while it copies
+releases_gil = numpy is not None
+
+def lane_format(*sizes):
+    # The widest memoryview format whose item size divides every size given, so each lane copies as many
+    # bytes as possible
+    for code, size in [('Q', 8), ('I', 4), ('H', 2)]:
+        if all([x % size == 0 for x in sizes]):
+            return(code, size)
+    return('B', 1)
+
+def deinterleave_slot(buffer, combined_stride, offset, stride, vertex_count = None):
+    # Returns one slot (stride bytes starting at offset of every vertex) of an interleaved buffer, as bytes or
+    # a bytearray
+    if vertex_count is None:
+        vertex_count = len(buffer) // combined_stride
+    if vertex_count == 0 or stride == 0:
+        return(b'')
+    if numpy is not None:
+        vertices = numpy.frombuffer(buffer, dtype = numpy.uint8, count = vertex_count * combined_stride)
+        slot_data = bytearray(vertex_count * stride)
+        # Assigning into an existing array (unlike tobytes) releases the GIL during the copy
+        numpy.frombuffer(slot_data, dtype = numpy.uint8).reshape(vertex_count, stride)[:] =\
+            vertices.reshape(vertex_count, combined_stride)[:, offset:offset + stride]
+        return(slot_data)
+    code, size = lane_format(combined_stride, offset, stride)
+    with memoryview(buffer) as view:
+        source = view[0:vertex_count * combined_stride].cast(code)
+        slot_data = bytearray(vertex_count * stride)
+        destination = memoryview(slot_data).cast(code)
+        for k in range(stride // size):
+            destination[k::stride // size] = source[offset // size + k::combined_stride // size]
+        destination.release()
+        source.release()
+    return(slot_data)
+
+def deinterleave(buffer, combined_stride, offsets, strides, vertex_count = None):
+    # Split an interleaved buffer into a list of slot buffers, given the offset and stride of each slot
+    return([deinterleave_slot(buffer, combined_stride, offsets[i], strides[i], vertex_count) for i in range(len(strides))])
+
+def deinterleave_to_files(buffer, combined_stride, offsets, strides, files, chunk_vertices = 65536, vertex_count = None):
+    # Write each slot of an interleaved buffer (e.g. a memory-mapped file) to its own file object, splitting
+    # chunk_vertices vertices at a time into every slot, so memory use is bounded by the chunk size rather
+    # than the size of the buffer.  Returns the number of bytes written.
+    if vertex_count is None:
+        vertex_count = len(buffer) // combined_stride
+    chunk_vertices = max(1, chunk_vertices)
+    bytes_written = 0
+    with memoryview(buffer) as view:
+        for chunk_start in range(0, vertex_count, chunk_vertices):
+            chunk_count = min(chunk_vertices, vertex_count - chunk_start)
+            with view[chunk_start * combined_stride:(chunk_start + chunk_count) * combined_stride] as chunk:
+                for i in range(len(files)):
+                    slot_data = deinterleave_slot(chunk, combined_stride, offsets[i], strides[i], chunk_count)
+                    files[i].write(slot_data)
+                    bytes_written += len(slot_data)
+                    del(slot_data)
+    return(bytes_written)
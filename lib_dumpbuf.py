@@ -0,0 +1,94 @@
+# A small library to read the binary (.buf) variant of 3dmigoto buffer dumps.  The files are memory-mapped
+# rather than read, and the layout (element formats and offsets) comes from the matching .txt dump header,
+# since the .buf files are raw buffer contents with no header of their own.
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import os, re, mmap, struct, contextlib
+
+@contextlib.contextmanager
+def open_buf(filename):
+    # Memory-map a .buf file read-only.  Empty files cannot be mapped, so they are returned as b''.
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield(b'')
+        else:
+            with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as buf:
+                yield(buf)
+
+def stride_from_format(dxgi_format):
+    return(int(sum([int(x) for x in re.findall("[0-9]+",dxgi_format)])/8))
+
+def dxgi_struct_format(dxgi_format):
+    # Returns (number of components, struct code, normalisation scale) for a format whose components are all
+    # the same size, e.g. R32G32B32_FLOAT -> (3, 'f', None) and R8G8B8A8_UNORM -> (4, 'B', 255)
+    dxgi_format_split = dxgi_format.split('DXGI_FORMAT_')[-1].split('_')
+    bits = re.findall("[0-9]+", dxgi_format_split[0])
+    codes = {('FLOAT', '32'): 'f', ('FLOAT', '16'): 'e', ('UINT', '32'): 'I', ('UINT', '16'): 'H', ('UINT', '8'): 'B',\
+        ('SINT', '32'): 'i', ('SINT', '16'): 'h', ('SINT', '8'): 'b', ('UNORM', '32'): 'I', ('UNORM', '16'): 'H',\
+        ('UNORM', '8'): 'B', ('SNORM', '32'): 'i', ('SNORM', '16'): 'h', ('SNORM', '8'): 'b'}
+    if len(dxgi_format_split) != 2 or len(bits) == 0 or len(set(bits)) != 1 or not (dxgi_format_split[1], bits[0]) in codes:
+        raise ValueError('Binary buffers do not support format ' + dxgi_format)
+    scale = None
+    if dxgi_format_split[1] == 'UNORM':
+        scale = 2**int(bits[0]) - 1
+    elif dxgi_format_split[1] == 'SNORM':
+        scale = 2**(int(bits[0]) - 1) - 1
+    return(len(bits), codes[(dxgi_format_split[1], bits[0])], scale)
+
+def semantic_of(element):
+    # The semantic as 3dmigoto prints it in text dumps, e.g. TEXCOORD1 (the index is left off when it is 0)
+    if int(element['SemanticIndex']) > 0:
+        return(element['SemanticName'] + str(element['SemanticIndex']))
+    return(element['SemanticName'])
+
+def slot_stride_from_elements(elements):
+    # Best guess at the stride of a slot that has no .txt header: the end of its last element
+    return(max([int(x['AlignedByteOffset']) + stride_from_format(x['Format']) for x in elements] + [0]))
+
+def slot_struct(elements, stride, e = '<'):
+    # Build one struct.Struct that unpacks a whole vertex of a slot, skipping padding.  elements must not share
+    # offsets.  Returns (Struct, [(position of the first value in the unpacked tuple, number of components,
+    # scale)] in the same order as elements).
+    order = sorted(range(len(elements)), key = lambda x: int(elements[x]['AlignedByteOffset']))
+    struct_format = e
+    position = 0
+    value_position = 0
+    columns = [None] * len(elements)
+    for i in order:
+        offset = int(elements[i]['AlignedByteOffset'])
+        num_components, code, scale = dxgi_struct_format(elements[i]['Format'])
+        if offset < position:
+            raise ValueError('Overlapping elements at offset ' + str(offset))
+        struct_format += str(offset - position) + 'x' + str(num_components) + code
+        position = offset + struct.calcsize(e + str(num_components) + code)
+        columns[i] = (value_position, num_components, scale)
+        value_position += num_components
+    if position > stride:
+        raise ValueError('Elements overrun the stride of ' + str(stride))
+    struct_format += str(stride - position) + 'x'
+    return(struct.Struct(struct_format), columns)
+
+def format_values(values, scale):
+    # Format decoded values the way 3dmigoto text dumps do, e.g. b'1, 0.5, 0'
+    if scale is not None:
+        return(', '.join(['%.9g' % (x / scale) for x in values]).encode())
+    return(', '.join(['%.9g' % x if isinstance(x, float) else str(x) for x in values]).encode())
+
+def read_buf_vertex_groups(buf, slot, stride, elements, chunk_vertices = 4096):
+    # Yield (vertex_num, slot, {offset: (semantic, value)}) for every vertex in a binary slot buffer, matching
+    # what the text dump tokenizer yields for the same data (semantic and value as bytes), with offsets in the
+    # order of elements.  elements must not share offsets.
+    vertex_struct, columns = slot_struct(elements, stride)
+    columns = [(int(elements[j]['AlignedByteOffset']), semantic_of(elements[j]).encode()) + columns[j] for j in range(len(elements))]
+    vertex_count = len(buf) // stride if stride > 0 else 0
+    vertex_num = 0
+    # Slices are taken a chunk at a time, so neither the whole buffer nor a view of the mmap is held
+    for chunk_start in range(0, vertex_count, chunk_vertices):
+        chunk_end = min(chunk_start + chunk_vertices, vertex_count)
+        for values in vertex_struct.iter_unpack(buf[chunk_start * stride:chunk_end * stride]):
+            group = {}
+            for offset, semantic, position, num_components, scale in columns:
+                group[offset] = (semantic, format_values(values[position:position + num_components], scale))
+            yield((vertex_num, slot, group))
+            vertex_num += 1
@@ -0,0 +1,126 @@
+# A small library to index a 3dmigoto frame dump directory in a single pass.  Every buffer filename is
+# parsed into its draw index, buffer type, input slot and shader / buffer hashes, so scripts can look up
+# the files for a draw call without globbing the directory again.
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import os, re
+
+# e.g. 000123-vb0=4121437a-vs=a4cbed5960571258-ps=8c1693fc42196c3d.txt (or .buf for binary dumps)
+dump_filename_re = re.compile(r'^(\d+)-(.+)\.(txt|buf)$')
+dump_hash_re = re.compile(r'^([a-z]+)(\d*)=(?:!\w!=)?([0-9a-fA-F]+)')
+
+def parse_dump_filename(filename):
+    # Returns a dict describing a frame dump buffer file, or None if the name is not a 3dmigoto buffer dump
+    match = dump_filename_re.match(filename)
+    if match is None:
+        return(None)
+    dump_file = {'index': match.group(1), 'filename': filename, 'extension': match.group(3),\
+        'buffer': None, 'slot': None, 'hashes': {}}
+    for part in match.group(2).split('-'):
+        part_match = dump_hash_re.match(part)
+        if part_match is None:
+            continue
+        key, slot, hash = part_match.groups()
+        if key in ['ib', 'vb'] and dump_file['buffer'] is None:
+            dump_file['buffer'] = key
+            if key == 'vb':
+                dump_file['slot'] = int(slot) if slot != '' else 0
+        dump_file['hashes'][key + slot] = hash.lower()
+    if dump_file['buffer'] is None:
+        return(None)
+    return(dump_file)
+
+def index_dump_directory(path = '.'):
+    # Scan the directory once and group every buffer file by draw index.  Each draw call is a dict:
+    # {'index': '000123', 'ib': filename or None, 'vb': {slot: filename}, 'hashes': {'ib': ..., 'vs': ...},
+    # 'ib_buf': filename or None, 'vb_buf': {slot: filename}}, where the _buf entries are binary .buf dumps.
+    draw_calls = {}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            dump_file = parse_dump_filename(entry.name)
+            if dump_file is None:
+                continue
+            if not dump_file['index'] in draw_calls:
+                draw_calls[dump_file['index']] = {'index': dump_file['index'], 'ib': None, 'vb': {}, 'hashes': {},\
+                    'ib_buf': None, 'vb_buf': {}}
+            draw_call = draw_calls[dump_file['index']]
+            suffix = '' if dump_file['extension'] == 'txt' else '_buf'
+            if dump_file['buffer'] == 'ib':
+                draw_call['ib' + suffix] = dump_file['filename']
+            else:
+                draw_call['vb' + suffix][dump_file['slot']] = dump_file['filename']
+            draw_call['hashes'].update(dump_file['hashes'])
+    return(draw_calls)
+
+def vb_filenames_of(draw_call):
+    # Text vertex buffer filenames of a draw call, in input slot order
+    return([draw_call['vb'][x] for x in sorted(draw_call['vb'].keys())])
+
+def vb_slots_of(draw_call):
+    # Every vertex buffer slot of a draw call in input slot order, as {'slot': N, 'txt': filename or None,
+    # 'buf': filename or None}.  A slot may have been dumped as text, binary or both.
+    slots = sorted(set(draw_call['vb'].keys()) | set(draw_call.get('vb_buf', {}).keys()))
+    return([{'slot': x, 'txt': draw_call['vb'].get(x), 'buf': draw_call.get('vb_buf', {}).get(x)} for x in slots])
+
+def draw_call_filenames(draw_call):
+    # Every dump file of a draw call, text and binary
+    filenames = [draw_call['ib'], draw_call.get('ib_buf')] + vb_filenames_of(draw_call)\
+        + [draw_call['vb_buf'][x] for x in sorted(draw_call.get('vb_buf', {}).keys())]
+    return([x for x in filenames if x is not None])
+
+def read_vertex_count(filename):
+    # Read the vertex count from the header of a text vertex buffer dump without reading the vertex data
+    with open(filename, 'r') as f:
+        for line in f:
+            if line[0:12] == 'vertex count':
+                return(int(line.split(': ')[1]))
+            if line[0:11] == 'vertex-data':
+                break
+    return(0)
+
+def filter_draw_calls(draw_calls, ib_hashes = None, vs_hashes = None, ps_hashes = None,\
+        first_index = None, last_index = None, min_vertex_count = None, required_slot = 0):
+    # Return the sorted list of draw indices that have vertex data in required_slot and pass every filter
+    # given.  Hash filters take a list of hashes, any of which may match.  The required slot must have been
+    # dumped as text, as its header describes the layout of every slot.
+    indices = []
+    for index in sorted(draw_calls.keys()):
+        draw_call = draw_calls[index]
+        if not required_slot in draw_call['vb']:
+            continue
+        if first_index is not None and int(index) < first_index:
+            continue
+        if last_index is not None and int(index) > last_index:
+            continue
+        hash_filters = [('ib', ib_hashes), ('vs', vs_hashes), ('ps', ps_hashes)]
+        if not all([x[1] is None or draw_call['hashes'].get(x[0]) in [y.lower() for y in x[1]] for x in hash_filters]):
+            continue
+        if min_vertex_count is not None and read_vertex_count(draw_call['vb'][required_slot]) < min_vertex_count:
+            continue
+        indices.append(index)
+    return(indices)
+
+def parse_index_range(index_range):
+    # '100-200' -> (100, 200), '100-' -> (100, None), '-200' -> (None, 200), '150' -> (150, 150)
+    if not '-' in index_range:
+        return((int(index_range), int(index_range)))
+    first, last = index_range.split('-', 1)
+    return((int(first) if first != '' else None, int(last) if last != '' else None))
+
+def add_filter_arguments(parser):
+    # Command line options shared by the merge scripts to restrict processing to buffers of interest
+    parser.add_argument('--ib', dest = 'ib_hashes', nargs = '+', metavar = 'HASH', help = 'only process draw calls using these index buffer hashes')
+    parser.add_argument('--vs', dest = 'vs_hashes', nargs = '+', metavar = 'HASH', help = 'only process draw calls using these vertex shader hashes')
+    parser.add_argument('--ps', dest = 'ps_hashes', nargs = '+', metavar = 'HASH', help = 'only process draw calls using these pixel shader hashes')
+    parser.add_argument('--range', dest = 'index_range', metavar = 'FIRST-LAST', help = 'only process draw indices in this range, e.g. 100-200')
+    parser.add_argument('--min-vertices', dest = 'min_vertex_count', type = int, metavar = 'N', help = 'skip buffers with fewer than N vertices')
+    return(parser)
+
+def filter_draw_calls_from_args(draw_calls, args, required_slot = 0):
+    first_index, last_index = parse_index_range(args.index_range) if args.index_range else (None, None)
+    return(filter_draw_calls(draw_calls, ib_hashes = args.ib_hashes, vs_hashes = args.vs_hashes,\
+        ps_hashes = args.ps_hashes, first_index = first_index, last_index = last_index,\
+        min_vertex_count = args.min_vertex_count, required_slot = required_slot))
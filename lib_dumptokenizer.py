@@ -0,0 +1,80 @@
+# A small library to tokenize the vertex data of 3dmigoto text buffer dumps.  The dump is scanned as bytes
+# with one compiled regular expression, so there is no decoding or splitting of each line: every vertex data
+# line (e.g. "vb1[12]+016 TEXCOORD: 0.5, 0.25") becomes a record of (vertex, offset, semantic, value), with
+# the semantic and value left as bytes.  Index buffer dumps are plain lists of numbers after their header,
+# and are parsed in one call (with NumPy, if it is installed).
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import re, warnings
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Same fields as the old line.split(': ') parsing: trailing whitespace (including \r) is not part of the value.
+# The value is matched greedily up to its last non-blank character, which is about twice as fast as a lazy
+# match that has to try to end the line after every character.
+dump_record_re = re.compile(rb'^vb\d+\[(\d+)\]\+(\d+) (\S+): ((?:[^\r\n]*[^ \t\r\n])?)[ \t\r]*$', re.M)
+
+def split_header(data):
+    # Returns (header, position of the vertex data) for a whole dump held in memory
+    vertex_data = data.find(b'vertex-data')
+    if vertex_data == -1:
+        return(data, len(data))
+    return(data[:vertex_data], vertex_data)
+
+def tokenize(data, start = 0):
+    # Yield (vertex, offset, semantic, value) for every vertex data line of a dump held in memory
+    for vertex, offset, semantic, value in dump_record_re.findall(data, start):
+        yield((int(vertex), int(offset), semantic, value))
+
+def tokenize_columns(data, start = 0):
+    # Tokenize a dump held in memory into columns: {'vertex': [int], 'offset': [int], 'semantic': [bytes],
+    # 'value': [bytes]}, one entry per line, in file order
+    records = dump_record_re.findall(data, start)
+    if len(records) == 0:
+        return({'vertex': [], 'offset': [], 'semantic': [], 'value': []})
+    vertices, offsets, semantics, values = zip(*records)
+    return({'vertex': list(map(int, vertices)), 'offset': list(map(int, offsets)), 'semantic': list(semantics),\
+        'value': list(values)})
+
+def iter_dump_records(f, chunk_size = 1048576):
+    # Yield (vertex, offset, semantic, value) from a dump file opened in binary mode, from its current position
+    # to the end, reading chunk_size bytes at a time so memory use does not depend on the size of the file
+    remainder = b''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        chunk = remainder + chunk
+        last_line_end = chunk.rfind(b'\n')
+        if last_line_end == -1:
+            remainder = chunk
+            continue
+        remainder = chunk[last_line_end + 1:]
+        yield from tokenize(chunk[:last_line_end + 1])
+    if remainder:
+        yield from tokenize(remainder)
+
+def split_ib_header(ib_text):
+    # Returns (header as a dict, e.g. {'topology': 'trianglelist', 'format': 'DXGI_FORMAT_R16_UINT', ...}, the
+    # index text after it) for a whole text index buffer dump held in memory (as str)
+    header_text, _, index_text = ib_text.partition('\n\n')
+    ib_header = {}
+    for line in header_text.strip().split('\n'):
+        if ': ' in line:
+            ib_header[line.split(': ')[0]] = line.split(': ')[1].strip()
+    return(ib_header, index_text)
+
+def parse_indices(index_text):
+    # All the numbers in the index text of an index buffer dump, as a list of ints.  NumPy reads them in one
+    # call; text it cannot read to the end is left to int(), so bad data fails the same way either way.
+    if numpy is not None and index_text.strip():
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            try:
+                return(numpy.fromstring(index_text, dtype = numpy.int64, sep = ' ').tolist())
+            except (ValueError, DeprecationWarning):
+                pass
+    return([int(x) for x in index_text.split()])
@@ -0,0 +1,45 @@
+# A small library to parse each distinct vertex layout of a frame dump only once.  A dump can have thousands
+# of vertex buffer files but only a few dozen input layouts, and every file repeats its whole layout in its
+# header.  The lines before the first element (stride, vertex count, etc) differ from file to file and are
+# cheap to parse, so only the element descriptions are cached, keyed by their raw bytes.  Cached layouts are
+# shared between files, so they are frozen: dicts become read-only mappings and lists become tuples.  Use
+# dict() / list() to get a copy to modify.  The cache hits and misses are added to the --stats report.
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import types
+from lib_stats import count
+
+layout_cache = {}
+layout_cache_counts = {'hits': 0, 'misses': 0}
+
+def split_layout(header):
+    # Split a dump header into (the lines before the first element, the element descriptions)
+    position = header.find(b'element[')
+    if position == -1:
+        return(header, b'')
+    return(header[:position], header[position:])
+
+def frozen_layout(value):
+    # A read-only copy of a parsed layout (dicts, lists and plain values)
+    if isinstance(value, dict):
+        return(types.MappingProxyType({x: frozen_layout(value[x]) for x in value}))
+    if isinstance(value, (list, tuple)):
+        return(tuple([frozen_layout(x) for x in value]))
+    return(value)
+
+def cached_layout(key, parse, *arguments):
+    # Return parse(*arguments), frozen, calling parse only the first time key (which must be hashable, e.g.
+    # the raw element descriptions, plus anything else the result depends on) is seen
+    if key in layout_cache:
+        layout_cache_counts['hits'] += 1
+        count('layout_cache_hits', 1)
+        return(layout_cache[key])
+    layout_cache_counts['misses'] += 1
+    count('layout_cache_misses', 1)
+    layout_cache[key] = frozen_layout(parse(*arguments))
+    return(layout_cache[key])
+
+def layout_cache_info():
+    # Hits, misses and distinct layouts cached so far in this process
+    return({'hits': layout_cache_counts['hits'], 'misses': layout_cache_counts['misses'], 'layouts': len(layout_cache)})
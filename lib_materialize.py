@@ -0,0 +1,62 @@
+# A small library to put an unchanged copy of a file in the output folder as cheaply as the filesystem
+# allows.  In order, it tries a hardlink (no data written at all), a reflink / copy_file_range (the kernel
+# copies, or shares, the blocks without passing them through python), and finally a buffered copy.  The
+# file is made under a temporary name and renamed into place, so an existing output is replaced atomically.
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import os, shutil
+
+materialize_methods = ['hardlink', 'reflink', 'copy']
+FICLONE = 0x40049409 # Linux ioctl to share the blocks of another file (btrfs, xfs, ...)
+
+def reflink_file(source, filename):
+    # Copy source to filename without reading it into python: a reflink if the filesystem supports it,
+    # otherwise copy_file_range.  Raises OSError if neither is available.
+    with open(source, 'rb') as src, open(filename, 'wb') as dst:
+        try:
+            import fcntl
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except (ImportError, OSError):
+            pass
+        if not hasattr(os, 'copy_file_range'):
+            raise OSError('copy_file_range is not available on this platform')
+        remaining = os.fstat(src.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+            if copied == 0:
+                raise OSError('copy_file_range stopped before the end of ' + source)
+            remaining -= copied
+    return
+
+def materialize(source, filename, method = 'hardlink'):
+    # Make filename a copy of source, starting from the given method in materialize_methods and falling back
+    # to the next one whenever it fails (e.g. across filesystems).  Returns the method that succeeded.
+    temp_filename = filename + '.' + str(os.getpid()) + '.tmp'
+    if method == 'hardlink' and os.path.exists(filename) and os.path.samefile(source, filename):
+        # Already linked by an earlier run.  (Renaming a second link over it would do nothing and leave the
+        # temporary file behind, as rename() is a no-op when both names are the same file.)
+        return('hardlink')
+    for current_method in materialize_methods[materialize_methods.index(method):]:
+        try:
+            if current_method == 'hardlink':
+                os.link(source, temp_filename)
+            elif current_method == 'reflink':
+                reflink_file(source, temp_filename)
+                shutil.copystat(source, temp_filename)
+            else:
+                shutil.copy2(source, temp_filename)
+            os.replace(temp_filename, filename)
+            return(current_method)
+        except OSError:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            if current_method == materialize_methods[-1]:
+                raise
+
+def add_materialize_argument(parser):
+    parser.add_argument('--materialize', choices = materialize_methods, default = 'hardlink',\
+        help = 'how unchanged files are put in the output folder: hardlink (falling back to reflink, then copy), '\
+        + 'reflink (falling back to copy) or copy (default: hardlink)')
+    return(parser)
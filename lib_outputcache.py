@@ -0,0 +1,80 @@
+# A small library to let the merge scripts skip draw calls that have not changed since the last run.  A
+# manifest in the output folder records, for every draw index, the size, mtime and content hash of each
+# input file, the settings used and the files written.  Outputs are written to a temporary file and
+# renamed into place, so an interrupted run never leaves a half-written file that looks up to date.
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import os, json, hashlib, contextlib
+
+manifest_version = 1
+
+def file_digest(filename):
+    # SHA-1 of the file contents, read in 1 MB chunks
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(1048576)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return(digest.hexdigest())
+
+def file_signature(filename, cached_signature = None):
+    # Size, mtime and content hash of a file.  If the size and mtime match cached_signature, its hash is
+    # reused rather than reading the file again.
+    stat = os.stat(filename)
+    signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if cached_signature is not None and cached_signature.get('size') == signature['size'] \
+            and cached_signature.get('mtime_ns') == signature['mtime_ns']:
+        signature['sha1'] = cached_signature['sha1']
+    else:
+        signature['sha1'] = file_digest(filename)
+    return(signature)
+
+def input_signatures(filenames, cached_entry = None):
+    cached_inputs = cached_entry['inputs'] if cached_entry is not None else {}
+    return({x: file_signature(x, cached_inputs.get(x)) for x in filenames})
+
+def entry_is_current(cached_entry, signatures, settings):
+    # True if the cached entry was made from identical inputs and settings and all its outputs still exist
+    if cached_entry is None or cached_entry.get('settings') != settings:
+        return(False)
+    if sorted(cached_entry['inputs'].keys()) != sorted(signatures.keys()):
+        return(False)
+    if not all([cached_entry['inputs'][x]['sha1'] == signatures[x]['sha1'] for x in signatures]):
+        return(False)
+    return(all([os.path.exists(x) for x in cached_entry['outputs']]))
+
+def make_entry(signatures, settings, outputs):
+    return({'inputs': signatures, 'settings': settings, 'outputs': outputs})
+
+def load_manifest(manifest_filename):
+    # Returns {fileindex: entry}, empty if there is no manifest or it was written by another version
+    try:
+        with open(manifest_filename, 'r') as f:
+            manifest = json.loads(f.read())
+    except (OSError, ValueError):
+        return({})
+    if not isinstance(manifest, dict) or manifest.get('version') != manifest_version:
+        return({})
+    return(manifest['entries'])
+
+def save_manifest(entries, manifest_filename):
+    with atomic_open(manifest_filename, 'w') as f:
+        f.write(json.dumps({'version': manifest_version, 'entries': entries}, indent = 1, sort_keys = True))
+    return
+
+@contextlib.contextmanager
+def atomic_open(filename, mode = 'w'):
+    # Open a temporary file next to filename, and rename it over filename only once it has been written
+    # completely.  If the block raises, the temporary file is removed and filename is left untouched.
+    temp_filename = filename + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(temp_filename, mode) as f:
+            yield(f)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
@@ -0,0 +1,212 @@
+# A small library to instrument the merge and split scripts.  With --stats, a script records the time spent
+# in each phase (scan, parse, merge / split, write) in total and per file, the bytes read and written, the
+# vertices processed and its peak memory, shows a progress line with an ETA on stderr and prints a summary
+# at the end.  --trace-memory also records the peak memory allocated by python objects (tracemalloc), which
+# is more precise but makes the timings several times slower.  --stats-json saves the same report as JSON,
+# and --profile saves a cProfile profile of the whole run (view it with python -m pstats).  Without these
+# options the calls below do nothing.
+#
+# GitHub eArmada8/vbuffer_merge_split
+
+import os, sys, json, time, cProfile, contextlib, threading, tracemalloc
+try:
+    import resource
+except ImportError: # Not available on Windows, so peak RSS is not reported there
+    resource = None
+
+run_stats = None # The report being collected, or None when instrumentation is off
+stats_lock = threading.Lock() # Guards run_stats when a script processes files on several threads
+thread_state = threading.local() # The file being processed by each thread (see stats_file)
+progress_start = None
+progress_shown = None
+
+def start_stats(trace_memory = False):
+    global run_stats
+    run_stats = {'phases': {}, 'totals': {'bytes_read': 0, 'bytes_written': 0, 'vertices': 0}, 'files': {}}
+    thread_state.current_file = None
+    if trace_memory == True:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    return
+
+def peak_rss():
+    # Peak resident memory of this process in bytes, or None where it is not available
+    if resource is None:
+        return(None)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024))
+
+def stats_enabled():
+    return(run_stats is not None)
+
+def take_stats():
+    # Stop collecting and return what was collected (used by worker processes to send their stats back)
+    global run_stats
+    collected = run_stats
+    if collected is not None:
+        collected['peak_rss'] = peak_rss()
+        collected['peak_traced_memory'] = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+    run_stats = None
+    return(collected)
+
+def merge_stats(other):
+    # Add the stats collected by a worker process to this process' stats
+    if run_stats is None or other is None:
+        return
+    for phase in other['phases']:
+        run_stats['phases'][phase] = run_stats['phases'].get(phase, 0) + other['phases'][phase]
+    for key in other['totals']:
+        run_stats['totals'][key] = run_stats['totals'].get(key, 0) + other['totals'][key]
+    run_stats['files'].update(other['files'])
+    for key in ['peak_rss', 'peak_traced_memory']:
+        if other[key] is not None:
+            run_stats['worker_' + key] = max(run_stats.get('worker_' + key, 0), other[key])
+    return
+
+def current_file():
+    return(getattr(thread_state, 'current_file', None))
+
+def file_record(filename):
+    if not filename in run_stats['files']:
+        run_stats['files'][filename] = {'seconds': 0, 'phases': {}, 'bytes_read': 0, 'bytes_written': 0, 'vertices': 0}
+    return(run_stats['files'][filename])
+
+@contextlib.contextmanager
+def stats_file(filename):
+    # Attribute the phases and counts inside the block to filename (e.g. a draw index or mesh name)
+    if run_stats is None:
+        yield
+        return
+    previous_file, thread_state.current_file = current_file(), filename
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if run_stats is not None:
+            with stats_lock:
+                file_record(filename)['seconds'] += time.perf_counter() - start
+        thread_state.current_file = previous_file
+
+@contextlib.contextmanager
+def timed(phase):
+    # Add the time spent in the block to phase, in total and for the current file
+    if run_stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if run_stats is not None:
+            elapsed = time.perf_counter() - start
+            filename = current_file()
+            with stats_lock:
+                run_stats['phases'][phase] = run_stats['phases'].get(phase, 0) + elapsed
+                if filename is not None:
+                    phases = file_record(filename)['phases']
+                    phases[phase] = phases.get(phase, 0) + elapsed
+
+def count(key, value):
+    # Add value to a count ('bytes_read', 'bytes_written' or 'vertices'), in total and for the current file
+    if run_stats is None:
+        return
+    filename = current_file()
+    with stats_lock:
+        run_stats['totals'][key] = run_stats['totals'].get(key, 0) + value
+        if filename is not None:
+            record = file_record(filename)
+            record[key] = record.get(key, 0) + value
+    return
+
+def count_files(key, filenames):
+    # Add the sizes of the files that exist to a byte count
+    if run_stats is None:
+        return
+    count(key, sum([os.path.getsize(x) for x in filenames if x is not None and os.path.exists(x)]))
+    return
+
+def progress(done, total):
+    # Show 'done / total' with an estimate of the time left on stderr, at most twice a second.  On a console
+    # the line is overwritten in place; otherwise (e.g. a log file) each update is a new line.
+    global progress_start, progress_shown
+    if run_stats is None:
+        return
+    now = time.perf_counter()
+    if progress_start is None or done == 0:
+        progress_start, progress_shown = now, None
+    if done < total and progress_shown is not None and now - progress_shown < 0.5:
+        return
+    progress_shown = now
+    elapsed = now - progress_start
+    line = '{0} / {1} ({2:.0%}), {3:.1f} s elapsed'.format(done, total, done / total if total > 0 else 1, elapsed)
+    if 0 < done < total:
+        line += ', about {0:.1f} s left'.format(elapsed / done * (total - done))
+    if sys.stderr.isatty():
+        sys.stderr.write('\r' + line + ' ' * 8 + ('\n' if done >= total else ''))
+    else:
+        sys.stderr.write(line + '\n')
+    sys.stderr.flush()
+    return
+
+def format_bytes(value):
+    return('{0:.2f} MB'.format(value / 1048576))
+
+def report_text(report):
+    lines = ['{0}: {1:.3f} s'.format(report['script'], report['seconds'])]
+    for phase in report['phases']:
+        lines.append('  {0:8} {1:9.3f} s'.format(phase, report['phases'][phase]))
+    totals = report['totals']
+    lines.append('  read {0}, wrote {1}, {2} vertices ({3:,.0f} vertices/s, {4:.2f} MB/s read)'.format(\
+        format_bytes(totals['bytes_read']), format_bytes(totals['bytes_written']), totals['vertices'],\
+        totals['vertices'] / report['seconds'] if report['seconds'] > 0 else 0,\
+        totals['bytes_read'] / 1048576 / report['seconds'] if report['seconds'] > 0 else 0))
+    if 'layout_cache_misses' in totals:
+        lines.append('  header layouts: {0} parsed, {1} reused from the cache (see lib_fmtcache.py)'.format(\
+            totals['layout_cache_misses'], totals.get('layout_cache_hits', 0)))
+    for key, label in [('peak_rss', 'peak memory (RSS)'), ('peak_traced_memory', 'peak python memory (tracemalloc)')]:
+        if report[key] is not None:
+            lines.append('  {0} {1}'.format(label, format_bytes(report[key]))\
+                + (', {0} in a worker'.format(format_bytes(report['worker_' + key])) if 'worker_' + key in report else ''))
+    slowest = sorted(report['files'].keys(), key = lambda x: report['files'][x]['seconds'], reverse = True)[0:5]
+    if len(slowest) > 0:
+        lines.append('  slowest: ' + ', '.join(['{0} ({1:.3f} s)'.format(x, report['files'][x]['seconds']) for x in slowest]))
+    return('\n'.join(lines) + '\n')
+
+def add_stats_arguments(parser):
+    parser.add_argument('--stats', action = 'store_true', help = 'show progress and a timing / memory summary on stderr')
+    parser.add_argument('--stats-json', metavar = 'FILE', help = 'save the timing / memory report as JSON (implies --stats)')
+    parser.add_argument('--trace-memory', action = 'store_true', help = 'also measure peak python memory with tracemalloc '\
+        + '(slows the run down; implies --stats)')
+    parser.add_argument('--profile', metavar = 'FILE', help = 'save a cProfile profile of the run to FILE')
+    return(parser)
+
+@contextlib.contextmanager
+def instrumented_run(args, script_name):
+    # Wrap the main part of a script: collect stats if --stats or --stats-json was given, and profile the run
+    # if --profile was given.  The report and profile are written even if the script fails partway.
+    stats_wanted = args.stats or args.stats_json is not None or args.trace_memory
+    # Report files are given relative to where the script was started, not the folder it changes to
+    stats_json = os.path.abspath(args.stats_json) if args.stats_json is not None else None
+    profile = os.path.abspath(args.profile) if args.profile is not None else None
+    if stats_wanted:
+        start_stats(args.trace_memory)
+    profiler = cProfile.Profile() if profile is not None else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+        if stats_wanted:
+            seconds = time.perf_counter() - start
+            report = take_stats()
+            report['script'] = script_name
+            report['seconds'] = seconds
+            sys.stderr.write(report_text(report))
+            if stats_json is not None:
+                with open(stats_json, 'w') as f:
+                    f.write(json.dumps(report, indent = 1, sort_keys = True))
@@ -3,28 +3,44 @@
 # output any buffers it finds into the ./output directory.  It will discard values that overread a buffer.
 # GitHub eArmada8/vbuffer_merge_split
 
-import glob, os, re, copy, json
+import os, re, sys, json, struct, hashlib, heapq, itertools, contextlib, argparse, collections, traceback, tracemalloc, concurrent.futures
+from lib_dumpindex import *
+from lib_outputcache import *
+from lib_dumpbuf import *
+from lib_materialize import *
+from lib_dumptokenizer import *
+from lib_stats import *
+from lib_fmtcache import *
 
-def retrieve_indices():
+def retrieve_indices(draw_calls = None):
     # Make a list of all vertex buffer indices in the current folder
     # NOTE: Will *not* include index buffers without vertex data! (i.e. ib files without corresponding vb files)
-    return sorted([re.findall(r'\d+', x)[0] for x in glob.glob('*-vb0*txt')])
-
-def copy_ib_file_to_output(fileindex):
-    # Copy the index buffer file to the output directory unmodified, if it exists
-    ib_filename = str(glob.glob(fileindex + '-ib*txt')[0])
-    if os.path.exists(ib_filename):
-        with open(ib_filename, 'r') as f:
-            ib_file_data = f.read()
-        with open('output/' + ib_filename, 'w') as f:
-            f.write(ib_file_data)
-        del ib_file_data
-    return
+    if draw_calls is None:
+        draw_calls = index_dump_directory('.')
+    return(filter_draw_calls(draw_calls))
+
+def copy_ib_file_to_output(fileindex, draw_call = None, materialize_method = 'hardlink'):
+    # Copy the index buffer file to the output directory unmodified, if it exists.  Returns the files written.
+    if draw_call is None:
+        draw_call = index_dump_directory('.')[fileindex]
+    ib_filename = draw_call['ib']
+    if ib_filename is not None and os.path.exists(ib_filename):
+        materialize(ib_filename, 'output/' + ib_filename, materialize_method)
+        return(['output/' + ib_filename])
+    return([])
 
 def stride_from_format(dxgi_format):
     return(int(sum([int(x) for x in re.findall("[0-9]+",dxgi_format)])/8))
 
 def read_fmt(header):
+    # Parse a dump header.  The element descriptions are the same for every buffer with the same input layout,
+    # so they are parsed once per layout and shared, read-only (see lib_fmtcache.py).
+    header_lines, element_lines = split_layout(header)
+    fmt_struct = parse_fmt(header_lines)
+    fmt_struct['elements'] = cached_layout(element_lines, lambda: parse_fmt(element_lines)['elements'])
+    return(fmt_struct)
+
+def parse_fmt(header):
     fmt_struct = {}
     headerlines = header.decode('utf-8').strip().replace('\r','').split('\n')
     elements = []
@@ -46,10 +62,27 @@ def read_fmt(header):
                 fmt_struct[linekey] = lineval
             else:
                 element[linekey] = lineval
-    elements.append(element)
+    if element_num > -1:
+        elements.append(element)
     fmt_struct['elements'] = elements
     return(fmt_struct)
 
+def merged_elements(header, valid_elements, original_strides):
+    # The elements of the merged buffer: valid_elements moved to slot 0, after the slots before their own.
+    # Worked out once for each layout, choice of elements and set of slot strides.
+    key = ('merged', split_layout(header)[1], tuple([(x['InputSlot'], x['AlignedByteOffset']) for x in valid_elements]),\
+        tuple(original_strides))
+    return(cached_layout(key, offset_elements, valid_elements, original_strides))
+
+def offset_elements(valid_elements, original_strides):
+    new_elements = []
+    for i in range(len(valid_elements)):
+        new_element = dict(valid_elements[i]) # Make a copy so we still have the original
+        new_element['AlignedByteOffset'] += sum(original_strides[0:new_element['InputSlot']])
+        new_element['InputSlot'] = 0
+        new_elements.append(new_element)
+    return(new_elements)
+
 def make_header(fmt_struct):
     header = ''
     for key in fmt_struct:
@@ -64,104 +97,614 @@ def make_header(fmt_struct):
     header += '\nvertex-data:\n\n'
     return(header)
 
-def merge_vb_file_to_output(fileindex):
-    # Take all the vertex buffer files for one index buffer and merge them into a single vertex buffer file
-    #First, get a list of all the VB files
-    vb_filenames = sorted(glob.glob(fileindex + '-vb*txt'))
+class UnorderedVertexDataError(Exception):
+    # Raised by the streaming merge when a slot file does not list its vertices in ascending order
+    pass
+
+def read_slot_stride(f):
+    # Advance a slot file (opened in binary mode) past its 'stride' line and return the stride (None if there
+    # is no stride line)
+    for line in f:
+        if line[0:6] == b'stride':
+            return(int(line.strip().split(b': ')[1]))
+    return(None)
+
+def read_slot_vertex_groups(f, slot):
+    # Yield (vertex_num, slot, {offset: (semantic, value)}) for every vertex group in a slot file opened in
+    # binary mode, one group at a time, with semantic and value as bytes.  Offsets that 3DMigoto re-reads
+    # within a vertex are discarded, keeping the first value.
+    current_vertex = -1
+    group = {}
+    for vertex_num, vertex_offset, semantic, value in iter_dump_records(f):
+        if vertex_num != current_vertex:
+            if vertex_num < current_vertex:
+                raise UnorderedVertexDataError(f.name)
+            if current_vertex > -1:
+                yield((current_vertex, slot, group))
+            current_vertex = vertex_num
+            group = {}
+        if not vertex_offset in group:
+            group[vertex_offset] = (semantic, value)
+    if current_vertex > -1:
+        yield((current_vertex, slot, group))
+
+def open_slot(slot_source, slot, elements, stack):
+    # Open one vertex buffer slot for merging, preferring the memory-mapped binary dump over the text dump if
+    # both exist.  Returns (stride, vertex group iterator).  The files stay open until stack is closed.
+    stride = None
+    if slot_source['txt'] is not None:
+        f = stack.enter_context(open(slot_source['txt'], 'rb'))
+        stride = read_slot_stride(f)
+        if slot_source['buf'] is None:
+            return(stride, read_slot_vertex_groups(f, slot))
+    if stride is None:
+        stride = slot_stride_from_elements(elements)
+    buf = stack.enter_context(open_buf(slot_source['buf']))
+    return(stride, read_buf_vertex_groups(buf, slot, stride, elements))
+
+def merge_vb_file_to_output(fileindex, draw_call = None):
+    # Take all the vertex buffer files for one index buffer and merge them into a single vertex buffer file.
+    # The slot files are read in lock-step and every vertex group is written as soon as it is complete, so
+    # memory use does not grow with the size of the mesh.  Dumps that are not in vertex order fall back to
+    # the in-memory merge below.  Returns the files written.
+    if draw_call is None:
+        draw_call = index_dump_directory('.')[fileindex]
+    vb_filenames = vb_filenames_of(draw_call)
 
     #Get Header
-    with open(vb_filenames[0], 'rb') as f:
-        filedata = f.read()
-        fmt = read_fmt(filedata[:filedata.find(b'vertex-data')])
-        del(filedata)
-
-    valid_elements = [] # These will be inserted (and thus ordered) by file then by offset
-    vertex_data = []
-    last_vertex = 0
-    original_strides = []
-    for i in range(len(vb_filenames)):
-        valid_input_slot = True
-        #Determine valid offsets (sometimes 3DMigoto re-reads the same values if the game does not give good offsets
-        elements = [element for element in fmt['elements'] if element['InputSlot'] == i]
-        offsets = [element['AlignedByteOffset'] for element in elements]
-        used_offsets = []
-        for j in range(len(elements)):
-            if not elements[j]['AlignedByteOffset'] in used_offsets:
-                valid_elements.append(elements[j])
-                used_offsets.append(elements[j]['AlignedByteOffset'])
-        vertices = {}
-        for j in range(len(used_offsets)):
-            vertices[used_offsets[j]] = {}
-        #Grab vertex data
-        current_vertex = -1
-        v_semantics = []
-        with open(vb_filenames[i], 'r') as f:
-            for line in f:
-                if line[0:6] == 'stride': #First line, replace with the merged stride
-                    original_strides.append(int(line.strip().split(': ')[1]))
-                    if original_strides[-1] == 0:
-                        valid_input_slot = False
-                        break #If the entire buffer is empty, skip this file
-                if line[0:2] == 'vb':
-                    vertex_num, vertex_offset = [int(x) for x in line[4:].split(' ')[0].split(']+')]
-                    if vertex_num != current_vertex:
-                        #Reset invalid offset detector
-                        used_offset_counter = []
-                        current_vertex = vertex_num
-                    if not vertex_offset in used_offset_counter:
-                        vertices[vertex_offset][vertex_num] = line.split(': ')[1].strip()
-                        used_offset_counter.append(vertex_offset)
-                        #Add semantic to list if first vertex
-                        if vertex_num == 0:
-                            v_semantics.append(line.split(': ')[0].split(' ')[1])
-        if valid_input_slot == True: # If the entire buffer is empty, skip all semantics
-            for j in range(len(used_offsets)):
-                last_vertex = max(last_vertex, max(vertices[used_offsets[j]].keys()))
-                vertex_data.append({'Semantic': v_semantics[j], 'InputSlot': i,\
-                    'OriginalOffset': used_offsets[j], 'Vertices': vertices[used_offsets[j]]})
+    with timed('parse'):
+        header = read_header(vb_filenames[0])
+        fmt = read_fmt(header)
+
+    try:
+        with contextlib.ExitStack() as stack:
+            slots = vb_slots_of(draw_call)
+            valid_elements = [] # These will be inserted (and thus ordered) by file then by offset
+            slot_offsets = []
+            original_strides = []
+            slot_groups = []
+            for i in range(len(slots)):
+                elements = [element for element in fmt['elements'] if element['InputSlot'] == i]
+                used_offsets = []
+                for j in range(len(elements)):
+                    if not elements[j]['AlignedByteOffset'] in used_offsets:
+                        valid_elements.append(elements[j])
+                        used_offsets.append(elements[j]['AlignedByteOffset'])
+                stride, groups = open_slot(slots[i], i, valid_elements[len(valid_elements) - len(used_offsets):], stack)
+                if stride is not None:
+                    original_strides.append(stride)
+                if stride == 0:
+                    continue #If the entire buffer is empty, skip this file
+                slot_offsets.append((i, used_offsets))
+                slot_groups.append(groups)
+
+            #Generate new element list
+            new_fmt = dict(fmt)
+            new_fmt['stride'] = sum(original_strides)
+            new_fmt['elements'] = merged_elements(header, valid_elements, original_strides)
+
+            #Semantics are taken from the first vertex of each slot, which is read ahead of the merge
+            first_groups = [next(x, None) for x in slot_groups]
+            line_prefixes = {}
+            element_num = 0
+            for i in range(len(slot_offsets)):
+                slot, used_offsets = slot_offsets[i]
+                v_semantics = [x[0] for x in first_groups[i][2].values()] if first_groups[i] is not None else []
+                for j in range(len(used_offsets)):
+                    line_prefixes[(slot, used_offsets[j])] = (element_num, b']+' \
+                        + str(new_fmt['elements'][element_num]['AlignedByteOffset']).zfill(3).encode() + b' ' + v_semantics[j] + b': ')
+                    element_num += 1
+            line_order = sorted(line_prefixes.keys(), key = lambda x: line_prefixes[x][0])
+            slot_groups = [itertools.chain([first_groups[i]], slot_groups[i]) if first_groups[i] is not None \
+                else slot_groups[i] for i in range(len(slot_groups))]
+
+            #Create combined VB, k-way merging the slot files by vertex number.  The text is assembled as bytes,
+            #with the platform's line endings as text mode would have written them.  The slots are parsed as
+            #they are merged and written, so this is all timed as the merge phase.
+            newline = os.linesep.encode()
+            with timed('merge'), atomic_open('output/' + vb_filenames[0], 'wb') as f:
+                f.write(make_header(new_fmt).replace('\n', os.linesep).encode())
+                next_vertex = 0
+                merged_groups = heapq.merge(*slot_groups, key = lambda x: (x[0], x[1]))
+                for vertex_num, groups in itertools.groupby(merged_groups, key = lambda x: x[0]):
+                    #Vertices that no slot provides still get their (empty) vertex group
+                    f.write(newline * (vertex_num - next_vertex))
+                    values = {}
+                    for group in groups:
+                        for offset in group[2]:
+                            values[(group[1], offset)] = group[2][offset][1]
+                    vertex_prefix = b'vb0[' + str(vertex_num).encode()
+                    f.writelines([vertex_prefix + line_prefixes[x][1] + values[x] + newline for x in line_order if x in values])
+                    #Blender plugin expects a blank line after every vertex group
+                    f.write(newline)
+                    next_vertex = vertex_num + 1
+                if next_vertex == 0:
+                    f.write(newline)
+            count('vertices', next_vertex)
+    except UnorderedVertexDataError:
+        return(merge_vb_file_to_output_in_memory(fileindex, draw_call))
+
+    with timed('write'), atomic_open('output/{0}.splitdata'.format(fileindex), 'w') as f:
+        f.write(json.dumps(original_strides))
+    return(['output/' + vb_filenames[0], 'output/{0}.splitdata'.format(fileindex)])
+
+def merge_vb_file_to_output_in_memory(fileindex, draw_call = None):
+    # Take all the vertex buffer files for one index buffer and merge them into a single vertex buffer file,
+    # holding every vertex in memory.  Used for dumps whose vertices are not listed in order.
+    #First, get a list of all the VB files
+    if draw_call is None:
+        draw_call = index_dump_directory('.')[fileindex]
+    vb_filenames = vb_filenames_of(draw_call)
 
+    with timed('parse'):
+        #Get Header
+        header = read_header(vb_filenames[0])
+        fmt = read_fmt(header)
 
+        valid_elements = [] # These will be inserted (and thus ordered) by file then by offset
+        vertex_data = []
+        last_vertex = 0
+        original_strides = []
+        slots = vb_slots_of(draw_call)
+        for i in range(len(slots)):
+            valid_input_slot = True
+            #Determine valid offsets (sometimes 3DMigoto re-reads the same values if the game does not give good offsets
+            elements = [element for element in fmt['elements'] if element['InputSlot'] == i]
+            offsets = [element['AlignedByteOffset'] for element in elements]
+            used_offsets = []
+            for j in range(len(elements)):
+                if not elements[j]['AlignedByteOffset'] in used_offsets:
+                    valid_elements.append(elements[j])
+                    used_offsets.append(elements[j]['AlignedByteOffset'])
+            vertices = {}
+            for j in range(len(used_offsets)):
+                vertices[used_offsets[j]] = {}
+            #Grab vertex data
+            current_vertex = -1
+            v_semantics = []
+            if slots[i]['buf'] is not None: # Binary dumps are always in order, so these are read as a stream
+                with contextlib.ExitStack() as stack:
+                    stride, groups = open_slot(slots[i], i, valid_elements[len(valid_elements) - len(used_offsets):], stack)
+                    original_strides.append(stride)
+                    if stride == 0:
+                        valid_input_slot = False
+                    for vertex_num, slot, group in (groups if valid_input_slot == True else []):
+                        for vertex_offset in group:
+                            vertices[vertex_offset][vertex_num] = group[vertex_offset][1]
+                            if vertex_num == 0:
+                                v_semantics.append(group[vertex_offset][0])
+            else:
+                with open(slots[i]['txt'], 'rb') as f:
+                    stride = read_slot_stride(f)
+                    if stride is not None: #Replaced with the merged stride
+                        original_strides.append(stride)
+                        if stride == 0:
+                            valid_input_slot = False #If the entire buffer is empty, skip this file
+                    for vertex_num, vertex_offset, semantic, value in (iter_dump_records(f) if valid_input_slot == True else []):
+                        if vertex_num != current_vertex:
+                            #Reset invalid offset detector
+                            used_offset_counter = set()
+                            current_vertex = vertex_num
+                        if not vertex_offset in used_offset_counter:
+                            vertices[vertex_offset][vertex_num] = value
+                            used_offset_counter.add(vertex_offset)
+                            #Add semantic to list if first vertex
+                            if vertex_num == 0:
+                                v_semantics.append(semantic)
+            if valid_input_slot == True: # If the entire buffer is empty, skip all semantics
+                for j in range(len(used_offsets)):
+                    last_vertex = max(last_vertex, max(vertices[used_offsets[j]].keys()))
+                    vertex_data.append({'Semantic': v_semantics[j], 'InputSlot': i,\
+                        'OriginalOffset': used_offsets[j], 'Vertices': vertices[used_offsets[j]]})
 
     #Generate new element list
-    new_elements = []
-    for i in range(len(valid_elements)):
-        new_element = copy.deepcopy(valid_elements[i]) # Make a copy so we still have the original
-        new_element['AlignedByteOffset'] += sum(original_strides[0:new_element['InputSlot']])
-        new_element['InputSlot'] = 0
-        new_elements.append(new_element)
-    new_fmt = copy.deepcopy(fmt)
+    new_fmt = dict(fmt)
     new_fmt['stride'] = sum(original_strides)
-    new_fmt['elements'] = new_elements
+    new_fmt['elements'] = merged_elements(header, valid_elements, original_strides)
     
-    #Create combined VB
-    with open('output/' + vb_filenames[0], 'w') as f:
-        f.write(make_header(new_fmt))
+    #Create combined VB, as bytes with the platform's line endings (as text mode would have written them)
+    newline = os.linesep.encode()
+    with timed('write'), atomic_open('output/' + vb_filenames[0], 'wb') as f:
+        f.write(make_header(new_fmt).replace('\n', os.linesep).encode())
         for j in range(last_vertex+1):
             for i in range(len(vertex_data)):
                 if j in vertex_data[i]['Vertices'].keys():
-                    f.write('vb0[' + str(j) + ']+' + str(new_fmt['elements'][i]['AlignedByteOffset']).zfill(3)\
-                        + ' ' + vertex_data[i]['Semantic'] + ': ' + vertex_data[i]['Vertices'][j] + '\n')
+                    f.write(b'vb0[' + str(j).encode() + b']+' + str(new_fmt['elements'][i]['AlignedByteOffset']).zfill(3).encode()\
+                        + b' ' + vertex_data[i]['Semantic'] + b': ' + vertex_data[i]['Vertices'][j] + newline)
             #Blender plugin expects a blank line after every vertex group
-            f.write('\n')
+            f.write(newline)
 
-    with open('output/{0}.splitdata'.format(fileindex), 'w') as f:
+    count('vertices', last_vertex + 1 if len(vertex_data) > 0 else 0)
+    with timed('write'), atomic_open('output/{0}.splitdata'.format(fileindex), 'w') as f:
         f.write(json.dumps(original_strides))
-    return
+    return(['output/' + vb_filenames[0], 'output/{0}.splitdata'.format(fileindex)])
+
+def read_header(filename):
+    # Read a text dump header, up to (but not including) the vertex data, without reading the rest of the file
+    header = b''
+    with open(filename, 'rb') as f:
+        for line in f:
+            if line[0:11] == b'vertex-data':
+                break
+            header += line
+    return(header)
+
+def read_merged_layout(slots):
+    # Work out the layout of the merged buffer from the slot file headers alone.  Returns (merged fmt, original
+    # strides, [(slot, original offset)] for each merged element).  Slots with a stride of 0 are empty, so
+    # their elements are left out of the merged layout.  Slots dumped only as .buf have no header, so their
+    # stride is taken from the end of their last element.
+    header = read_header(slots[0]['txt'])
+    fmt = read_fmt(header)
+    original_strides = []
+    for i in range(len(slots)):
+        stride = None
+        if slots[i]['txt'] is not None:
+            with open(slots[i]['txt'], 'rb') as f:
+                stride = read_slot_stride(f)
+        if stride is None:
+            stride = slot_stride_from_elements([x for x in fmt['elements'] if x['InputSlot'] == i])
+        original_strides.append(stride)
+    valid_elements = []
+    element_slots = []
+    for i in range(len(original_strides)):
+        if original_strides[i] == 0:
+            continue
+        used_offsets = []
+        for element in [x for x in fmt['elements'] if x['InputSlot'] == i]:
+            if not element['AlignedByteOffset'] in used_offsets:
+                used_offsets.append(element['AlignedByteOffset'])
+                valid_elements.append(element)
+                element_slots.append((i, element['AlignedByteOffset']))
+    new_fmt = dict(fmt)
+    new_fmt['stride'] = sum(original_strides)
+    new_fmt['elements'] = merged_elements(header, valid_elements, original_strides)
+    return(new_fmt, original_strides, element_slots)
+
+def encode_column(values, dxgi_format):
+    # Pack the text values of one element for every vertex (e.g. [b'1, 0, 0', ...]) into binary with a single
+    # struct call.  Missing components are filled with 0 and extra components are dropped.
+    num_components, code, scale = dxgi_struct_format(dxgi_format)
+    padding = [b'0'] * num_components
+    components = [x for value in values for x in (value.split(b', ') + padding)[0:num_components]]
+    if code in 'fe':
+        numbers = [float(x) for x in components]
+    elif scale is None:
+        numbers = [int(float(x)) for x in components]
+    elif code in 'IHB':
+        numbers = [int(round(min(max(float(x), 0), 1) * scale)) for x in components]
+    else:
+        numbers = [int(round(min(max(float(x), -1), 1) * scale)) for x in components]
+    return(struct.pack('<' + str(len(numbers)) + code, *numbers))
+
+def write_binary_ib(fileindex, draw_call):
+    # Convert the text index buffer to output/<fileindex>.ib, or copy the indices used by the draw call
+    # straight out of the binary (.buf) dump if there is one.  Returns (files written, ib header as a dict).
+    if draw_call['ib'] is None:
+        return([], {'topology': 'trianglelist', 'format': 'DXGI_FORMAT_UNKNOWN'})
+    with open(draw_call['ib'], 'r') as f:
+        ib_header, index_text = split_ib_header(f.read())
+    _, code, _ = dxgi_struct_format(ib_header['format'])
+    with atomic_open('output/{0}.ib'.format(fileindex), 'wb') as f:
+        if draw_call.get('ib_buf') is not None:
+            index_size = struct.calcsize(code)
+            start = int(ib_header.get('byte offset', 0)) + int(ib_header.get('first index', 0)) * index_size
+            with open_buf(draw_call['ib_buf']) as buf:
+                end = start + int(ib_header['index count']) * index_size if 'index count' in ib_header else len(buf)
+                f.write(buf[start:end])
+        else:
+            indices = parse_indices(index_text)
+            f.write(struct.pack('<' + str(len(indices)) + code, *indices))
+    return(['output/{0}.ib'.format(fileindex)], ib_header)
+
+def write_binary_fmt(fileindex, new_fmt, ib_header):
+    # Write the .fmt file describing the merged .vb and .ib, in the layout the Blender plugin exports
+    fmt_text = 'stride: ' + str(new_fmt['stride']) + '\n'
+    fmt_text += 'topology: ' + str(new_fmt.get('topology', ib_header.get('topology', 'trianglelist'))) + '\n'
+    fmt_text += 'format: ' + ib_header['format'] + '\n'
+    for i in range(len(new_fmt['elements'])):
+        fmt_text += 'element[' + str(i) + ']:\n'
+        for key in new_fmt['elements'][i]:
+            fmt_text += '  ' + key + ': ' + str(new_fmt['elements'][i][key]) + '\n'
+    with atomic_open('output/{0}.fmt'.format(fileindex), 'w') as f:
+        f.write(fmt_text)
+    return(['output/{0}.fmt'.format(fileindex)])
+
+def merge_vb_file_to_binary_output(fileindex, draw_call = None, vb_source = None, materialize_method = 'hardlink'):
+    # Merge the vertex buffer files for one index buffer straight into a raw buffer, writing output/<fileindex>
+    # .vb, .ib, .fmt and .splitdata (as Blender would export them, so vb_split.py can split them again).  Each
+    # text element is packed as one column and interleaved into the merged buffer with one slice per byte, and
+    # binary (.buf) slots are interleaved straight from the memory-mapped file.  If
+    # vb_source is given as the fileindex of an identical, already merged buffer, its .vb is linked instead.
+    # Returns the files written.
+    if draw_call is None:
+        draw_call = index_dump_directory('.')[fileindex]
+    slots = vb_slots_of(draw_call)
+    with timed('parse'):
+        new_fmt, original_strides, element_slots = read_merged_layout(slots)
+    with timed('write'):
+        outputs, ib_header = write_binary_ib(fileindex, draw_call)
+        outputs += write_binary_fmt(fileindex, new_fmt, ib_header)
+
+    if vb_source is not None:
+        for extension in ['vb', 'splitdata']:
+            materialize('output/{0}.{1}'.format(vb_source, extension), 'output/{0}.{1}'.format(fileindex, extension), materialize_method)
+        return(outputs + ['output/{0}.vb'.format(fileindex), 'output/{0}.splitdata'.format(fileindex)])
+
+    with contextlib.ExitStack() as stack:
+        #Binary slots are memory-mapped and copied whole; text slots are read into one {vertex_num: value} dict
+        #per element
+        with timed('parse'):
+            slot_bufs = {}
+            columns = {x: {} for x in element_slots}
+            for i in sorted(set([x[0] for x in element_slots])):
+                if slots[i]['buf'] is not None:
+                    slot_bufs[i] = stack.enter_context(open_buf(slots[i]['buf']))
+                    continue
+                current_vertex = -1
+                with open(slots[i]['txt'], 'rb') as f:
+                    for vertex_num, vertex_offset, semantic, value in iter_dump_records(f):
+                        if vertex_num != current_vertex:
+                            used_offset_counter = set()
+                            current_vertex = vertex_num
+                        if not vertex_offset in used_offset_counter and (i, vertex_offset) in columns:
+                            columns[(i, vertex_offset)][vertex_num] = value
+                            used_offset_counter.add(vertex_offset)
+            vertex_count = max([max(x.keys()) + 1 for x in columns.values() if len(x) > 0]\
+                + [len(slot_bufs[i]) // original_strides[i] for i in slot_bufs] + [0])
+
+        with timed('merge'):
+            stride = new_fmt['stride']
+            vb_data = bytearray(vertex_count * stride)
+            #Binary slots are a strided byte interleave, one slice per byte of the slot stride
+            for i in slot_bufs:
+                slot_stride = original_strides[i]
+                slot_start = sum(original_strides[0:i])
+                slot_vertex_count = len(slot_bufs[i]) // slot_stride
+                for k in range(slot_stride):
+                    vb_data[slot_start + k:slot_vertex_count * stride:stride] = slot_bufs[i][k:slot_vertex_count * slot_stride:slot_stride]
+
+    with timed('merge'):
+        #Pack each text element as a column, then interleave the columns one byte lane at a time
+        for j in range(len(element_slots)):
+            if element_slots[j][0] in slot_bufs:
+                continue
+            element = new_fmt['elements'][j]
+            element_size = stride_from_format(element['Format'])
+            vertices = columns[element_slots[j]]
+            if len(vertices) == vertex_count:
+                column = encode_column([vertices[x] for x in range(vertex_count)], element['Format'])
+                for k in range(element_size):
+                    vb_data[element['AlignedByteOffset'] + k::stride] = column[k::element_size]
+            else: # Some vertices are missing this element, so they are left as zeroes
+                vertex_nums = sorted(vertices.keys())
+                column = encode_column([vertices[x] for x in vertex_nums], element['Format'])
+                for k in range(len(vertex_nums)):
+                    start = vertex_nums[k] * stride + element['AlignedByteOffset']
+                    vb_data[start:start + element_size] = column[k * element_size:(k + 1) * element_size]
+
+    count('vertices', vertex_count)
+    with timed('write'), atomic_open('output/{0}.vb'.format(fileindex), 'wb') as f:
+        f.write(vb_data)
+    with timed('write'), atomic_open('output/{0}.splitdata'.format(fileindex), 'w') as f:
+        f.write(json.dumps(original_strides))
+    return(outputs + ['output/{0}.vb'.format(fileindex), 'output/{0}.splitdata'.format(fileindex)])
+
+# Anything that changes the merged output must be recorded here, so that cached outputs made with other
+# settings are not reused
+merge_settings = {'merge_version': 1, 'binary': False}
+manifest_filename = 'output/vb_merge_manifest.json'
+
+def draw_call_inputs(draw_call):
+    # Every input file that the output of a draw index depends on
+    return(draw_call_filenames(draw_call))
+
+def vb_content_key(draw_call, signatures):
+    # Digest of the contents of every vertex buffer slot file, text and binary.  Draw calls with the same key produce the same
+    # merged vertex buffer, whatever their draw index.
+    vb_files = [x[y] for x in vb_slots_of(draw_call) for y in ['txt', 'buf'] if x[y] is not None]
+    return(hashlib.sha1(' '.join([signatures[x]['sha1'] for x in vb_files]).encode()).hexdigest())
+
+def vb_candidate_key(draw_call):
+    # The vertex buffer hashes in the file names and the sizes of the slot files, which costs no reading.  Draw
+    # calls with the same vertex buffers have the same key, but the same key does not guarantee the same
+    # contents (a text dump only has the vertices that its draw call used), so it only picks the draw calls
+    # whose contents need to be compared with vb_content_key.
+    return(tuple([(x['slot'], draw_call['hashes'].get('vb' + str(x['slot'])),\
+        None if x['txt'] is None else os.path.getsize(x['txt']), None if x['buf'] is None else os.path.getsize(x['buf']))\
+        for x in vb_slots_of(draw_call)]))
+
+def index_signatures(draw_call, cached_entry = None, trace_memory = None):
+    # input_signatures of a draw call, or None if a file cannot be read (process_index will report it).  In a
+    # worker process, trace_memory is given (True or False) to collect its stats and return them as well.
+    if trace_memory is not None:
+        start_stats(trace_memory)
+    try:
+        with timed('scan'):
+            signatures = input_signatures(draw_call_inputs(draw_call), cached_entry)
+    except OSError:
+        signatures = None
+    return((signatures, take_stats() if trace_memory is not None else None))
+
+def link_vb_file_to_output(fileindex, draw_call, source_index, source_draw_call, materialize_method = 'hardlink'):
+    # Materialise the merged vertex buffer of a duplicate draw call from the already merged output of a draw
+    # call with identical vertex data (hardlinked where possible).  Returns the files written.
+    outputs = ['output/' + vb_filenames_of(draw_call)[0], 'output/{0}.splitdata'.format(fileindex)]
+    sources = ['output/' + vb_filenames_of(source_draw_call)[0], 'output/{0}.splitdata'.format(source_index)]
+    for i in range(len(outputs)):
+        if outputs[i] != sources[i]:
+            materialize(sources[i], outputs[i], materialize_method)
+    return(outputs)
+
+def process_index(fileindex, draw_call = None, cached_entry = None, settings = None, signatures = None, source = None,\
+        materialize_method = 'hardlink'):
+    # Copy the IB and merge the VBs for one draw index.  Returns (error, manifest entry, skipped).  Errors are
+    # returned as the traceback rather than raised, so that one bad buffer does not abort a whole batch.
+    # If cached_entry shows that the inputs and settings are unchanged, nothing is written.  If source is
+    # given as (fileindex, draw_call) of an identical, already merged vertex buffer, it is reused.
+    if draw_call is None:
+        draw_call = index_dump_directory('.')[fileindex]
+    with stats_file(fileindex):
+        try:
+            if signatures is None:
+                with timed('scan'):
+                    signatures = input_signatures(draw_call_inputs(draw_call), cached_entry)
+            if entry_is_current(cached_entry, signatures, settings):
+                return((None, cached_entry, True))
+            if settings is not None and settings.get('binary') == True:
+                outputs = merge_vb_file_to_binary_output(fileindex, draw_call, source[0] if source is not None else None,\
+                    materialize_method)
+            else:
+                outputs = copy_ib_file_to_output(fileindex, draw_call, materialize_method)
+                if source is None:
+                    outputs += merge_vb_file_to_output(fileindex, draw_call)
+                else:
+                    outputs += link_vb_file_to_output(fileindex, draw_call, source[0], source[1], materialize_method)
+        except Exception:
+            return((traceback.format_exc(), None, False))
+        count_files('bytes_read', draw_call_inputs(draw_call) if source is None else [draw_call['ib'], draw_call.get('ib_buf')])
+        count_files('bytes_written', outputs)
+    return((None, make_entry(signatures, settings, outputs), False))
+
+def process_index_with_stats(trace_memory, *arguments):
+    # process_index for a worker process, collecting its stats to be merged into the main process' stats
+    start_stats(trace_memory)
+    result = process_index(*arguments)
+    return((result, take_stats()))
+
+def process_indices(indices, draw_calls, jobs = 1, manifest = None, settings = None, dedupe = True,\
+        materialize_method = 'hardlink'):
+    # Process every draw index, spreading them over a pool of worker processes if jobs > 1.  Each draw index
+    # writes only its own output files, so the results do not depend on the order the workers finish in.
+    # If a manifest dict is given, unchanged draw indices are skipped and the manifest is updated in place.
+    # With dedupe, each distinct set of vertex buffer contents is merged only once, and draw calls that
+    # repeat it are linked to the first one's output.  Only draw calls that may repeat another one (see
+    # vb_candidate_key) have their files hashed up front, on the worker processes; the others are hashed by
+    # the worker that merges them.  Returns a summary dict: {'errors': {fileindex: error message}, 'skipped':
+    # number unchanged, 'merged': number merged, 'deduplicated': number linked}.
+    cached_entries = {x: manifest.get(x) if manifest is not None else None for x in indices}
+    signatures = {x: None for x in indices}
+    sources = {}
+    with (concurrent.futures.ProcessPoolExecutor(max_workers = jobs) if jobs > 1 else contextlib.nullcontext()) as executor:
+        results = process_indices_with(executor, jobs, indices, draw_calls, cached_entries, signatures, sources,\
+            settings, dedupe, materialize_method)
+    summary = {'errors': {}, 'skipped': 0, 'merged': 0, 'deduplicated': 0}
+    for fileindex in indices:
+        error, entry, skipped = results[fileindex]
+        if error is not None:
+            summary['errors'][fileindex] = error
+            if manifest is not None:
+                manifest.pop(fileindex, None)
+            continue
+        if manifest is not None:
+            manifest[fileindex] = entry
+        if skipped == True:
+            summary['skipped'] += 1
+        elif fileindex in sources:
+            summary['deduplicated'] += 1
+        else:
+            summary['merged'] += 1
+    return(summary)
+
+def process_indices_with(executor, jobs, indices, draw_calls, cached_entries, signatures, sources, settings, dedupe,\
+        materialize_method):
+    # The body of process_indices, with executor the process pool (None if jobs is 1).  Fills in signatures
+    # and sources, and returns {fileindex: result of process_index}.
+    trace_memory = tracemalloc.is_tracing() if stats_enabled() else None
+    if dedupe == True:
+        candidate_keys = {}
+        with timed('scan'):
+            for fileindex in indices:
+                try:
+                    candidate_keys[fileindex] = vb_candidate_key(draw_calls[fileindex])
+                except OSError:
+                    continue # The worker will report it
+        key_counts = collections.Counter(candidate_keys.values())
+        candidates = [x for x in indices if x in candidate_keys and key_counts[candidate_keys[x]] > 1]
+        if executor is not None and len(candidates) > 1:
+            candidate_signatures = executor.map(index_signatures, [draw_calls[x] for x in candidates],\
+                [cached_entries[x] for x in candidates], [trace_memory] * len(candidates),\
+                chunksize = max(1, len(candidates) // (jobs * 8)))
+        else:
+            candidate_signatures = map(index_signatures, [draw_calls[x] for x in candidates], [cached_entries[x] for x in candidates])
+        first_by_key = {}
+        for fileindex, (signature, worker_stats) in zip(candidates, candidate_signatures):
+            merge_stats(worker_stats)
+            if signature is None:
+                continue
+            signatures[fileindex] = signature
+            key = vb_content_key(draw_calls[fileindex], signature)
+            if key in first_by_key:
+                sources[fileindex] = first_by_key[key]
+            else:
+                first_by_key[key] = fileindex
+    unique_indices = [x for x in indices if not x in sources]
+    duplicate_indices = [x for x in indices if x in sources]
+    arguments = [unique_indices, [draw_calls[x] for x in unique_indices], [cached_entries[x] for x in unique_indices],\
+        [settings] * len(unique_indices), [signatures[x] for x in unique_indices], [None] * len(unique_indices),\
+        [materialize_method] * len(unique_indices)]
+    results = []
+    progress(0, len(indices))
+    if executor is not None and len(unique_indices) > 1:
+        if stats_enabled():
+            for result, worker_stats in executor.map(process_index_with_stats, [trace_memory] * len(unique_indices),\
+                    *arguments, chunksize = max(1, len(unique_indices) // (jobs * 8))):
+                merge_stats(worker_stats)
+                results.append(result)
+                progress(len(results), len(indices))
+        else:
+            results = list(executor.map(process_index, *arguments, chunksize = max(1, len(unique_indices) // (jobs * 8))))
+    else:
+        for result in map(process_index, *arguments):
+            results.append(result)
+            progress(len(results), len(indices))
+    results = dict(zip(unique_indices, results))
+    # Duplicates are linked once the buffer they repeat has been merged
+    for fileindex in duplicate_indices:
+        source_index = sources[fileindex]
+        if results[source_index][0] is not None:
+            results[fileindex] = (results[source_index][0], None, False)
+        else:
+            results[fileindex] = process_index(fileindex, draw_calls[fileindex], cached_entries[fileindex], settings,\
+                signatures[fileindex], (source_index, draw_calls[source_index]), materialize_method)
+        progress(len(results), len(indices))
+    return(results)
 
 # End of functions, begin main script
 
 if __name__ == "__main__":
-    # Set current directory
-    os.chdir(os.path.abspath(os.path.dirname(__file__)))
-
-    # Let's make an output directory, because otherwise we would have to delete / overwrite files
-    if not os.path.exists('output'): 
-        os.mkdir('output')
-
-    indices = retrieve_indices()
-    for i in range(len(indices)):
-        #print('Processing index ' + indices[i] + '...\n')
-        copy_ib_file_to_output(indices[i])
-        #print('  Copying IB file ' + indices[i] + '...\n')
-        merge_vb_file_to_output(indices[i])
-        #print('  Processing VB file ' + indices[i] + '...\n')
+    parser = argparse.ArgumentParser(description = 'Merge multi-slot vertex buffers in a 3dmigoto frame dump.')
+    add_filter_arguments(parser)
+    parser.add_argument('-j', '--jobs', type = int, default = 1, metavar = 'N', help = 'number of worker processes (0 = one per CPU)')
+    parser.add_argument('--force', action = 'store_true', help = 'merge every draw call, even if it is unchanged since the last run')
+    parser.add_argument('--binary', action = 'store_true', help = 'write raw .vb/.ib/.fmt buffers instead of text dumps')
+    add_materialize_argument(parser)
+    parser.add_argument('--no-dedupe', dest = 'dedupe', action = 'store_false', help = 'merge repeated vertex buffers separately instead of linking them')
+    add_stats_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented_run(args, 'vb_merge.py'):
+        # Set current directory
+        os.chdir(os.path.abspath(os.path.dirname(__file__)))
+
+        # Let's make an output directory, because otherwise we would have to delete / overwrite files
+        if not os.path.exists('output'): 
+            os.mkdir('output')
+
+        with timed('scan'):
+            draw_calls = index_dump_directory('.')
+        indices = filter_draw_calls_from_args(draw_calls, args)
+        manifest = load_manifest(manifest_filename) if not args.force else {}
+        summary = process_indices(indices, draw_calls, jobs = args.jobs if args.jobs > 0 else os.cpu_count(),\
+            manifest = manifest, settings = dict(merge_settings, binary = args.binary), dedupe = args.dedupe,\
+            materialize_method = args.materialize)
+        save_manifest(manifest, manifest_filename)
+        if summary['deduplicated'] > 0:
+            print('Merged ' + str(summary['merged']) + ' vertex buffers; ' + str(summary['deduplicated'])\
+                + ' repeated buffers were linked instead of merged.')
+        errors = summary['errors']
+        for fileindex in sorted(errors.keys()):
+            sys.stderr.write('Error processing index ' + fileindex + ':\n' + errors[fileindex] + '\n')
+        if len(errors) > 0:
+            sys.stderr.write(str(len(errors)) + ' of ' + str(len(indices)) + ' draw indices could not be merged.\n')
+            sys.exit(1)
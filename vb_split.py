@@ -5,20 +5,28 @@
 # with 3dmigoto if one doesn't already exist.  Has only been tested with TOCS4.
 # GitHub eArmada8/vbuffer_merge_split
 
-import glob, os, re, json
+import glob, os, re, sys, contextlib, json, traceback, tracemalloc, concurrent.futures, argparse
+from lib_stats import *
+from lib_deinterleave import *
+from lib_dumpbuf import open_buf
 
-def retrieve_meshes():
-    # Make a list of all mesh groups in the current folder, both fmt and vb files are necessary for processing
-    fmts = [x[:-4] for x in glob.glob('*fmt')]
-    vbs = [x[:-3] for x in glob.glob('*vb')]
+def retrieve_meshes(recursive = False):
+    # Make a list of all mesh groups in the current folder (and its subfolders if recursive, as relative paths),
+    # both fmt and vb files are necessary for processing
+    pattern = os.path.join('**', '') if recursive == True else ''
+    fmts = [x[:-4] for x in glob.glob(pattern + '*fmt', recursive = recursive)]
+    vbs = set([x[:-3] for x in glob.glob(pattern + '*vb', recursive = recursive)])
     return [value for value in fmts if value in vbs]
 
-def split_vb_file_and_make_ini_file(meshname):
-    #Take the raw combined buffer and split into individual raw buffers
+def split_vb_file_and_make_ini_file(meshname, stream = False, chunk_vertices = 65536):
+    #Take the raw combined buffer and split into individual raw buffers.  With stream, the combined buffer is
+    #memory-mapped and split chunk_vertices vertices at a time, so memory use does not depend on its size.
+    #meshname may include a folder; the ini file goes in the same folder and refers to the buffers by name.
+    meshpath, meshname = meshname, os.path.basename(meshname)
     
     #Determine the offsets used in the combined buffer by parsing the FMT file
     offsets = []
-    with open(meshname + '.fmt', 'r') as f:
+    with timed('parse'), open(meshpath + '.fmt', 'r') as f:
         for line in f:
             if line[0:6] == 'stride':
                 combined_stride = int(line[8:-1])
@@ -32,9 +40,9 @@ def split_vb_file_and_make_ini_file(meshname):
                 offsets.append(int(line[21:-1]))
 
     #Determine the strides to be used in the individual buffers
-    if os.path.exists(meshname + '.splitdata'):
+    if os.path.exists(meshpath + '.splitdata'):
         #Use custom data if available
-        with open(meshname + '.splitdata', 'r') as f:
+        with timed('parse'), open(meshpath + '.splitdata', 'r') as f:
             strides = json.loads(f.read())
         combined_stride = sum(strides)
         offsets = [0]
@@ -48,21 +56,31 @@ def split_vb_file_and_make_ini_file(meshname):
             else:
                 strides.append(offsets[i+1] - offsets[i])
    
-    #Read in the entire combined buffer
-    with open(meshname + '.vb', 'rb') as f:
-        vb_read_buffer = f.read()
-    
-    #Count the total number of vertices
-    vertex_count = int(len(vb_read_buffer)/combined_stride)
-    
-    #Write each individual vertex buffer file, one for each element
-    for vertex_group in range(len(strides)):
-        write_data = b''
-        for i in range(vertex_count):
-            start_index = i * combined_stride + offsets[vertex_group]
-            write_data = write_data + vb_read_buffer[start_index:start_index+strides[vertex_group]]
-        with open(meshname + '.vb' + str(vertex_group), 'wb') as f:
-            f.write(write_data)
+    if stream == True:
+        #Memory-map the combined buffer and write every individual vertex buffer file a chunk at a time
+        with timed('split'), open_buf(meshpath + '.vb') as vb_read_buffer, contextlib.ExitStack() as stack:
+            count('bytes_read', len(vb_read_buffer))
+            vertex_count = int(len(vb_read_buffer)/combined_stride)
+            count('vertices', vertex_count)
+            vb_files = [stack.enter_context(open(meshpath + '.vb' + str(vertex_group), 'wb')) for vertex_group in range(len(strides))]
+            count('bytes_written', deinterleave_to_files(vb_read_buffer, combined_stride, offsets, strides, vb_files, chunk_vertices, vertex_count))
+    else:
+        #Read in the entire combined buffer
+        with timed('parse'), open(meshpath + '.vb', 'rb') as f:
+            vb_read_buffer = f.read()
+        count('bytes_read', len(vb_read_buffer))
+        
+        #Count the total number of vertices
+        vertex_count = int(len(vb_read_buffer)/combined_stride)
+        count('vertices', vertex_count)
+        
+        #Write each individual vertex buffer file, one for each element
+        for vertex_group in range(len(strides)):
+            with timed('split'):
+                write_data = deinterleave_slot(vb_read_buffer, combined_stride, offsets[vertex_group], strides[vertex_group], vertex_count)
+            with timed('write'), open(meshpath + '.vb' + str(vertex_group), 'wb') as f:
+                f.write(write_data)
+            count('bytes_written', len(write_data))
     
     #Create the beginnings of an ini file
     ini_text = []
@@ -105,19 +123,81 @@ def split_vb_file_and_make_ini_file(meshname):
     ini_text.append(';allow_duplicate_hash=true\n')
     
     #Write ini file
-    if not os.path.exists(meshname + '.ini'):
-        with open(meshname + '.ini', 'w') as f:
+    if not os.path.exists(meshpath + '.ini'):
+        with timed('write'), open(meshpath + '.ini', 'w') as f:
             f.write("".join(ini_text))
+        count_files('bytes_written', [meshpath + '.ini'])
         
     return
 
+def split_mesh(meshname, stream = False, chunk_vertices = 65536):
+    # Split one mesh.  Returns None, or the error as a traceback rather than raising it, so that one bad mesh
+    # does not abort a whole batch.
+    with stats_file(meshname):
+        try:
+            count_files('bytes_read', [meshname + '.fmt', meshname + '.splitdata'])
+            split_vb_file_and_make_ini_file(meshname, stream, chunk_vertices)
+        except Exception:
+            return(traceback.format_exc())
+    return(None)
+
+def split_mesh_with_stats(trace_memory, *arguments):
+    # split_mesh for a worker process, collecting its stats to be merged into the main process' stats
+    start_stats(trace_memory)
+    result = split_mesh(*arguments)
+    return((result, take_stats()))
+
+def split_meshes(meshes, jobs = 1, stream = False, chunk_vertices = 65536):
+    # Split every mesh, several at a time if jobs > 1.  Each mesh writes only its own files, so they can be split
+    # in any order.  With NumPy the copying (and the file I/O) runs without the GIL, so threads are enough;
+    # otherwise the meshes are spread over worker processes.  Returns a dict of {meshname: error message}.
+    arguments = [meshes, [stream] * len(meshes), [chunk_vertices] * len(meshes)]
+    results = []
+    progress(0, len(meshes))
+    if jobs > 1 and len(meshes) > 1 and releases_gil == True:
+        with concurrent.futures.ThreadPoolExecutor(max_workers = jobs) as executor:
+            for result in executor.map(split_mesh, *arguments):
+                results.append(result)
+                progress(len(results), len(meshes))
+    elif jobs > 1 and len(meshes) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as executor:
+            chunksize = max(1, len(meshes) // (jobs * 8))
+            if stats_enabled():
+                for result, worker_stats in executor.map(split_mesh_with_stats, [tracemalloc.is_tracing()] * len(meshes),\
+                        *arguments, chunksize = chunksize):
+                    merge_stats(worker_stats)
+                    results.append(result)
+                    progress(len(results), len(meshes))
+            else:
+                results = list(executor.map(split_mesh, *arguments, chunksize = chunksize))
+    else:
+        for result in map(split_mesh, *arguments):
+            results.append(result)
+            progress(len(results), len(meshes))
+    return({meshes[i]: results[i] for i in range(len(meshes)) if results[i] is not None})
+
 # End of functions, begin main script
 
 if __name__ == "__main__":
-    # Set current directory
-    os.chdir(os.path.abspath(os.path.dirname(__file__)))
+    parser = argparse.ArgumentParser(description = 'Split Blender .vb exports into one buffer per 3dmigoto input slot, with a starter .ini file.')
+    parser.add_argument('folder', nargs = '?', help = 'folder of the exported meshes (default: the folder this script is in)')
+    parser.add_argument('-r', '--recursive', action = 'store_true', help = 'also split the meshes in every subfolder, e.g. of a whole mod')
+    parser.add_argument('-j', '--jobs', type = int, default = 1, metavar = 'N', help = 'number of meshes to split at once (0 = one per CPU)')
+    parser.add_argument('--stream', action = 'store_true', help = 'memory-map each .vb and split it a chunk at a time (for very large meshes)')
+    parser.add_argument('--chunk-vertices', type = int, default = 65536, metavar = 'N', help = 'vertices per chunk with --stream (default: 65536)')
+    add_stats_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented_run(args, 'vb_split.py'):
+        # Set current directory
+        os.chdir(os.path.abspath(args.folder) if args.folder is not None else os.path.abspath(os.path.dirname(__file__)))
 
-    meshes = retrieve_meshes()
-    for i in range(len(meshes)):
-        #print('Processing mesh ' + meshes[i] + '...\n')
-        split_vb_file_and_make_ini_file(meshes[i])
+        with timed('scan'):
+            meshes = retrieve_meshes(args.recursive)
+        errors = split_meshes(meshes, jobs = args.jobs if args.jobs > 0 else os.cpu_count(), stream = args.stream,\
+            chunk_vertices = args.chunk_vertices)
+        for meshname in sorted(errors.keys()):
+            sys.stderr.write('Error splitting ' + meshname + ':\n' + errors[meshname] + '\n')
+        if len(errors) > 0:
+            sys.stderr.write(str(len(errors)) + ' of ' + str(len(meshes)) + ' meshes could not be split.\n')
+            sys.exit(1)
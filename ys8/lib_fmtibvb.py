@@ -3,139 +3,333 @@
 #
 # GitHub eArmada8/gust_stuff
 
-import io, re, struct, json
+import os, re, sys, math, mmap, array, struct, json, contextlib, collections
+try:
+    import numpy
+except ImportError: # Optional, only needed for the column reader (read_vb_columns) and to write its columns
+    numpy = None
 
-# Currently only simple formats (8-, 16-, and 32-bit) are supported.  Floats must be 32-bit.
-# Attempting to read an unsupported format will return a raw bytes object.
-def unpack_dxgi_vector(f, stride, dxgi_format, e = '<'):
+# Each DXGI format is compiled once (per stride and byte order) into a codec, so that reading and writing
+# vertices does not have to parse the format string again for every vector.  A codec is a dict:
+#   'numtype': FLOAT, UINT, SINT, UNORM, SNORM, PACKED (see below) or UNSUPPORTED
+#   'struct': a struct.Struct of the whole vector, or None if the format is read and written as raw bytes
+#   'byte_order', 'type_code': the struct byte order and the struct code of one component (None for raw bytes)
+#   'components': number of components, 'bits': bits per component
+#   'float_max': the value that 1.0 is stored as for UNORM / SNORM formats, otherwise None
+#   'lut': for 8-bit UNORM / SNORM, the decoded value of every byte (indexed by the unsigned byte, so that a
+#          signed byte indexes it from the end), otherwise None
+#   'fields': for packed formats, whose components are bit fields of one 16- or 32-bit word (the struct),
+#             a list of (shift, mask, numtype, float_max, lut) per component, otherwise None
+#   'swizzle': for byte formats stored in another order than RGBA (e.g. B8G8R8A8) whose codec was asked for
+#              RGBA order (swizzle = True), the position of each component in memory (it is its own
+#              inverse), otherwise None.  By default components are in memory order, as named.
+#   'stride': size of the vector in bytes
+#   'dtype': the NumPy dtype of the vector (components x the struct type, one word for packed formats, or
+#            stride x uint8 for raw bytes), or None if NumPy is not installed
+dxgi_codecs = {}
+dxgi_struct_codes = {('FLOAT', 32): 'f', ('FLOAT', 16): 'e', ('UINT', 32): 'I', ('UINT', 16): 'H', ('UINT', 8): 'B',\
+    ('SINT', 32): 'i', ('SINT', 16): 'h', ('SINT', 8): 'b', ('UNORM', 32): 'I', ('UNORM', 16): 'H', ('UNORM', 8): 'B',\
+    ('SNORM', 32): 'i', ('SNORM', 16): 'h', ('SNORM', 8): 'b'}
+numpy_type_codes = {'f': 'f4', 'e': 'f2', 'I': 'u4', 'H': 'u2', 'B': 'u1', 'i': 'i4', 'h': 'i2', 'b': 'i1'}
+# Packed formats: the struct code of the word, and the (shift, bits, numtype) of each component in the order of
+# the name.  The first component in the name is in the lowest bits.  FLOAT fields are the 11- and 10-bit unsigned floats
+# (5-bit exponent) of R11G11B10_FLOAT.
+packed_dxgi_formats = {'R10G10B10A2_UNORM': ('I', [(0, 10, 'UNORM'), (10, 10, 'UNORM'), (20, 10, 'UNORM'), (30, 2, 'UNORM')]),\
+    'R10G10B10A2_UINT': ('I', [(0, 10, 'UINT'), (10, 10, 'UINT'), (20, 10, 'UINT'), (30, 2, 'UINT')]),\
+    'R11G11B10_FLOAT': ('I', [(0, 11, 'FLOAT'), (11, 11, 'FLOAT'), (22, 10, 'FLOAT')]),\
+    'D24_UNORM_S8_UINT': ('I', [(0, 24, 'UNORM'), (24, 8, 'UINT')]),\
+    'B5G6R5_UNORM': ('H', [(0, 5, 'UNORM'), (5, 6, 'UNORM'), (11, 5, 'UNORM')]),\
+    'B5G5R5A1_UNORM': ('H', [(0, 5, 'UNORM'), (5, 5, 'UNORM'), (10, 5, 'UNORM'), (15, 1, 'UNORM')]),\
+    'B4G4R4A4_UNORM': ('H', [(0, 4, 'UNORM'), (4, 4, 'UNORM'), (8, 4, 'UNORM'), (12, 4, 'UNORM')])}
+# Formats stored in BGR(A) order: the position of each RGBA component in the order of the name, used when a
+# codec is asked for RGBA order (swizzle = True)
+rgba_dxgi_swizzles = {'B8G8R8A8_UNORM': (2, 1, 0, 3), 'B8G8R8X8_UNORM': (2, 1, 0, 3), 'B5G6R5_UNORM': (2, 1, 0),\
+    'B5G5R5A1_UNORM': (2, 1, 0, 3), 'B4G4R4A4_UNORM': (2, 1, 0, 3)}
+
+def small_float_table(bits):
+    # The value of every bit pattern of an unsigned float with a 5-bit exponent (bias 15) and bits - 5 bits of
+    # mantissa, as used by R11G11B10_FLOAT
+    mantissa_bits = bits - 5
+    table = []
+    for x in range(2**bits):
+        exponent, mantissa = x >> mantissa_bits, x & ((1 << mantissa_bits) - 1)
+        if exponent == 0:
+            table.append(math.ldexp(mantissa, -14 - mantissa_bits))
+        elif exponent == 31:
+            table.append(math.inf if mantissa == 0 else math.nan)
+        else:
+            table.append(math.ldexp((1 << mantissa_bits) + mantissa, exponent - 15 - mantissa_bits))
+    return(tuple(table))
+
+def encode_small_float(x, bits):
+    # The nearest unsigned small float to x (ties to even).  Negative numbers become 0 and numbers too large
+    # for the format become its largest value; infinity and NaN are kept.
+    mantissa_bits = bits - 5
+    if x != x:
+        return((1 << bits) - 1)
+    if x <= 0:
+        return(0)
+    if x == math.inf:
+        return(31 << mantissa_bits)
+    exponent = math.frexp(x)[1] - 1
+    if exponent + 15 >= 1:
+        biased_exponent, mantissa = exponent + 15, round(math.ldexp(x, mantissa_bits - exponent)) - (1 << mantissa_bits)
+    else:
+        biased_exponent, mantissa = 0, round(math.ldexp(x, 14 + mantissa_bits))
+    if mantissa == 1 << mantissa_bits: # Rounded up to the next power of two
+        biased_exponent, mantissa = biased_exponent + 1, 0
+    if biased_exponent >= 31:
+        return((30 << mantissa_bits) | ((1 << mantissa_bits) - 1))
+    return((biased_exponent << mantissa_bits) | mantissa)
+
+def encode_small_float_array(x, bits):
+    # encode_small_float for a NumPy array, giving an int64 array
+    mantissa_bits = bits - 5
+    x = numpy.asarray(x, dtype = numpy.float64)
+    finite = numpy.isfinite(x) & (x > 0)
+    values = numpy.where(finite, x, 1.0)
+    exponent = numpy.frexp(values)[1] - 1
+    normal = exponent + 15 >= 1
+    mantissa = numpy.where(normal, numpy.rint(numpy.ldexp(values, mantissa_bits - exponent)) - (1 << mantissa_bits),\
+        numpy.rint(numpy.ldexp(values, 14 + mantissa_bits))).astype(numpy.int64)
+    biased_exponent = numpy.where(normal, exponent + 15, 0).astype(numpy.int64)
+    carry = mantissa == 1 << mantissa_bits
+    biased_exponent, mantissa = numpy.where(carry, biased_exponent + 1, biased_exponent), numpy.where(carry, 0, mantissa)
+    encoded = numpy.where(biased_exponent >= 31, (30 << mantissa_bits) | ((1 << mantissa_bits) - 1),\
+        (biased_exponent << mantissa_bits) | mantissa)
+    encoded = numpy.where(finite, encoded, 0)
+    encoded = numpy.where(x == math.inf, 31 << mantissa_bits, encoded)
+    return(numpy.where(numpy.isnan(x), (1 << bits) - 1, encoded))
+
+def compile_dxgi_codec(stride, dxgi_format, e = '<', swizzle = False):
+    # With swizzle, the components of formats in rgba_dxgi_swizzles are in RGBA order instead of memory order
     dxgi_format = dxgi_format.split('DXGI_FORMAT_')[-1]
+    if dxgi_format in packed_dxgi_formats:
+        type_code, fields = packed_dxgi_formats[dxgi_format]
+        if swizzle == True and dxgi_format in rgba_dxgi_swizzles:
+            fields = [fields[x] for x in rgba_dxgi_swizzles[dxgi_format]]
+        codec = {'numtype': 'PACKED', 'struct': None, 'byte_order': e, 'type_code': None, 'components': len(fields),\
+            'bits': None, 'float_max': None, 'lut': None, 'fields': None, 'swizzle': None, 'stride': stride, 'dtype': None}
+        if struct.calcsize(type_code) == stride:
+            codec['type_code'] = type_code
+            codec['struct'] = struct.Struct(e + type_code)
+            codec['fields'] = [(shift, (1 << bits) - 1, numtype, (1 << bits) - 1 if numtype == 'UNORM' else None,\
+                small_float_table(bits) if numtype == 'FLOAT' else None) for shift, bits, numtype in fields]
+            if numpy is not None:
+                codec['dtype'] = numpy.dtype((e + numpy_type_codes[type_code], (1,)))
+        elif numpy is not None:
+            codec['dtype'] = numpy.dtype((numpy.uint8, (max(stride, 0),)))
+        return(codec)
+    if swizzle == True and dxgi_format in rgba_dxgi_swizzles:
+        codec = dict(compile_dxgi_codec(stride, dxgi_format, e))
+        if codec['struct'] is not None:
+            codec['swizzle'] = rgba_dxgi_swizzles[dxgi_format]
+        return(codec)
     dxgi_format_split = dxgi_format.split('_')
+    vec_bits = 0
+    vec_elements = 0
     if len(dxgi_format_split) == 2:
         numtype = dxgi_format_split[1]
         vec_format = re.findall("[0-9]+",dxgi_format_split[0])
         if len(vec_format) > 0:
             vec_bits = int(vec_format[0])
             vec_elements = len(vec_format)
-        else:
-            vec_bits = 0
-            vec_elements = 0
     else:
         numtype = 'UNSUPPORTED'
+    codec = {'numtype': numtype, 'struct': None, 'byte_order': e, 'type_code': None, 'components': vec_elements,\
+        'bits': vec_bits, 'float_max': None, 'lut': None, 'fields': None, 'swizzle': None, 'stride': stride, 'dtype': None}
+    # Formats that are not supported, or do not fill the stride, are read and written as raw bytes
+    if (numtype, vec_bits) in dxgi_struct_codes and (vec_elements * vec_bits / 8 == stride):
+        codec['type_code'] = dxgi_struct_codes[(numtype, vec_bits)]
+        codec['struct'] = struct.Struct(e + str(vec_elements) + codec['type_code'])
+        if numtype == 'UNORM':
+            codec['float_max'] = ((2**vec_bits)-1)
+        elif numtype == 'SNORM':
+            codec['float_max'] = ((2**(vec_bits-1))-1)
+        if vec_bits == 8 and codec['float_max'] is not None:
+            codec['lut'] = tuple([(x - 256 if numtype == 'SNORM' and x > 127 else x) / codec['float_max'] for x in range(256)])
+        if numpy is not None:
+            codec['dtype'] = numpy.dtype((e + numpy_type_codes[dxgi_struct_codes[(numtype, vec_bits)]], (vec_elements,)))
+    elif numpy is not None:
+        codec['dtype'] = numpy.dtype((numpy.uint8, (max(stride, 0),)))
+    return(codec)
 
-    if numtype == 'FLOAT' and (vec_elements * vec_bits / 8 == stride):
-        if vec_bits == 32:
-            read = list(struct.unpack(e+str(vec_elements)+"f", f.read(stride)))
-        elif vec_bits == 16:
-            read = list(struct.unpack(e+str(vec_elements)+"e", f.read(stride)))
-    elif numtype == 'UINT' and (vec_elements * vec_bits / 8 == stride):
-        if vec_bits == 32:
-            read = list(struct.unpack(e+str(vec_elements)+"I", f.read(stride)))
-        elif vec_bits == 16:
-            read = list(struct.unpack(e+str(vec_elements)+"H", f.read(stride)))
-        elif vec_bits == 8:
-            read = list(struct.unpack(e+str(vec_elements)+"B", f.read(stride)))
-    elif numtype == "SINT" and (vec_elements * vec_bits / 8 == stride):
-        if vec_bits == 32:
-            read = list(struct.unpack(e+str(vec_elements)+"i", f.read(stride)))
-        elif vec_bits == 16:
-            read = list(struct.unpack(e+str(vec_elements)+"h", f.read(stride)))
-        elif vec_bits == 8:
-            read = list(struct.unpack(e+str(vec_elements)+"b", f.read(stride)))
-    elif numtype == "UNORM" and (vec_elements * vec_bits / 8 == stride):
-        # First read as integers
-        if vec_bits == 32:
-            read = list(struct.unpack(e+str(vec_elements)+"I", f.read(stride)))
-        elif vec_bits == 16:
-            read = list(struct.unpack(e+str(vec_elements)+"H", f.read(stride)))
-        elif vec_bits == 8:
-            read = list(struct.unpack(e+str(vec_elements)+"B", f.read(stride)))
-        # Convert to normalized floats
-        float_max = ((2**vec_bits)-1)
-        for i in range(len(read)):
-            read[i] = read[i] / float_max
-    elif numtype == "SNORM" and (vec_elements * vec_bits / 8 == stride):
-        # First read as integers
-        if vec_bits == 32:
-            read = list(struct.unpack(e+str(vec_elements)+"i", f.read(stride)))
-        elif vec_bits == 16:
-            read = list(struct.unpack(e+str(vec_elements)+"h", f.read(stride)))
-        elif vec_bits == 8:
-            read = list(struct.unpack(e+str(vec_elements)+"b", f.read(stride)))
+def dxgi_codec(stride, dxgi_format, e = '<', swizzle = False):
+    # The compiled codec of a format, from the registry
+    key = (stride, dxgi_format, e, swizzle)
+    if not key in dxgi_codecs:
+        dxgi_codecs[key] = compile_dxgi_codec(stride, dxgi_format, e, swizzle)
+    return(dxgi_codecs[key])
+
+def decode_packed_word(fields, word):
+    read = []
+    for shift, mask, numtype, float_max, lut in fields:
+        value = (word >> shift) & mask
+        read.append(lut[value] if lut is not None else (value / float_max if float_max is not None else value))
+    return(read)
+
+def encode_packed_word(fields, values):
+    if len(values) != len(fields):
+        raise ValueError('Expected ' + str(len(fields)) + ' components per vector')
+    word = 0
+    for (shift, mask, numtype, float_max, lut), x in zip(fields, values):
+        if numtype == 'UNORM':
+            value = int(round(min(max(x,0), 1) * float_max))
+        elif numtype == 'FLOAT':
+            value = encode_small_float(x, mask.bit_length())
+        else:
+            value = min(max(int(x), 0), mask)
+        word |= value << shift
+    return(word)
+
+def decode_dxgi_vector(codec, data, offset = 0):
+    # Decode one vector from data (bytes) at offset: a list of numbers, or raw bytes for unsupported formats
+    if codec['struct'] is None:
+        return(bytes(data[offset:offset + codec['stride']]))
+    read = codec['struct'].unpack_from(data, offset)
+    if codec['fields'] is not None:
+        return(decode_packed_word(codec['fields'], read[0]))
+    if codec['lut'] is not None:
+        lut = codec['lut']
+        read = [lut[x] for x in read]
+    elif codec['float_max'] is not None:
         # Convert to normalized floats
-        float_max = ((2**(vec_bits-1))-1)
-        for i in range(len(read)):
-            read[i] = read[i] / float_max
+        float_max = codec['float_max']
+        read = [x / float_max for x in read]
     else:
-        read = f.read(stride)
-    return (read)
+        read = list(read)
+    if codec['swizzle'] is not None:
+        read = [read[x] for x in codec['swizzle']]
+    return(read)
 
-def pack_dxgi_vector(f, data, stride, dxgi_format, e = '<'):
-    dxgi_format = dxgi_format.split('DXGI_FORMAT_')[-1]
-    dxgi_format_split = dxgi_format.split('_')
-    if len(dxgi_format_split) == 2:
-        numtype = dxgi_format_split[1]
-        vec_format = re.findall("[0-9]+",dxgi_format_split[0])
-        if len(vec_format) > 0:
-            vec_bits = int(vec_format[0])
-            vec_elements = len(vec_format)
-        else:
-            vec_bits = 0
-            vec_elements = 0
+def decode_dxgi_column(codec, values):
+    # Decode a whole column of vectors at once: values is the field of one element in a NumPy structured array
+    # of vertices (see get_vb_dtype), returned as a (vertices x components) array
+    if codec['struct'] is None:
+        return(values.copy())
+    if codec['fields'] is not None:
+        words = values[:, 0].astype(numpy.int64)
+        columns = []
+        for shift, mask, numtype, float_max, lut in codec['fields']:
+            field = (words >> shift) & mask
+            if lut is not None:
+                columns.append(numpy.asarray(lut)[field])
+            elif float_max is not None:
+                columns.append(field / float_max)
+            else:
+                columns.append(field)
+        return(numpy.stack(columns, axis = 1))
+    if codec['lut'] is not None:
+        read = numpy.asarray(codec['lut'])[values.view(numpy.uint8)]
+    elif codec['float_max'] is not None:
+        # Convert to normalized floats
+        read = values.astype(numpy.float64) / codec['float_max']
     else:
-        numtype = 'UNSUPPORTED'
+        read = values.copy()
+    if codec['swizzle'] is not None:
+        read = read[:, list(codec['swizzle'])]
+    return(read)
 
-    if numtype == 'FLOAT' and (vec_elements * vec_bits / 8 == stride):
-        for i in range(vec_elements):
-            if vec_bits == 32:
-                f.write(struct.pack(e+"f", data[i]))
-            elif vec_bits == 16:
-                f.write(struct.pack(e+"e", data[i]))
-    elif numtype == 'UINT' and (vec_elements * vec_bits / 8 == stride):
-        for i in range(vec_elements):
-            if vec_bits == 32:
-                f.write(struct.pack(e+"I", data[i]))
-            elif vec_bits == 16:
-                f.write(struct.pack(e+"H", data[i]))
-            elif vec_bits == 8:
-                f.write(struct.pack(e+"B", data[i]))
-    elif numtype == "SINT" and (vec_elements * vec_bits / 8 == stride):
-        for i in range(vec_elements):
-            if vec_bits == 32:
-                f.write(struct.pack(e+"i", data[i]))
-            elif vec_bits == 16:
-                f.write(struct.pack(e+"h", data[i]))
-            elif vec_bits == 8:
-                f.write(struct.pack(e+"b", data[i]))
-    elif numtype == 'UNORM' and (vec_elements * vec_bits / 8 == stride):
-        converted_data = []
-        for i in range(vec_elements):
-            #First convert back to unsigned integers, then pack
-            float_max = ((2**vec_bits)-1)
-            converted_data.append(int(round(min(max(data[i],0), 1) * float_max)))
-            if vec_bits == 32:
-                f.write(struct.pack(e+"I", converted_data[i]))
-            elif vec_bits == 16:
-                f.write(struct.pack(e+"H", converted_data[i]))
-            elif vec_bits == 8:
-                f.write(struct.pack(e+"B", converted_data[i]))
-    elif numtype == 'SNORM' and (vec_elements * vec_bits / 8 == stride):
-        converted_data = []
-        for i in range(vec_elements):
-            #First convert back to unsigned integers, then pack
-            float_max = ((2**(vec_bits-1))-1)
-            converted_data.append(int(round(min(max(data[i],-1), 1) * float_max)))
-            if vec_bits == 32:
-                f.write(struct.pack(e+"i", converted_data[i]))
-            elif vec_bits == 16:
-                f.write(struct.pack(e+"h", converted_data[i]))
-            elif vec_bits == 8:
-                f.write(struct.pack(e+"b", converted_data[i]))
+def encode_dxgi_vector(codec, data):
+    # Encode one vector (as returned by decode_dxgi_vector) to bytes
+    if codec['struct'] is None:
+        return(bytes(data))
+    values = data[0:codec['components']]
+    if codec['fields'] is not None:
+        return(codec['struct'].pack(encode_packed_word(codec['fields'], values)))
+    if codec['swizzle'] is not None:
+        values = [values[x] for x in codec['swizzle']]
+    if codec['numtype'] == 'UNORM':
+        #First convert back to unsigned integers, then pack
+        values = [int(round(min(max(x,0), 1) * codec['float_max'])) for x in values]
+    elif codec['numtype'] == 'SNORM':
+        values = [int(round(min(max(x,-1), 1) * codec['float_max'])) for x in values]
+    return(codec['struct'].pack(*values))
+
+def encode_dxgi_values(codec, values):
+    # Encode a flat list of components (any number of whole vectors, in memory order) to bytes with a single
+    # pack.  Not for packed formats, see encode_dxgi_column.
+    if codec['numtype'] == 'UNORM':
+        values = [int(round(min(max(x,0), 1) * codec['float_max'])) for x in values]
+    elif codec['numtype'] == 'SNORM':
+        values = [int(round(min(max(x,-1), 1) * codec['float_max'])) for x in values]
+    return(struct.pack(codec['byte_order'] + str(len(values)) + codec['type_code'], *values))
+
+def encode_dxgi_column(codec, vectors):
+    # Encode a whole column of vectors (a list as returned by decode_dxgi_vector, or an array from
+    # read_vb_stream_columns) to bytes, the same as encoding each vector and joining them
+    if codec['struct'] is None:
+        if numpy is not None and isinstance(vectors, numpy.ndarray):
+            return(numpy.ascontiguousarray(vectors, dtype = numpy.uint8).tobytes())
+        return(b''.join([bytes(x) for x in vectors]))
+    components = codec['components']
+    if numpy is not None and isinstance(vectors, numpy.ndarray):
+        values = (vectors[:, None] if vectors.ndim == 1 else vectors)[:, 0:components]
+        if values.shape[1] != components:
+            raise ValueError('Expected ' + str(components) + ' components per vector, got ' + str(values.shape[1]))
+        if codec['fields'] is not None:
+            words = numpy.zeros(len(values), dtype = numpy.int64)
+            for i in range(len(codec['fields'])):
+                shift, mask, numtype, float_max, lut = codec['fields'][i]
+                if numtype == 'UNORM':
+                    field = numpy.rint(numpy.clip(values[:, i], 0, 1) * float_max).astype(numpy.int64)
+                elif numtype == 'FLOAT':
+                    field = encode_small_float_array(values[:, i], mask.bit_length())
+                else:
+                    field = numpy.clip(values[:, i], 0, mask).astype(numpy.int64)
+                words |= field << shift
+            return(words.astype(codec['dtype'].base).tobytes())
+        if codec['swizzle'] is not None:
+            values = values[:, list(codec['swizzle'])]
+        if codec['numtype'] == 'UNORM':
+            values = numpy.round(numpy.clip(values, 0, 1) * codec['float_max'])
+        elif codec['numtype'] == 'SNORM':
+            values = numpy.round(numpy.clip(values, -1, 1) * codec['float_max'])
+        return(numpy.ascontiguousarray(values, dtype = codec['dtype'].base).tobytes())
+    if codec['fields'] is not None:
+        words = [encode_packed_word(codec['fields'], vector[0:components]) for vector in vectors]
+        return(struct.pack(codec['byte_order'] + str(len(words)) + codec['type_code'], *words))
+    if codec['swizzle'] is not None:
+        values = [vector[x] for vector in vectors for x in codec['swizzle']]
     else:
-        write = f.write(data)
+        values = [x for vector in vectors for x in vector[0:components]]
+    if len(values) != len(vectors) * components:
+        raise ValueError('Expected ' + str(components) + ' components per vector')
+    return(encode_dxgi_values(codec, values))
+
+def interleave_columns(columns, strides, vertex_count):
+    # Interleave encoded columns (vertex_count vectors of strides[i] bytes each) into one vertex buffer, in
+    # one preallocated buffer: a strided NumPy copy per column, or otherwise a slice assignment per byte
+    combined_stride = sum(strides)
+    vb_stream = bytearray(vertex_count * combined_stride)
+    if numpy is not None:
+        vertices = numpy.frombuffer(vb_stream, dtype = numpy.uint8).reshape(vertex_count, combined_stride)
+    position = 0
+    for i in range(len(columns)):
+        if numpy is not None:
+            vertices[:, position:position + strides[i]] = numpy.frombuffer(columns[i], dtype = numpy.uint8).reshape(vertex_count, strides[i])
+        else:
+            for j in range(strides[i]):
+                vb_stream[position + j::combined_stride] = columns[i][j::strides[i]]
+        position += strides[i]
+    return(vb_stream)
+
+# Simple formats (8-, 16-, and 32-bit components, floats must be 16- or 32-bit) and the packed formats above are
+# supported.  Attempting to read an unsupported format will return a raw bytes object.  Components are in the
+# order they are stored in (e.g. BGRA for B8G8R8A8_UNORM); with swizzle = True, the formats in
+# rgba_dxgi_swizzles are read and written in RGBA order instead.  The readers and writers below take the same
+# swizzle argument, so use the same setting to write back what was read.
+def unpack_dxgi_vector(f, stride, dxgi_format, e = '<', swizzle = False):
+    return (decode_dxgi_vector(dxgi_codec(stride, dxgi_format, e, swizzle), f.read(stride)))
+
+def pack_dxgi_vector(f, data, stride, dxgi_format, e = '<', swizzle = False):
+    f.write(encode_dxgi_vector(dxgi_codec(stride, dxgi_format, e, swizzle), data))
     return
 
 def get_stride_from_dxgi_format(dxgi_format):
     dxgi_format = dxgi_format.split('DXGI_FORMAT_')[-1]
+    if dxgi_format in packed_dxgi_formats:
+        return(struct.calcsize(packed_dxgi_formats[dxgi_format][0]))
     dxgi_format_split = dxgi_format.split('_')
     if len(dxgi_format_split) == 2:
         numtype = dxgi_format_split[1]
@@ -188,21 +382,68 @@ def write_fmt(fmt_struct, fmt_filename):
         f.write(output)
     return
 
+# Indices per primitive for the topologies whose index buffers are lists of primitives.  Strips, adjacency
+# and patch lists cannot be split into primitives this way, and are rejected rather than grouped in threes.
+topology_group_sizes = {'pointlist': 1, 'linelist': 2, 'trianglelist': 3}
+
+def get_topology_group_size(topology):
+    if not topology in topology_group_sizes:
+        raise ValueError('Unsupported topology ' + str(topology) + ', only ' + ', '.join(topology_group_sizes.keys())\
+            + ' index buffers can be read')
+    return(topology_group_sizes[topology])
+
+def read_ib_stream_indices(ib_stream, fmt_struct, e = '<'):
+    # All the indices of an R8_UINT, R16_UINT or R32_UINT index buffer, decoded at once: a NumPy array, or an
+    # array.array without NumPy.  A partial index at the end is ignored.
+    # Cheating a bit here, since all index buffers I've seen are single numbers, but fmt doesn't have a stride for IB
+    ib_stride = int(int(re.findall("[0-9]+", fmt_struct["format"])[0])/8)
+    codec = dxgi_codec(ib_stride, fmt_struct["format"], e)
+    if codec['numtype'] != 'UINT' or codec['components'] != 1 or codec['struct'] is None:
+        raise ValueError('Unsupported index buffer format ' + str(fmt_struct["format"]))
+    index_count = int(len(ib_stream) / ib_stride)
+    if numpy is not None:
+        return(numpy.frombuffer(ib_stream, dtype = codec['dtype'].base, count = index_count))
+    indices = array.array([x for x in 'BHILQ' if array.array(x).itemsize == ib_stride][0])
+    indices.frombytes(memoryview(ib_stream)[0:index_count * ib_stride])
+    if e != {'little': '<', 'big': '>'}[sys.byteorder]:
+        indices.byteswap()
+    return(indices)
+
+def read_ib_stream_array(ib_stream, fmt_struct, e = '<'):
+    # The primitives of an index buffer (per its "topology", trianglelist if there is none) decoded at once: an
+    # (N, 3) NumPy array of triangles (N x 2 for lines, N x 1 for points), or without NumPy a flat array.array
+    # of their indices.  Indices after the last whole primitive are dropped.
+    group_size = get_topology_group_size(fmt_struct.get("topology", "trianglelist"))
+    indices = read_ib_stream_indices(ib_stream, fmt_struct, e)
+    whole_primitives = len(indices) - len(indices) % group_size
+    if numpy is not None:
+        return(indices[0:whole_primitives].reshape(-1, group_size))
+    return(indices[0:whole_primitives])
+
+def read_ib_array(ib_filename, fmt_struct, e = '<'):
+    with open(ib_filename, 'rb') as f:
+        ib_stream = f.read()
+    return(read_ib_stream_array(ib_stream, fmt_struct, e))
+
 def read_ib_stream(ib_stream, fmt_struct, e = '<'):
+    # The index buffer as a list of primitives (lists of indices), grouped per its "topology" (trianglelist if
+    # there is none).  An incomplete primitive at the end is kept as a shorter list.
     ib_data = []
-    # Cheating a bit here, since all index buffers I've seen are single numbers, but fmt doesn't have a stride for IB
+    group_size = get_topology_group_size(fmt_struct.get("topology", "trianglelist"))
     ib_stride = int(int(re.findall("[0-9]+", fmt_struct["format"])[0])/8)
-    with io.BytesIO(ib_stream) as f:
-        length = f.seek(0,2)
-        f.seek(0)
-        vertex_num = 0
-        triangle = []
-        while f.tell() < length:
-            triangle.extend(unpack_dxgi_vector(f, ib_stride, fmt_struct["format"], e))
-            vertex_num += 1
-            if vertex_num % 3 == 0 or f.tell() == length:
-                ib_data.append(triangle)
-                triangle = []
+    codec = dxgi_codec(ib_stride, fmt_struct["format"], e)
+    if codec['numtype'] == 'UINT' and codec['components'] == 1 and codec['struct'] is not None:
+        indices = read_ib_stream_indices(ib_stream, fmt_struct, e).tolist()
+        return([indices[i:i + group_size] for i in range(0, len(indices), group_size)])
+    length = len(ib_stream)
+    vertex_num = 0
+    triangle = []
+    for offset in range(0, length, ib_stride):
+        triangle.extend(decode_dxgi_vector(codec, ib_stream, offset))
+        vertex_num += 1
+        if vertex_num % group_size == 0 or offset + ib_stride >= length:
+            ib_data.append(triangle)
+            triangle = []
     return(ib_data)
 
 def read_ib(ib_filename, fmt_struct, e = '<'):
@@ -213,9 +454,15 @@ def read_ib(ib_filename, fmt_struct, e = '<'):
 def write_ib_stream(ib_data, ib_stream, fmt_struct, e = '<'):
     # See above about cheating
     ib_stride = int(int(re.findall("[0-9]+", fmt_struct["format"])[0])/8)
-    for i in range(len(ib_data)):
-        for j in range(len(ib_data[i])):
-            pack_dxgi_vector(ib_stream, [ib_data[i][j]], ib_stride, fmt_struct["format"], e)
+    codec = dxgi_codec(ib_stride, fmt_struct["format"], e)
+    if codec['struct'] is not None and numpy is not None and isinstance(ib_data, numpy.ndarray):
+        ib_stream.write(encode_dxgi_column(codec, ib_data.reshape(-1)))
+    elif codec['struct'] is not None and isinstance(ib_data, array.array):
+        ib_stream.write(encode_dxgi_values(codec, ib_data.tolist()))
+    elif codec['struct'] is not None:
+        ib_stream.write(encode_dxgi_values(codec, [x for triangle in ib_data for x in triangle]))
+    else:
+        ib_stream.write(b''.join([encode_dxgi_vector(codec, [ib_data[i][j]]) for i in range(len(ib_data)) for j in range(len(ib_data[i]))]))
     return
 
 def write_ib(ib_data, ib_filename, fmt_struct, e = '<'):
@@ -223,72 +470,278 @@ def write_ib(ib_data, ib_filename, fmt_struct, e = '<'):
         write_ib_stream(ib_data, f, fmt_struct, e)
     return
 
-def read_vb_stream(vb_stream, fmt_struct, e = '<'):
+def get_buffer_strides(fmt_struct):
+    # The size of each element of the vertex buffer, from its offset to the next element's (or the stride)
+    buffer_strides = []
+    for i in range(len(fmt_struct["elements"])):
+        if i == len(fmt_struct["elements"]) - 1:
+            buffer_strides.append(int(fmt_struct["stride"]) - int(fmt_struct["elements"][i]["AlignedByteOffset"]))
+        else:
+            buffer_strides.append(int(fmt_struct["elements"][i+1]["AlignedByteOffset"]) \
+                - int(fmt_struct["elements"][i]["AlignedByteOffset"]))
+    return(buffer_strides)
+
+def get_vb_dtype(fmt_struct, e = '<'):
+    # A NumPy structured dtype of one vertex, with one field per element (named by its position in the list
+    # of elements, as semantics can repeat).  Requires NumPy.
+    buffer_strides = get_buffer_strides(fmt_struct)
+    return(numpy.dtype({'names': [str(i) for i in range(len(fmt_struct["elements"]))],\
+        'formats': [dxgi_codec(buffer_strides[i], fmt_struct["elements"][i]["Format"], e)['dtype'] for i in range(len(fmt_struct["elements"]))],\
+        'offsets': [int(x["AlignedByteOffset"]) for x in fmt_struct["elements"]], 'itemsize': int(fmt_struct["stride"])}))
+
+def read_vb_stream_columns(vb_stream, fmt_struct, e = '<', swizzle = False):
+    # Decode the whole vertex buffer at once into one NumPy array per element: the same list of dicts as
+    # read_vb_stream, but each "Buffer" is a (vertices x components) array, float64 for UNORM / SNORM, or
+    # (vertices x stride) uint8 for formats read as raw bytes.  Requires NumPy.
+    if numpy is None:
+        raise ImportError('read_vb_stream_columns requires NumPy')
+    buffer_strides = get_buffer_strides(fmt_struct)
+    vertices = numpy.frombuffer(vb_stream, dtype = get_vb_dtype(fmt_struct, e), count = int(len(vb_stream) / int(fmt_struct["stride"])))
     vb_data = []
-    with io.BytesIO(vb_stream) as f:
-        length = f.seek(0,2)
-        f.seek(0)
-        num_vertex = int(length / int(fmt_struct["stride"]))
-        buffer_strides = []
-        # Calculate individual buffer strides
-        for i in range(len(fmt_struct["elements"])):
-            if i == len(fmt_struct["elements"]) - 1:
-                buffer_strides.append(int(fmt_struct["stride"]) - int(fmt_struct["elements"][i]["AlignedByteOffset"]))
-            else:
-                buffer_strides.append(int(fmt_struct["elements"][i+1]["AlignedByteOffset"]) \
-                    - int(fmt_struct["elements"][i]["AlignedByteOffset"]))
-        # Read in the buffers
-        for i in range(len(fmt_struct["elements"])):
-            element = {}
-            element["SemanticName"] = fmt_struct["elements"][i]["SemanticName"]
-            element["SemanticIndex"] = fmt_struct["elements"][i]["SemanticIndex"]
-            element_buffer = []
-            for j in range(num_vertex):
-                f.seek(j * int(fmt_struct["stride"]) + int(fmt_struct["elements"][i]["AlignedByteOffset"]),0)
-                element_buffer.append(unpack_dxgi_vector(f, buffer_strides[i], fmt_struct["elements"][i]["Format"], e))
-            element["Buffer"] = element_buffer
-            vb_data.append(element)
+    for i in range(len(fmt_struct["elements"])):
+        element = {}
+        element["SemanticName"] = fmt_struct["elements"][i]["SemanticName"]
+        element["SemanticIndex"] = fmt_struct["elements"][i]["SemanticIndex"]
+        element["Buffer"] = decode_dxgi_column(dxgi_codec(buffer_strides[i], fmt_struct["elements"][i]["Format"], e, swizzle), vertices[str(i)])
+        vb_data.append(element)
     return(vb_data)
 
-def read_vb(vb_filename, fmt_struct, e = '<'):
+def read_vb_columns(vb_filename, fmt_struct, e = '<', swizzle = False):
     with open(vb_filename, 'rb') as f:
         vb_stream = f.read()
-    return(read_vb_stream(vb_stream, fmt_struct, e))
+    return(read_vb_stream_columns(vb_stream, fmt_struct, e, swizzle))
 
-def write_vb_stream(vb_data, vb_stream, fmt_struct, e = '<', interleave = True):
-    buffer_strides = []
-    # Calculate individual buffer strides
+def decode_vb_element(vb_stream, stride, offset, codec, start, stop, columns = False):
+    # Decode one element of vertices start to stop - 1 of an interleaved vertex buffer, without touching the
+    # other elements: as a NumPy array (as in read_vb_stream_columns) if columns is True, otherwise as lists
+    # (as in read_vb_stream), which NumPy also decodes when it is installed.
+    if columns == True or (numpy is not None and codec['struct'] is not None\
+            and not (codec['fields'] is not None and len(set([x[2] for x in codec['fields']])) > 1)):
+        if numpy is None:
+            raise ImportError('Decoding elements as columns requires NumPy')
+        values = numpy.frombuffer(vb_stream, dtype = numpy.dtype({'names': ['0'], 'formats': [codec['dtype']],\
+            'offsets': [offset], 'itemsize': stride}), count = stop - start, offset = start * stride)['0']
+        decoded = decode_dxgi_column(codec, values)
+        return(decoded if columns == True else decoded.tolist())
+    # Raw bytes, mixed fields (e.g. D24_UNORM_S8_UINT, which would share one float array) or no NumPy
+    return([decode_dxgi_vector(codec, vb_stream, j * stride + offset) for j in range(start, stop)])
+
+def read_vb_stream(vb_stream, fmt_struct, e = '<', swizzle = False):
+    # The vertex buffer as lists (one list per vertex, or bytes for formats read as raw bytes), which can be
+    # saved as JSON.  With NumPy each element is decoded as a column and then converted to lists.
+    vb_data = []
+    stride = int(fmt_struct["stride"])
+    num_vertex = int(len(vb_stream) / stride)
+    buffer_strides = get_buffer_strides(fmt_struct)
+    # Read in the buffers
     for i in range(len(fmt_struct["elements"])):
-        if i == len(fmt_struct["elements"]) - 1:
-            buffer_strides.append(int(fmt_struct["stride"]) - int(fmt_struct["elements"][i]["AlignedByteOffset"]))
+        element = {}
+        element["SemanticName"] = fmt_struct["elements"][i]["SemanticName"]
+        element["SemanticIndex"] = fmt_struct["elements"][i]["SemanticIndex"]
+        codec = dxgi_codec(buffer_strides[i], fmt_struct["elements"][i]["Format"], e, swizzle)
+        offset = int(fmt_struct["elements"][i]["AlignedByteOffset"])
+        element["Buffer"] = decode_vb_element(vb_stream, stride, offset, codec, 0, num_vertex)
+        vb_data.append(element)
+    return(vb_data)
+
+def read_vb(vb_filename, fmt_struct, e = '<', swizzle = False):
+    with open(vb_filename, 'rb') as f:
+        vb_stream = f.read()
+    return(read_vb_stream(vb_stream, fmt_struct, e, swizzle))
+
+# A lazy vertex buffer reader, for tools that only need some of the elements or vertices of a .vb (e.g.
+# POSITION for a bounding box): open_vb memory-maps the file, and read_vb_element / read_vb_range /
+# iter_vb_vertices decode only what they are asked for.  The reader is a dict:
+#   'stream': the vertex buffer (a read-only mmap, or any bytes-like object given to vb_reader)
+#   'fmt': the fmt_struct (from read_fmt), 'stride': its stride, 'vertex_count': number of whole vertices
+#   'elements': per element, a dict of its 'SemanticName', 'SemanticIndex', byte 'offset' and 'codec'
+#   'cache': decoded elements, keyed by (element, start, stop, columns), least recently used first
+#   'cache_bytes': the most bytes of the buffer whose decoded elements are kept, 'cached_bytes': how many are
+def vb_reader(vb_stream, fmt_struct, e = '<', cache_bytes = 67108864, swizzle = False):
+    stride = int(fmt_struct["stride"])
+    buffer_strides = get_buffer_strides(fmt_struct)
+    elements = [{'SemanticName': fmt_struct["elements"][i]["SemanticName"], 'SemanticIndex': fmt_struct["elements"][i]["SemanticIndex"],\
+        'offset': int(fmt_struct["elements"][i]["AlignedByteOffset"]),\
+        'codec': dxgi_codec(buffer_strides[i], fmt_struct["elements"][i]["Format"], e, swizzle)} for i in range(len(fmt_struct["elements"]))]
+    return({'stream': vb_stream, 'fmt': fmt_struct, 'stride': stride, 'vertex_count': int(len(vb_stream) / stride),\
+        'elements': elements, 'cache': collections.OrderedDict(), 'cache_bytes': cache_bytes, 'cached_bytes': 0})
+
+@contextlib.contextmanager
+def open_vb(vb_filename, fmt_struct, e = '<', cache_bytes = 67108864, swizzle = False):
+    # Memory-map a .vb file read-only and yield a reader for it (see vb_reader).  Empty files cannot be mapped,
+    # so they are read as b''.  Decoded elements are copies, so they can be kept after the file is closed.
+    with open(vb_filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield(vb_reader(b'', fmt_struct, e, cache_bytes, swizzle))
         else:
-            buffer_strides.append(int(fmt_struct["elements"][i+1]["AlignedByteOffset"]) \
-                - int(fmt_struct["elements"][i]["AlignedByteOffset"]))
-    if interleave == True:
+            with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as vb_stream:
+                reader = vb_reader(vb_stream, fmt_struct, e, cache_bytes, swizzle)
+                try:
+                    yield(reader)
+                finally:
+                    reader['cache'].clear()
+                    reader['cached_bytes'] = 0
+
+def find_vb_element(reader, element):
+    # The position of an element in the layout, given its position, its SemanticName (the first element with
+    # that name) or (SemanticName, SemanticIndex)
+    if isinstance(element, int):
+        if not -len(reader['elements']) <= element < len(reader['elements']):
+            raise IndexError('Element ' + str(element) + ' out of range')
+        return(element % len(reader['elements']))
+    name, index = element if isinstance(element, tuple) else (element, None)
+    for i in range(len(reader['elements'])):
+        if reader['elements'][i]['SemanticName'] == name and (index is None or str(reader['elements'][i]['SemanticIndex']) == str(index)):
+            return(i)
+    raise KeyError('No element ' + str(element) + ' in the vertex buffer')
+
+def read_vb_element(reader, element, start = 0, stop = None, columns = None):
+    # One element (see find_vb_element) of vertices start to stop - 1, which are slice indices (negative ones
+    # count from the end).  Decoded as a NumPy array if columns is True, or lists if it is False; by default
+    # arrays if NumPy is installed.  The result is cached and shared, so copy it before modifying it.
+    i = find_vb_element(reader, element)
+    start, stop, step = slice(start, stop).indices(reader['vertex_count'])
+    stop = max(start, stop)
+    columns = (numpy is not None) if columns is None else columns
+    cache = reader['cache']
+    for key in [(i, start, stop, columns), (i, 0, reader['vertex_count'], columns)]:
+        if key in cache:
+            cache.move_to_end(key)
+            return(cache[key] if key[1:3] == (start, stop) else cache[key][start:stop])
+    codec = reader['elements'][i]['codec']
+    decoded = decode_vb_element(reader['stream'], reader['stride'], reader['elements'][i]['offset'], codec, start, stop, columns)
+    size = (stop - start) * abs(codec['stride'])
+    if size <= reader['cache_bytes']:
+        cache[(i, start, stop, columns)] = decoded
+        reader['cached_bytes'] += size
+        while reader['cached_bytes'] > reader['cache_bytes']:
+            key, value = cache.popitem(last = False)
+            reader['cached_bytes'] -= (key[2] - key[1]) * abs(reader['elements'][key[0]]['codec']['stride'])
+    return(decoded)
+
+def read_vb_range(reader, start = 0, stop = None):
+    # Vertices start to stop - 1 (slice indices) as the lists of read_vb_stream, e.g. to write them out with
+    # write_vb_stream.  Not cached.
+    start, stop, step = slice(start, stop).indices(reader['vertex_count'])
+    stop = max(start, stop)
+    return([{'SemanticName': x['SemanticName'], 'SemanticIndex': x['SemanticIndex'],\
+        'Buffer': decode_vb_element(reader['stream'], reader['stride'], x['offset'], x['codec'], start, stop)}\
+        for x in reader['elements']])
+
+def iter_vb_vertices(reader, start = 0, stop = None, chunk_vertices = 4096):
+    # Yield vertices start to stop - 1 one at a time, each as a list of its elements' vectors, decoding
+    # chunk_vertices vertices at a time so that the whole buffer is never decoded at once.  Not cached.
+    start, stop, step = slice(start, stop).indices(reader['vertex_count'])
+    for chunk_start in range(start, stop, chunk_vertices):
+        chunk = [x["Buffer"] for x in read_vb_range(reader, chunk_start, min(chunk_start + chunk_vertices, stop))]
+        for j in range(len(chunk[0]) if len(chunk) > 0 else 0):
+            yield([x[j] for x in chunk])
+
+def write_vb_stream(vb_data, vb_stream, fmt_struct, e = '<', interleave = True, swizzle = False):
+    buffer_strides = get_buffer_strides(fmt_struct)
+    codecs = [dxgi_codec(buffer_strides[i], fmt_struct["elements"][i]["Format"], e, swizzle) for i in range(len(fmt_struct["elements"]))]
+    vertex_count = len(vb_data[0]["Buffer"])
+    # Encode each element's buffer in one go
+    columns = [encode_dxgi_column(codecs[i], vb_data[i]["Buffer"][0:vertex_count]) for i in range(len(fmt_struct["elements"]))]
+    if interleave == False:
+        # Write out the buffers, element by element.
+        vb_stream.write(b''.join(columns))
+    elif all([len(columns[i]) == vertex_count * buffer_strides[i] for i in range(len(columns))]):
         # Write out the buffers, vertex by vertex.
-        for j in range(len(vb_data[0]["Buffer"])):
-            for i in range(len(fmt_struct["elements"])):
-                pack_dxgi_vector(vb_stream, vb_data[i]["Buffer"][j], buffer_strides[i], fmt_struct["elements"][i]["Format"], e)
+        vb_stream.write(interleave_columns(columns, buffer_strides, vertex_count))
     else:
-        # Write out the buffers, element by element.
-        for i in range(len(fmt_struct["elements"])):
-            for j in range(len(vb_data[0]["Buffer"])):
-                pack_dxgi_vector(vb_stream, vb_data[i]["Buffer"][j], buffer_strides[i], fmt_struct["elements"][i]["Format"], e)
+        # Raw bytes that are not the size of their element can only be interleaved vertex by vertex
+        vb_stream.write(b''.join([encode_dxgi_vector(codecs[i], vb_data[i]["Buffer"][j])\
+            for j in range(vertex_count) for i in range(len(fmt_struct["elements"]))]))
     return
 
-def write_vb(vb_data, vb_filename, fmt_struct, e = '<', interleave = True):
+def write_vb(vb_data, vb_filename, fmt_struct, e = '<', interleave = True, swizzle = False):
     with open(vb_filename, 'wb') as f:
-        write_vb_stream(vb_data, f, fmt_struct, e=e, interleave=interleave)
+        write_vb_stream(vb_data, f, fmt_struct, e=e, interleave=interleave, swizzle=swizzle)
+    return
+
+# A compact binary mesh cache, to pass meshes between tools without going through JSON.  A mesh is a dict of
+# 'fmt' (fmt_struct), 'vb' (vb_data, lists or NumPy columns) and optionally 'ib' (ib_data, in any form that
+# write_ib_stream takes).  The file is:
+#   8 bytes: mesh_cache_magic, then the offset and length of the header (two little endian uint64), padded to 32
+#   each element's buffer as one column in its own format (as if written with interleave = False), then the
+#   index buffer as in a .ib file, each starting at a multiple of 16 bytes
+#   the header: JSON of {'fmt', 'byte_order', 'vertex_count', 'vb': [per element, its 'SemanticName',
+#   'SemanticIndex', 'Format', 'stride', 'offset' and 'nbytes'], 'ib': {'offset', 'nbytes'} or None}
+mesh_cache_magic = b'FMTIBVB1'
+
+def write_mesh_cache(mesh, filename, e = '<', swizzle = False):
+    if not filename[-8:] == '.meshbin':
+        filename += '.meshbin'
+    fmt_struct = mesh['fmt']
+    buffer_strides = get_buffer_strides(fmt_struct)
+    vertex_count = len(mesh['vb'][0]["Buffer"]) if len(mesh['vb']) > 0 else 0
+    header = {'fmt': fmt_struct, 'byte_order': e, 'vertex_count': vertex_count, 'vb': [], 'ib': None}
+    with open(filename, 'wb') as f:
+        f.write(mesh_cache_magic + bytes(24))
+        for i in range(len(fmt_struct["elements"])):
+            element = fmt_struct["elements"][i]
+            column = encode_dxgi_column(dxgi_codec(buffer_strides[i], element["Format"], e, swizzle), mesh['vb'][i]["Buffer"][0:vertex_count])
+            if buffer_strides[i] <= 0 or len(column) != vertex_count * buffer_strides[i]:
+                raise ValueError('Element ' + str(element["SemanticName"]) + str(element["SemanticIndex"]) + ' is not '\
+                    + str(buffer_strides[i]) + ' bytes per vertex, so it cannot be stored as a column')
+            f.write(bytes(-f.tell() % 16))
+            header['vb'].append({'SemanticName': element["SemanticName"], 'SemanticIndex': element["SemanticIndex"],\
+                'Format': element["Format"], 'stride': buffer_strides[i], 'offset': f.tell(), 'nbytes': len(column)})
+            f.write(column)
+        if mesh.get('ib') is not None:
+            f.write(bytes(-f.tell() % 16))
+            offset = f.tell()
+            write_ib_stream(mesh['ib'], f, fmt_struct, e)
+            header['ib'] = {'offset': offset, 'nbytes': f.tell() - offset}
+        header_offset = f.tell()
+        header_bytes = json.dumps(header).encode('utf-8')
+        f.write(header_bytes)
+        f.seek(len(mesh_cache_magic))
+        f.write(struct.pack('<QQ', header_offset, len(header_bytes)))
     return
 
-# The following two functions are purely for convenience
+def read_mesh_cache(filename, columns = None, swizzle = False):
+    # The mesh saved by write_mesh_cache, with each element as a NumPy array if columns is True, or lists (as
+    # from read_vb / read_ib) if it is False; by default arrays if NumPy is installed.  The file is memory-mapped,
+    # and the arrays of FLOAT / UINT / SINT elements and of the index buffer are read-only views of it rather
+    # than copies (the file stays mapped while they are in use).  Other formats are decoded.
+    columns = (numpy is not None) if columns is None else columns
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < 32:
+            raise ValueError(filename + ' is not a mesh cache')
+        buf = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    if buf[0:len(mesh_cache_magic)] != mesh_cache_magic:
+        raise ValueError(filename + ' is not a mesh cache')
+    header_offset, header_length = struct.unpack_from('<QQ', buf, len(mesh_cache_magic))
+    header = json.loads(buf[header_offset:header_offset + header_length].decode('utf-8'))
+    e = header['byte_order']
+    vertex_count = header['vertex_count']
+    vb_data = []
+    for x in header['vb']:
+        codec = dxgi_codec(x['stride'], x['Format'], e, swizzle)
+        blob = memoryview(buf)[x['offset']:x['offset'] + x['nbytes']]
+        if columns == True and numpy is not None and codec['numtype'] in ['FLOAT', 'UINT', 'SINT']\
+                and codec['struct'] is not None and codec['swizzle'] is None:
+            element_buffer = numpy.frombuffer(blob, dtype = codec['dtype'], count = vertex_count)
+        else:
+            element_buffer = decode_vb_element(blob, x['stride'], 0, codec, 0, vertex_count, columns)
+        vb_data.append({'SemanticName': x['SemanticName'], 'SemanticIndex': x['SemanticIndex'], 'Buffer': element_buffer})
+    mesh = {'fmt': header['fmt'], 'vb': vb_data}
+    if header['ib'] is not None:
+        blob = memoryview(buf)[header['ib']['offset']:header['ib']['offset'] + header['ib']['nbytes']]
+        mesh['ib'] = read_ib_stream_array(blob, header['fmt'], e) if columns == True else read_ib_stream(blob, header['fmt'], e)
+    return(mesh)
+
+# The following two functions are purely for convenience (and to inspect a mesh cache: write_struct_to_json
+# takes the columns of read_mesh_cache as well as lists)
 def read_struct_from_json(filename):
     with open(filename, 'r') as f:
         return(json.loads(f.read()))
 
 def write_struct_to_json(struct, filename):
-    if not filename[:-5] == '.json':
+    if not filename[-5:] == '.json':
         filename += '.json'
     with open(filename, "wb") as f:
-        f.write(json.dumps(struct, indent=4).encode("utf-8"))
+        f.write(json.dumps(struct, indent=4, default = lambda x: x.tolist()).encode("utf-8"))
     return
\ No newline at end of file
@@ -3,8 +3,12 @@
 #
 # GitHub eArmada8/vbuffer_merge_split
 
-import os, glob
+import os, sys, glob, argparse
 from lib_fmtibvb import *
+# The shared lib_*.py modules live in the parent folder, unless they have been copied alongside this script
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib_dumptokenizer import split_header, tokenize_columns, split_ib_header, parse_indices
+from lib_stats import *
 
 def retrieve_indices():
     # Make a list of all vertex buffer indices in the current folder
@@ -42,13 +46,8 @@ def make_fmt():
         'SemanticIndex': '0', 'Format': 'R8G8B8A8_UINT', 'InputSlot': '0',\
         'AlignedByteOffset': '84', 'InputSlotClass': 'per-vertex', 'InstanceDataStepRate': '0'}]})
 
-def strip_non_ascii(f, replace_with = 'x'):
-    new_char = ord(replace_with)
-    f.seek(0)
-    return(bytes([x if x < 128 else new_char for x in f.read()]))
-
 def read_ys8_vb(filename):
-    orig_offset = ['+000', '+016', '+032', '+036', '+040', '+044', '+048', '+064', '+080', '+084']
+    orig_offset = [0, 16, 32, 36, 40, 44, 48, 64, 80, 84]
     SemanticName = ['POSITION', 'UNKNOWN', 'NORMAL', 'UNKNOWN', 'COLOR',\
         'COLOR', 'TEXCOORD', 'TEXCOORD', 'BLENDWEIGHTS', 'BLENDINDICES']
     SemanticIndex = ['0', '0', '0', '1', '0', '1', '0', '1', '0', '0']
@@ -56,13 +55,21 @@ def read_ys8_vb(filename):
     Blanks = [[0,0,0,1], [0,0,0,0], [0,0,0,1], [0,0,0,0], [1,1,1,1], [0,0,0,1],\
         [0,0,0,0], [0,0,0,0], [0,0,0,0], [0,0,0,0]]
     with open(filename,'rb') as f:
-        output = strip_non_ascii(f)
-        lines = output.decode().replace('\r\n','\n').split('\n')
-    vertex_count = [int(x.split(': ')[1]) for x in lines if 'vertex count' in x][0]
-    if lines[0] == 'stride: 88':
+        data = f.read()
+    count('bytes_read', len(data))
+    # The dump is tokenized as bytes, so non-ascii semantic names do not need to be stripped before parsing
+    header, vertex_data_offset = split_header(data)
+    lines = header.replace(b'\r\n',b'\n').split(b'\n')
+    vertex_count = [int(x.split(b': ')[1]) for x in lines if b'vertex count' in x][0]
+    if lines[0] == b'stride: 88':
+        columns = tokenize_columns(data, vertex_data_offset)
+        values_by_offset = {x: [] for x in orig_offset}
+        for offset, value in zip(columns['offset'], columns['value']):
+            if offset in values_by_offset:
+                values_by_offset[offset].append(value)
         vb = []
         for i in range(len(orig_offset)):
-            raw_values = [x.split(': ')[1].split(', ') for x in lines if orig_offset[i] in x]
+            raw_values = [x.split(b', ') for x in values_by_offset[orig_offset[i]]]
             if len(raw_values) == 0: # Fill in the blanks, literally
                 raw_values = [Blanks[i] for x in range(vertex_count)]
             for j in range(len(raw_values)):
@@ -80,30 +87,48 @@ def read_ys8_vb(filename):
         return(False)
 
 def read_ys8_ib(filename):
+    # Returns (list of primitives, topology), or (False, topology) if the topology is not a list of primitives
     with open(filename,'r') as f:
-        lines = f.read().split('\n\n')[1].split('\n')
-    if lines[-1] == '':
-        lines = lines[:-1]
-    raw_values = [x.split(' ') for x in lines]
-    for i in range(len(raw_values)):
-        raw_values[i] = [int(x) for x in raw_values[i]]
-    return(raw_values)
+        ib_header, index_text = split_ib_header(f.read())
+    count_files('bytes_read', [filename])
+    topology = ib_header.get('topology', 'trianglelist')
+    if not topology in topology_group_sizes:
+        return(False, topology)
+    group_size = get_topology_group_size(topology)
+    indices = parse_indices(index_text)
+    return([indices[i:i + group_size] for i in range(0, len(indices), group_size)], topology)
 
 if __name__ == "__main__":
-    # Set current directory
-    os.chdir(os.path.abspath(os.path.dirname(__file__)))
+    parser = argparse.ArgumentParser(description = 'Convert Ys VIII stride 88 vertex buffer dumps into .fmt/.ib/.vb files.')
+    add_stats_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented_run(args, 'vb_ys8dump.py'):
+        # Set current directory
+        os.chdir(os.path.abspath(os.path.dirname(__file__)))
 
-    # Let's make an output directory, because otherwise we would have to delete / overwrite files
-    if not os.path.exists('output'): 
-        os.mkdir('output')
+        # Let's make an output directory, because otherwise we would have to delete / overwrite files
+        if not os.path.exists('output'): 
+            os.mkdir('output')
 
-    fmt = make_fmt()
-    indices = retrieve_indices()
-    for i in range(len(indices)):
-        vb = read_ys8_vb(glob.glob(indices[i] + '-vb*txt')[0])
-        if vb != False:
-            #print("Processing {0}...".format(indices[i]))
-            ib = read_ys8_ib(glob.glob(indices[i] + '-ib*txt')[0])
-            write_fmt(fmt, 'output/{0}.fmt'.format(indices[i]))
-            write_ib(ib, 'output/{0}.ib'.format(indices[i]), fmt)
-            write_vb(vb, 'output/{0}.vb'.format(indices[i]), fmt)
+        fmt = make_fmt()
+        with timed('scan'):
+            indices = retrieve_indices()
+        for i in range(len(indices)):
+            with stats_file(indices[i]):
+                with timed('parse'):
+                    vb = read_ys8_vb(glob.glob(indices[i] + '-vb*txt')[0])
+                if vb != False:
+                    #print("Processing {0}...".format(indices[i]))
+                    with timed('parse'):
+                        ib, topology = read_ys8_ib(glob.glob(indices[i] + '-ib*txt')[0])
+                    if ib == False:
+                        sys.stderr.write('Skipping {0}: {1} index buffers are not supported.\n'.format(indices[i], topology))
+                    else:
+                        count('vertices', len(vb[0]['Buffer']))
+                        with timed('write'):
+                            write_fmt(dict(fmt, topology = topology), 'output/{0}.fmt'.format(indices[i]))
+                            write_ib(ib, 'output/{0}.ib'.format(indices[i]), fmt)
+                            write_vb(vb, 'output/{0}.vb'.format(indices[i]), fmt)
+                        count_files('bytes_written', ['output/{0}.{1}'.format(indices[i], x) for x in ['fmt', 'ib', 'vb']])
+            progress(i + 1, len(indices))